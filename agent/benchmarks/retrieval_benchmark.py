@@ -0,0 +1,256 @@
+"""
+Offline benchmark for long-term memory retrieval backends.
+
+Fills a temporary SQLite database with synthetic memories (random vectors, no network) and,
+for each store size and backend, measures cold load time, warm query latency (p50/p99),
+store_memory throughput, peak RSS and how far RSS grows while querying. Each backend runs
+in its own process so peak RSS is not polluted by the others; the IVF build runs in yet
+another one, so the backend's peak RSS is that of loading and querying the index, and the
+build's is reported apart.
+
+    python -m benchmarks.retrieval_benchmark --sizes 1000 10000 --backends exact ivf int8
+
+A million 1536-dim memories need about 6 GB for the float32 matrix alone; pass
+--sizes 1000000 only on a machine with room for it.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue as queue_module
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from models import Base, LongTermMemory
+from engines.embedding_codec import encode_embedding
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_BACKENDS = ["exact", "ivf", "int8"]
+EMBEDDING_DIM = 1536
+INSERT_BATCH_SIZE = 10_000
+# Seconds one backend (or one IVF build) may run before it is killed and reported as failed
+DEFAULT_TIMEOUT = 1800
+
+
+def synthetic_vectors(start: int, count: int, dim: int) -> np.ndarray:
+    """Deterministic pseudo-random vectors: row i is always the same for a given dim."""
+    rng = np.random.default_rng(start)
+    return rng.standard_normal((count, dim), dtype=np.float32)
+
+
+def create_store(path: str, size: int, dim: int) -> None:
+    """Create a SQLite database at path holding `size` synthetic memories."""
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for start in range(0, size, INSERT_BATCH_SIZE):
+            count = min(INSERT_BATCH_SIZE, size - start)
+            rows = []
+            for offset, vector in enumerate(synthetic_vectors(start, count, dim)):
+                embedding_vector, embedding_dtype = encode_embedding(vector)
+                rows.append({
+                    "content": f"synthetic memory {start + offset}",
+                    "embedding": "",
+                    "embedding_vector": embedding_vector,
+                    "embedding_dtype": embedding_dtype,
+                    "significance_score": 7.0 + (start + offset) % 4,
+                })
+            conn.execute(insert(LongTermMemory), rows)
+    engine.dispose()
+
+
+def load_backend(backend: str, db, session_factory, workdir: str):
+    if backend == "exact":
+        from engines.memory_index import MemoryIndex
+        return MemoryIndex.from_db(db)
+    if backend == "ivf":
+        from engines.ann_index import IVFIndex
+        return IVFIndex(os.path.join(workdir, "agents.db.ivf"))
+    if backend == "int8":
+        from engines.quantized_index import Int8MemoryIndex
+        return Int8MemoryIndex.from_db(db, session_factory)
+    raise ValueError(f"Unknown backend {backend!r}")
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """Restart the peak peak_rss_mb reports from the current RSS; False where the kernel doesn't allow it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def build_ivf(db_path: str, workdir: str) -> Dict[str, float]:
+    """Write the IVF index files for a store. Meant to run in a fresh process."""
+    from engines.ann_index import IVFIndex
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    db = sessionmaker(bind=engine)()
+    start = time.perf_counter()
+    IVFIndex.rebuild_from_db(db, os.path.join(workdir, "agents.db.ivf"))
+    build_seconds = time.perf_counter() - start
+    db.close()
+    engine.dispose()
+    return {"build_s": build_seconds, "build_rss_mb": peak_rss_mb()}
+
+
+def run_backend(backend: str, db_path: str, workdir: str, dim: int, queries: int, inserts: int) -> Dict[str, float]:
+    """Measure one backend against an existing store (and, for ivf, built index). Meant to run in a fresh process."""
+    from engines.long_term_mem import store_memory
+    from engines.memory_index import set_memory_index
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = session_factory()
+
+    start = time.perf_counter()
+    index = load_backend(backend, db, session_factory, workdir)
+    cold_load_seconds = time.perf_counter() - start
+
+    query_vectors = np.random.default_rng(1).standard_normal((queries, dim), dtype=np.float32)
+    # Loading dominates the process peak, so the queries' own working memory is measured apart
+    load_rss_mb = peak_rss_mb()
+    query_start_rss_mb = peak_rss_mb() if reset_peak_rss() else None
+    latencies = []
+    for query in query_vectors:
+        start = time.perf_counter()
+        index.search(query, 5)
+        latencies.append((time.perf_counter() - start) * 1000)
+    query_rss_mb = peak_rss_mb() - query_start_rss_mb if query_start_rss_mb is not None else float("nan")
+
+    set_memory_index(index)
+    new_vectors = np.random.default_rng(2).standard_normal((inserts, dim), dtype=np.float32)
+    start = time.perf_counter()
+    for i, vector in enumerate(new_vectors):
+        store_memory(db, f"benchmark insert {i}", vector.tolist(), 8.0)
+    insert_seconds = time.perf_counter() - start
+
+    db.close()
+    engine.dispose()
+    return {
+        "cold_load_s": cold_load_seconds,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99)),
+        "inserts_per_s": inserts / insert_seconds if insert_seconds else 0.0,
+        "query_rss_mb": query_rss_mb,
+        "peak_rss_mb": max(load_rss_mb, peak_rss_mb()),
+    }
+
+
+def _worker(queue, target, *args):
+    try:
+        queue.put(target(*args))
+    except Exception as e:
+        queue.put({"error": str(e)})
+
+
+def run_isolated(target, *args, timeout: float = DEFAULT_TIMEOUT) -> Dict[str, float]:
+    """
+    Run target(*args) in a fresh process and return its result. A worker that dies without
+    answering (e.g. OOM-killed) or outlives `timeout` is reported as an error instead of
+    hanging the run.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_worker, args=(queue, target, *args))
+    process.start()
+    deadline = time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except queue_module.Empty:
+            if not process.is_alive():
+                # It may have put its result just before exiting
+                try:
+                    result = queue.get(timeout=1)
+                except queue_module.Empty:
+                    result = {"error": f"worker exited with code {process.exitcode} without a result"}
+            elif time.monotonic() > deadline:
+                process.kill()
+                result = {"error": f"worker timed out after {timeout:.0f}s"}
+    process.join()
+    return result
+
+
+def run_benchmark(sizes: List[int], backends: List[str], dim: int, queries: int, inserts: int, timeout: float = DEFAULT_TIMEOUT) -> List[Dict]:
+    results = []
+    for size in sizes:
+        workdir = tempfile.mkdtemp(prefix="retrieval_benchmark_")
+        try:
+            db_path = os.path.join(workdir, "agents.db")
+            start = time.perf_counter()
+            create_store(db_path, size, dim)
+            print(f"Created store with {size} memories in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+            # Every backend starts from the same store, without the previous backend's inserts
+            pristine_path = db_path + ".pristine"
+            shutil.copyfile(db_path, pristine_path)
+            for backend in backends:
+                shutil.copyfile(pristine_path, db_path)
+                build = {"build_s": 0.0, "build_rss_mb": 0.0}
+                if backend == "ivf":
+                    # Building the IVF files is a one-off; cold load is opening the memory-mapped index
+                    build = run_isolated(build_ivf, db_path, workdir, timeout=timeout)
+                result = build if "error" in build else {**build, **run_isolated(
+                    run_backend, backend, db_path, workdir, dim, queries, inserts, timeout=timeout
+                )}
+                results.append({"size": size, "backend": backend, **result})
+                print(f"  {backend}: {result}", file=sys.stderr)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def format_table(results: List[Dict]) -> str:
+    columns = [
+        "size", "backend", "build_s", "build_rss_mb", "cold_load_s", "query_p50_ms", "query_p99_ms", "inserts_per_s", "query_rss_mb",
+        "peak_rss_mb",
+    ]
+    lines = ["  ".join(f"{column:>14}" for column in columns)]
+    for row in results:
+        if "error" in row:
+            lines.append(f"{row['size']:>14}  {row['backend']:>14}  error: {row['error']}")
+            continue
+        lines.append("  ".join(
+            f"{row[column]:>14.3f}" if isinstance(row[column], float) else f"{row[column]:>14}"
+            for column in columns
+        ))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark long-term memory retrieval backends on synthetic stores.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--backends", nargs="+", default=DEFAULT_BACKENDS, choices=DEFAULT_BACKENDS)
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--inserts", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Seconds each backend may run")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.backends, args.dim, args.queries, args.inserts, args.timeout)
+    print(format_table(results))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
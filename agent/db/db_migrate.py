@@ -0,0 +1,161 @@
+from typing import Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine
+from models import Base
+from db.db_setup import engine
+from engines.embedding_codec import encode_embedding, parse_embedding
+
+MIGRATION_BATCH_SIZE = 500
+
+
+def add_missing_columns(db_engine: Engine, table: str, columns: dict[str, str]) -> None:
+    """Add columns (name -> SQL type) that an older database file does not have yet."""
+    existing = {column["name"] for column in inspect(db_engine).get_columns(table)}
+    with db_engine.begin() as conn:
+        for name, sql_type in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}"))
+                print(f"Added column {table}.{name}")
+
+
+def migrate_embeddings_to_binary(
+    db_engine: Engine = engine, batch_size: int = MIGRATION_BATCH_SIZE, dtype: Optional[str] = None
+) -> int:
+    """
+    Convert long_term_memories rows from the legacy text embedding to the binary column.
+
+    Runs in batches and is safe to re-run: only rows without embedding_vector are touched,
+    and the legacy text is cleared once the bytes are written. Returns the number of rows converted.
+    """
+    if not inspect(db_engine).has_table("long_term_memories"):
+        return 0
+
+    add_missing_columns(db_engine, "long_term_memories", {
+        "embedding_vector": "BLOB",
+        "embedding_dtype": "VARCHAR",
+    })
+
+    converted = 0
+    while True:
+        with db_engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT id, embedding FROM long_term_memories "
+                    "WHERE embedding_vector IS NULL AND embedding != '' LIMIT :limit"
+                ),
+                {"limit": batch_size},
+            ).all()
+            if not rows:
+                break
+
+            updates = []
+            for row in rows:
+                vector, vector_dtype = encode_embedding(parse_embedding(row.embedding), dtype)
+                updates.append({"id": row.id, "vector": vector, "dtype": vector_dtype})
+            conn.execute(
+                text(
+                    "UPDATE long_term_memories SET embedding_vector = :vector, "
+                    "embedding_dtype = :dtype, embedding = '' WHERE id = :id"
+                ),
+                updates,
+            )
+        converted += len(rows)
+        print(f"Converted {converted} long-term memory embeddings to binary")
+
+    return converted
+
+
+MEMORY_FTS_TABLE = "long_term_memories_fts"
+
+
+def ensure_memory_fts(db_engine: Engine = engine) -> bool:
+    """
+    Create the FTS5 mirror of long_term_memories.content and the triggers that keep it in sync.
+
+    Usernames, $tickers and wallet addresses are kept as single tokens. Returns False if this
+    SQLite build has no FTS5, in which case hybrid retrieval falls back to vector scoring.
+    """
+    if not inspect(db_engine).has_table("long_term_memories"):
+        return False
+    if inspect(db_engine).has_table(MEMORY_FTS_TABLE):
+        return True
+
+    try:
+        with db_engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE {MEMORY_FTS_TABLE} USING fts5("
+                "content, content='long_term_memories', content_rowid='id', "
+                "tokenize=\"unicode61 tokenchars '_@$'\")"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS long_term_memories_fts_insert AFTER INSERT ON long_term_memories BEGIN "
+                f"INSERT INTO {MEMORY_FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS long_term_memories_fts_delete AFTER DELETE ON long_term_memories BEGIN "
+                f"INSERT INTO {MEMORY_FTS_TABLE}({MEMORY_FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS long_term_memories_fts_update AFTER UPDATE OF content ON long_term_memories BEGIN "
+                f"INSERT INTO {MEMORY_FTS_TABLE}({MEMORY_FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+                f"INSERT INTO {MEMORY_FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+            ))
+            # Index rows that existed before the table was created
+            conn.execute(text(f"INSERT INTO {MEMORY_FTS_TABLE}({MEMORY_FTS_TABLE}) VALUES ('rebuild')"))
+    except OperationalError as e:
+        print(f"Full-text search unavailable, skipping {MEMORY_FTS_TABLE}: {e}")
+        return False
+
+    print(f"Created {MEMORY_FTS_TABLE} full-text index")
+    return True
+
+
+def ensure_indexes(db_engine: Engine = engine) -> None:
+    """
+    Add the indexes that files created before they were declared on the models are missing.
+
+    tweet_posts used to get a row for every id seen on every run, so duplicates are removed
+    (keeping the oldest row) before its unique index is built. Safe to re-run.
+    """
+    inspector = inspect(db_engine)
+    if inspector.has_table("tweet_posts"):
+        existing = {index["name"] for index in inspector.get_indexes("tweet_posts")}
+        if "ix_tweet_posts_tweet_id" not in existing:
+            with db_engine.begin() as conn:
+                removed = conn.execute(text(
+                    "DELETE FROM tweet_posts WHERE id NOT IN (SELECT MIN(id) FROM tweet_posts GROUP BY tweet_id)"
+                )).rowcount
+                conn.execute(text("CREATE UNIQUE INDEX ix_tweet_posts_tweet_id ON tweet_posts (tweet_id)"))
+            print(f"Removed {removed} duplicate tweet ids and indexed tweet_posts.tweet_id")
+
+    if inspector.has_table("posts"):
+        existing = {index["name"] for index in inspector.get_indexes("posts")}
+        if "ix_posts_created_at" not in existing:
+            with db_engine.begin() as conn:
+                conn.execute(text("CREATE INDEX ix_posts_created_at ON posts (created_at)"))
+            print("Indexed posts.created_at")
+
+
+def vacuum(db_engine: Engine = engine) -> None:
+    """Rebuild the database file to give back space freed by a migration."""
+    with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+
+
+def migrate_database(db_engine: Engine = engine) -> None:
+    """Bring an existing database file up to date with the current models."""
+    # Creates tables added since the file was made; existing tables are left alone
+    Base.metadata.create_all(bind=db_engine)
+    if migrate_embeddings_to_binary(db_engine) > 0:
+        vacuum(db_engine)
+    ensure_memory_fts(db_engine)
+    ensure_indexes(db_engine)
+    # Refresh the query planner's statistics where they are stale
+    with db_engine.begin() as conn:
+        conn.execute(text("PRAGMA optimize"))
+
+
+if __name__ == "__main__":
+    migrate_database()
+    print("Database migrated successfully.")
@@ -2,10 +2,11 @@ import os
 import random
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from openai import OpenAI
 from dotenv import load_dotenv
 from models import User, Post, Comment, Like, LongTermMemory
 from db.db_setup import SessionLocal
+from engines import long_term_mem
+from engines.embedding_codec import encode_embedding
 
 # Load environment variables
 load_dotenv()
@@ -33,14 +34,9 @@ def load_example_content(filename: str = "examples.txt") -> list[str]:
         print("Looking for file in:", current_dir)
         raise
 
-def create_embedding(text: str) -> list[float]:
-    """Create embedding using OpenAI API."""
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+def create_embeddings(texts: list[str]) -> list[list[float]]:
+    """Create embeddings using OpenAI API in batched, cached requests."""
+    return long_term_mem.create_embeddings(texts, os.getenv('OPENAI_API_KEY'))
 
 def add_users(db: Session, examples: list[str]) -> None:
     """Add users to the database if they do not exist."""
@@ -104,11 +100,14 @@ def add_long_term_memories(db: Session, remaining_examples: list[str]) -> None:
         num_memories = min(MAX_MEMORIES, len(remaining_examples))
         memory_examples = random.sample(remaining_examples, num_memories)
 
-        for content in memory_examples:
-            embedding = create_embedding(content)
+        embeddings = create_embeddings(memory_examples)
+        for content, embedding in zip(memory_examples, embeddings):
+            embedding_vector, embedding_dtype = encode_embedding(embedding)
             memory = LongTermMemory(
                 content=content,
-                embedding=str(embedding),
+                embedding="",
+                embedding_vector=embedding_vector,
+                embedding_dtype=embedding_dtype,
                 significance_score=random.uniform(7.0, 10.0)
             )
             db.add(memory)
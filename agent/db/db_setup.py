@@ -1,6 +1,8 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from models import Base
 
 # Database URL
@@ -9,8 +11,49 @@ os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+# "performance" applies SQLITE_PRAGMAS to every connection; "default" leaves SQLite's own settings
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "performance")
+# How long a connection waits on another writer's lock before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Connections kept open, plus how many more may be opened under load (the stages run in threads)
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_MAX_OVERFLOW = int(os.getenv("SQLITE_MAX_OVERFLOW", "10"))
+SQLITE_PRAGMAS = {
+    # Readers don't block the writer and vice versa; commits append to the log instead of rewriting pages
+    "journal_mode": "WAL",
+    # In WAL mode this only fsyncs at checkpoints: a power cut can lose the last commits, never corrupt the file
+    "synchronous": "NORMAL",
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative values are KiB: a 64 MiB page cache per connection
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "temp_store": "MEMORY",
+}
+
+
+def apply_sqlite_profile(db_engine: Engine, profile: str = SQLITE_PROFILE) -> Engine:
+    """Run the profile's pragmas on every new connection the engine opens."""
+    if profile != "performance":
+        return db_engine
+
+    @event.listens_for(db_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return db_engine
+
+
 # Create engine with appropriate arguments
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+engine = apply_sqlite_profile(create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    poolclass=QueuePool,
+    pool_size=SQLITE_POOL_SIZE,
+    max_overflow=SQLITE_MAX_OVERFLOW,
+))
 
 # Create SessionLocal factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,363 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db.db_setup import DB_PATH
+from models import LongTermMemory
+from engines.embedding_codec import memory_embedding
+from engines.memory_index import MemoryIndex, normalize, top_k_indices
+
+# IVF-flat index files live in a directory next to agents.db
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", f"{DB_PATH}.ivf")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_KMEANS_ITERATIONS = 20
+ANN_KMEANS_SAMPLE = 50_000
+# Rebuild once this share of the stored entries (base rows and delta records) is tombstoned
+ANN_COMPACT_TOMBSTONE_FRACTION = float(os.getenv("ANN_COMPACT_TOMBSTONE_FRACTION", "0.2"))
+
+
+def default_nlist(num_vectors: int) -> int:
+    """Rule of thumb for the number of inverted lists: about 4 * sqrt(n)."""
+    return max(1, min(num_vectors, int(4 * np.sqrt(num_vectors))))
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = ANN_KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on (a sample of) normalized vectors."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > ANN_KMEANS_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), ANN_KMEANS_SAMPLE, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = ~np.bincount(assignments, minlength=nlist).astype(bool)
+        # Re-seed empty lists from random points so every list stays useful
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65_536) -> np.ndarray:
+    """Assign each vector to its closest centroid, in chunks to bound memory."""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    Persistent IVF-flat approximate nearest-neighbour index.
+
+    Vectors are clustered with spherical k-means and stored contiguously per inverted list,
+    so a query scores the centroids, then only the nprobe closest lists. The base files are
+    memory-mapped; memories added after the last rebuild go to an append-only delta file that
+    is always searched exhaustively, and deletions go to a tombstone file.
+
+    A tombstone records the id and how many delta records existed when it was written. It
+    hides every base entry with that id and only the delta records before it, so an id that
+    SQLite hands out again after a delete is live in the delta but never in the base files.
+    Each list's search over-fetches by exactly the number of its entries that are hidden, and
+    the index is rebuilt once ANN_COMPACT_TOMBSTONE_FRACTION of what it stores is dead.
+    """
+
+    def __init__(self, path: str = ANN_INDEX_DIR, nprobe: int = ANN_NPROBE):
+        self.path = path
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.dim: Optional[int] = meta["dim"]
+
+        if meta["size"] > 0:
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.offsets = np.load(os.path.join(path, "offsets.npy"))
+            self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        else:
+            self.centroids = np.empty((0, self.dim or 0), dtype=np.float32)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+            self.ids = np.empty(0, dtype=np.int64)
+
+        records = None
+        if self.dim is not None and os.path.exists(self._delta_path):
+            records = np.fromfile(self._delta_path, dtype=self._delta_dtype)
+        self._delta_records = 0 if records is None else len(records)
+
+        # id -> number of delta records when it was last deleted
+        self._deleted = {}
+        if os.path.exists(self._deleted_path):
+            for memory_id, position in np.fromfile(self._deleted_path, dtype=self._tombstone_dtype).tolist():
+                self._deleted[memory_id] = max(position, self._deleted.get(memory_id, 0))
+        # Base entries hidden by a tombstone, per inverted list
+        self._hidden_per_list = self._count_per_list(self._deleted)
+
+        self._delta = MemoryIndex(dim=self.dim)
+        if records is not None:
+            live = np.array([
+                position >= self._deleted.get(memory_id, 0) for position, memory_id in enumerate(records["id"].tolist())
+            ], dtype=bool)
+            self._delta.add_many(records["id"][live], records["vector"][live])
+
+    @property
+    def _delta_path(self) -> str:
+        return os.path.join(self.path, "delta.bin")
+
+    @property
+    def _deleted_path(self) -> str:
+        return os.path.join(self.path, "tombstones.bin")
+
+    @property
+    def _tombstone_dtype(self) -> np.dtype:
+        return np.dtype([("id", "<i8"), ("delta_records", "<i8")])
+
+    @property
+    def _delta_dtype(self) -> np.dtype:
+        return np.dtype([("id", "<i8"), ("vector", "<f4", (self.dim,))])
+
+    def _count_per_list(self, ids) -> np.ndarray:
+        """How many base entries of each inverted list carry one of these ids."""
+        counts = np.zeros(len(self.offsets) - 1, dtype=np.int64)
+        if len(self.ids) and ids:
+            positions = np.flatnonzero(np.isin(np.asarray(self.ids), np.fromiter(ids, dtype=np.int64, count=len(ids))))
+            np.add.at(counts, np.searchsorted(self.offsets, positions, side="right") - 1, 1)
+        return counts
+
+    def tombstone_fraction(self) -> float:
+        """Share of the stored base rows and delta records that are hidden by tombstones."""
+        stored = len(self.ids) + self._delta_records
+        dead = int(self._hidden_per_list.sum()) + self._delta_records - len(self._delta)
+        return dead / stored if stored else 0.0
+
+    def compacted(self, db: Session) -> "IVFIndex":
+        """This index, or a fresh rebuild from the database once tombstones pass ANN_COMPACT_TOMBSTONE_FRACTION."""
+        fraction = self.tombstone_fraction()
+        if fraction <= ANN_COMPACT_TOMBSTONE_FRACTION:
+            return self
+        print(f"{fraction:.0%} of the IVF index at {self.path} is tombstoned; rebuilding")
+        return self.rebuild_from_db(db, self.path)
+
+    def _live_base_ids(self) -> np.ndarray:
+        ids = np.asarray(self.ids)
+        if not self._deleted:
+            return ids
+        return ids[~np.isin(ids, np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted)))]
+
+    def __len__(self) -> int:
+        return len(self._live_base_ids()) + len(self._delta)
+
+    def max_id(self) -> Optional[int]:
+        """Largest live memory id, or None when the index is empty."""
+        ids = np.concatenate([self._live_base_ids(), self._delta.ids])
+        return int(ids.max()) if len(ids) else None
+
+    def add(self, memory_id: int, embedding) -> None:
+        """Append a memory to the delta file so it survives restarts without a rebuild."""
+        vector = normalize(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(vector)
+                self._write_meta(self.path, self.dim, 0, 0)
+            record = np.zeros(1, dtype=self._delta_dtype)
+            record["id"], record["vector"] = memory_id, vector
+            with open(self._delta_path, "ab") as f:
+                record.tofile(f)
+            self._delta_records += 1
+        self._delta.add(memory_id, vector)
+
+    def add_many(self, ids: Sequence[int], embeddings) -> None:
+        for memory_id, embedding in zip(ids, embeddings):
+            self.add(memory_id, embedding)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        """Tombstone memories; they are dropped for good on the next rebuild."""
+        ids = [int(memory_id) for memory_id in ids]
+        with self._lock:
+            # Base entries of an id deleted before are hidden already
+            self._hidden_per_list += self._count_per_list({memory_id for memory_id in ids if memory_id not in self._deleted})
+            records = np.zeros(len(ids), dtype=self._tombstone_dtype)
+            records["id"], records["delta_records"] = ids, self._delta_records
+            with open(self._deleted_path, "ab") as f:
+                records.tofile(f)
+            self._deleted.update((memory_id, self._delta_records) for memory_id in ids)
+        self._delta.remove(ids)
+
+    def search(self, query_embedding, top_k: int = 5, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return approximate (memory_id, cosine_similarity) pairs for the top_k closest memories."""
+        query = normalize(np.asarray(query_embedding, dtype=np.float32))
+        candidate_ids, candidate_scores = [], []
+
+        if len(self.centroids):
+            probe = top_k_indices(self.centroids @ query, nprobe or self.nprobe)
+            for list_id in probe:
+                start, end = self.offsets[list_id], self.offsets[list_id + 1]
+                if start == end:
+                    continue
+                scores = np.asarray(self.vectors[start:end]) @ query
+                # Over-fetch by the list's hidden entries, so tombstones never leave it short
+                best = top_k_indices(scores, top_k + int(self._hidden_per_list[list_id]))
+                list_ids = np.asarray(self.ids[start:end])[best]
+                if self._deleted:
+                    # Every base entry of a deleted id stays hidden, even once the id is reused
+                    live = np.array([memory_id not in self._deleted for memory_id in list_ids.tolist()], dtype=bool)
+                    best, list_ids = best[live], list_ids[live]
+                candidate_ids.append(list_ids)
+                candidate_scores.append(scores[best])
+
+        # The delta only holds live records, so its results need no filtering
+        for memory_id, score in self._delta.search(query, top_k):
+            candidate_ids.append(np.array([memory_id]))
+            candidate_scores.append(np.array([score], dtype=np.float32))
+
+        if not candidate_ids:
+            return []
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        return [(int(ids[i]), float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+    @staticmethod
+    def _write_meta(path: str, dim: Optional[int], size: int, nlist: int) -> None:
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"dim": dim, "size": size, "nlist": nlist, "built_at": time.time()}, f)
+
+    @classmethod
+    def build(cls, ids, vectors, path: str = ANN_INDEX_DIR, nlist: Optional[int] = None) -> "IVFIndex":
+        """Cluster the vectors and write a fresh index directory, replacing any existing one."""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize(np.asarray(vectors, dtype=np.float32)) if len(ids) else None
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        if vectors is not None:
+            nlist = min(nlist or default_nlist(len(ids)), len(ids))
+            centroids = train_centroids(vectors, nlist)
+            assignments = assign_lists(vectors, centroids)
+            order = np.argsort(assignments, kind="stable")
+            offsets = np.zeros(nlist + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assignments, minlength=nlist), out=offsets[1:])
+
+            np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+            np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+            np.save(os.path.join(tmp_path, "vectors.npy"), vectors[order])
+            np.save(os.path.join(tmp_path, "ids.npy"), ids[order])
+            cls._write_meta(tmp_path, vectors.shape[1], len(ids), nlist)
+        else:
+            cls._write_meta(tmp_path, None, 0, 0)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    @classmethod
+    def rebuild_from_db(cls, db: Session, path: str = ANN_INDEX_DIR, nlist: Optional[int] = None) -> "IVFIndex":
+        exact = MemoryIndex.from_db(db)
+        index = cls.build(exact.ids, exact.matrix, path, nlist)
+        print(f"Built IVF index over {len(exact)} memories at {path}")
+        return index
+
+    @classmethod
+    def load_or_build(cls, db: Session, path: str = ANN_INDEX_DIR) -> "IVFIndex":
+        """
+        Load the index and check it against long_term_memories. Memories stored since it was
+        last written are appended to the delta; any other mismatch, or too many tombstones,
+        triggers a rebuild.
+        """
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return cls.rebuild_from_db(db, path)
+
+        index = cls(path)
+        count, max_id = db.query(func.count(LongTermMemory.id), func.max(LongTermMemory.id)).one()
+        indexed_count, indexed_max_id = len(index), index.max_id()
+        if (indexed_count, indexed_max_id) == (count, max_id):
+            return index.compacted(db)
+
+        newer = db.query(
+            LongTermMemory.id,
+            LongTermMemory.embedding,
+            LongTermMemory.embedding_vector,
+            LongTermMemory.embedding_dtype,
+        ).filter(LongTermMemory.id > (indexed_max_id or 0)).order_by(LongTermMemory.id).all()
+        if newer and indexed_count + len(newer) == count:
+            index.add_many([row.id for row in newer], [memory_embedding(row) for row in newer])
+            print(f"Appended {len(newer)} memories missing from the IVF index at {path}")
+            return index.compacted(db)
+
+        print(f"IVF index at {path} holds {indexed_count} memories, database has {count}; rebuilding")
+        return cls.rebuild_from_db(db, path)
+
+
+def recall_at_k(db: Session, k: int = 5, num_queries: int = 100, nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32), path: str = ANN_INDEX_DIR) -> List[dict]:
+    """
+    Compare the IVF index against exact search for a range of nprobe values.
+
+    Queries are stored memories with a little noise added, which mimics real queries that
+    land near existing thoughts. Returns one row per nprobe with recall@k and mean latency.
+    """
+    exact = MemoryIndex.from_db(db)
+    ann = IVFIndex.load_or_build(db, path)
+    if len(exact) == 0:
+        return []
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(exact), min(num_queries, len(exact)), replace=False)
+    queries = exact.matrix[picks] + rng.normal(0, 0.01, size=(len(picks), exact.dim)).astype(np.float32)
+    truth = [{memory_id for memory_id, _ in exact.search(query, k)} for query in queries]
+
+    start = time.perf_counter()
+    for query in queries:
+        exact.search(query, k)
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    report = []
+    for nprobe in nprobes:
+        hits, start = 0, time.perf_counter()
+        for query, expected in zip(queries, truth):
+            found = {memory_id for memory_id, _ in ann.search(query, k, nprobe=nprobe)}
+            hits += len(found & expected)
+        elapsed_ms = (time.perf_counter() - start) / len(queries) * 1000
+        report.append({
+            "nprobe": nprobe,
+            f"recall@{k}": hits / sum(len(expected) for expected in truth),
+            "ann_ms": elapsed_ms,
+            "exact_ms": exact_ms,
+        })
+    return report
+
+
+def main():
+    from db.db_setup import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Manage the IVF index over long-term memories.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="Rebuild the index from the database")
+    rebuild.add_argument("--nlist", type=int, default=None)
+    recall = subparsers.add_parser("recall", help="Measure recall@k against exact search")
+    recall.add_argument("--k", type=int, default=5)
+    recall.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            IVFIndex.rebuild_from_db(db, nlist=args.nlist)
+        else:
+            for row in recall_at_k(db, args.k, args.queries):
+                print("  ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
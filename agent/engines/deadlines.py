@@ -0,0 +1,37 @@
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+_deadline: ContextVar[Optional[float]] = ContextVar("stage_deadline", default=None)
+
+
+class StageDeadlineExceeded(TimeoutError):
+    """The current pipeline stage ran out of time before an action was started."""
+
+
+@contextmanager
+def stage_deadline(seconds: float):
+    """Give everything run inside this block (including from to_thread) `seconds` to finish; never extends an outer deadline."""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(deadline, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left(default: float = math.inf) -> float:
+    """Seconds left before the current stage's deadline, or `default` outside any stage."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(0.0, deadline - time.monotonic())
+
+
+def check_deadline(action: str) -> None:
+    """Raise StageDeadlineExceeded instead of starting `action` once the stage is out of time."""
+    if time_left() <= 0:
+        raise StageDeadlineExceeded(f"stage deadline passed, not {action}")
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from db.db_setup import DB_PATH
+from engines.embedding_codec import decode_embedding, encode_embedding
+
+# Persistent layer lives next to agents.db so it survives restarts and re-seeding
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(DB_PATH), "embedding_cache.db")
+)
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "2048"))
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "200000"))
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """Content address for an embedding: the model name plus a hash of the exact text."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-level embedding cache: an in-process LRU in front of a SQLite table.
+
+    Both levels are size-bounded; the disk level evicts the least recently used rows
+    once it grows past max_disk_entries.
+    """
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_memory_entries: int = EMBEDDING_CACHE_MEMORY_SIZE,
+        max_disk_entries: int = EMBEDDING_CACHE_DISK_SIZE,
+    ):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_last_used ON embedding_cache (last_used)")
+        self._conn.commit()
+        self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = embedding_cache_key(model, text)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+            row = self._conn.execute("SELECT vector FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE embedding_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            embedding = decode_embedding(row[0]).tolist()
+            self._remember(key, embedding)
+            self.stats["disk_hits"] += 1
+            return embedding
+
+    def put(self, model: str, text: str, embedding: List[float]) -> None:
+        key = embedding_cache_key(model, text)
+        vector, _ = encode_embedding(embedding, "float32")
+        with self._lock:
+            self._remember(key, list(embedding))
+            now = time.time()
+            # rowcount of INSERT OR REPLACE is 1 for a replaced row too; only genuinely new rows are counted
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO embedding_cache (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                (key, model, vector, now),
+            ).rowcount
+            if not inserted:
+                self._conn.execute(
+                    "UPDATE embedding_cache SET vector = ?, last_used = ? WHERE key = ?", (vector, now, key)
+                )
+            self._disk_entries += inserted
+            if self._disk_entries > self.max_disk_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # Trim 10% below the cap so eviction doesn't run on every insert
+        target = int(self.max_disk_entries * 0.9)
+        self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        excess = self._disk_entries - target
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embedding_cache WHERE key IN "
+            "(SELECT key FROM embedding_cache ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        )
+        self._disk_entries -= excess
+        self.stats["evictions"] += excess
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                **self.stats,
+                "hit_rate": self.hit_rate(),
+                "memory_entries": len(self._memory),
+                "disk_entries": self._disk_entries,
+            }
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
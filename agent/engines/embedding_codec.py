@@ -0,0 +1,36 @@
+import json
+import os
+from typing import Optional, Tuple
+import numpy as np
+
+# Storage precision for LongTermMemory.embedding_vector: "float32" (default) or "float16"
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def encode_embedding(embedding, dtype: Optional[str] = None) -> Tuple[bytes, str]:
+    """Serialize an embedding to little-endian bytes, returning (bytes, dtype name)."""
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype {dtype!r}, expected one of {SUPPORTED_DTYPES}")
+    vector = np.asarray(embedding, dtype=np.dtype(dtype).newbyteorder("<"))
+    return vector.tobytes(), dtype
+
+
+def decode_embedding(data: bytes, dtype: Optional[str] = None) -> np.ndarray:
+    """Deserialize bytes written by encode_embedding into a float32 vector."""
+    stored = np.frombuffer(data, dtype=np.dtype(dtype or "float32").newbyteorder("<"))
+    return stored.astype(np.float32)
+
+
+def parse_embedding(raw: str) -> np.ndarray:
+    """Parse a legacy embedding stored as a stringified list of floats."""
+    return np.asarray(json.loads(raw), dtype=np.float32)
+
+
+def memory_embedding(memory) -> np.ndarray:
+    """Return a LongTermMemory row's embedding, falling back to the legacy text column."""
+    if memory.embedding_vector is not None:
+        return decode_embedding(memory.embedding_vector, memory.embedding_dtype)
+    return parse_embedding(memory.embedding)
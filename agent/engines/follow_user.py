@@ -1,8 +1,20 @@
-import requests
 import re
+from typing import Callable
 from twitter.account import Account
 from twitter.scraper import Scraper
 from models import User
+from engines.rate_limiter import get_rate_limiter
+from engines.structured_output import FollowDecision, is_empty_json_list, parse_items, structured_chat_completion
+
+# Builds the scraper for user lookups from an account's cookies; the mock server installs its own
+_scraper_factory: Callable = Scraper
+
+
+def set_scraper_factory(factory: Callable) -> None:
+    """Look users up with factory(cookies) instead of twitter's Scraper, e.g. against the mock server."""
+    global _scraper_factory
+    _scraper_factory = factory
+
 
 def extract_twitter_usernames(posts):
     twitter_pattern = re.compile(r"@([A-Za-z0-9_]{1,15})")
@@ -51,21 +63,21 @@ def generate_decision_prompt(posts, usernames):
     """
 
 def get_decision_from_ai(prompt, openrouter_api_key):
-    response = requests.post(
-        url="https://openrouter.ai/api/v1/chat/completions",
-        headers={"Authorization": f"Bearer {openrouter_api_key}"},
-        json={
-            "model": "meta-llama/llama-3.1-70b-instruct",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7,
-        },
+    payload = {
+        "model": "meta-llama/llama-3.1-70b-instruct",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.7,
+    }
+    return structured_chat_completion(
+        "openrouter",
+        payload,
+        openrouter_api_key,
+        "follow_decisions",
+        FollowDecision,
+        engine="follow_decision",
+        cache_if=is_empty_json_list,
     )
 
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        raise Exception(f"Error generating decision: {response.text}")
-
 def decide_to_follow_users(db, posts, openrouter_api_key: str):
     # Extract Twitter usernames from posts
     twitter_usernames = extract_twitter_usernames(posts)
@@ -80,14 +92,16 @@ def decide_to_follow_users(db, posts, openrouter_api_key: str):
     prompt = generate_decision_prompt(posts, new_usernames)
 
     # Get decision from AI
-    return get_decision_from_ai(prompt, openrouter_api_key)
+    return parse_items(get_decision_from_ai(prompt, openrouter_api_key), FollowDecision)
 
 def get_user_id(account: Account, username):
-    scraper = Scraper(account.session.cookies)
+    scraper = _scraper_factory(account.session.cookies)
+    get_rate_limiter().acquire("twitter", "users")
     users = scraper.users([username])
     return users[0].id if users else None
 
 def follow_user(account: Account, user_id):
+    get_rate_limiter().acquire("twitter", "follow")
     return account.follow(user_id)
 
 def follow_by_username(account: Account, username):
@@ -0,0 +1,37 @@
+from typing import List, Sequence, Tuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import HandledNotification
+
+Notification = Tuple[str, str]  # (text, tweet_id)
+
+
+def unhandled_notifications(db: Session, action: str, notifications: Sequence[Notification]) -> List[Notification]:
+    """The notifications `action` has not already been taken for, in their original order."""
+    tweet_ids = [tweet_id for _, tweet_id in notifications]
+    handled = {
+        tweet_id
+        for (tweet_id,) in db.query(HandledNotification.tweet_id)
+        .filter(HandledNotification.action == action, HandledNotification.tweet_id.in_(tweet_ids))
+    }
+    return [(text, tweet_id) for text, tweet_id in notifications if tweet_id not in handled]
+
+
+def claim_notifications(db: Session, action: str, notifications: Sequence[Notification]) -> List[Notification]:
+    """
+    Record `action` as taken for each notification and return the ones this call claimed.
+    Claiming happens before the action runs, so a crash in between skips the action rather than repeating it.
+    """
+    claimed = []
+    for text, tweet_id in notifications:
+        result = db.execute(
+            sqlite_insert(HandledNotification)
+            .values(action=action, tweet_id=tweet_id)
+            .on_conflict_do_nothing(index_elements=["action", "tweet_id"])
+        )
+        if result.rowcount:
+            claimed.append((text, tweet_id))
+    db.commit()
+    return claimed
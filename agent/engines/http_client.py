@@ -0,0 +1,113 @@
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from engines.rate_limiter import get_rate_limiter, limit_key_for_url
+from engines.tracing import add_to_span
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+# Keep-alive connections kept open per host
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+# Number of distinct hosts whose pools are kept around
+HTTP_POOL_HOSTS = 32
+
+
+class PooledHTTPClient:
+    """
+    One requests.Session shared by every engine, so calls to the same host reuse
+    keep-alive connections instead of paying a new TCP+TLS handshake each time.
+
+    Per-host counters show how many requests went out and how many connections had
+    to be opened for them.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = HTTP_POOL_MAXSIZE,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"requests": 0, "errors": 0, "bytes_sent": 0, "bytes_received": 0})
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        rate_limit: Optional[Tuple[str, str]] = None,
+        rate_limit_wait: Optional[float] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        Send a request once the rate limiter allows it. `rate_limit` names the (provider, endpoint)
+        bucket, otherwise it is derived from the URL; `rate_limit_wait` caps the time spent queueing.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        provider, endpoint = rate_limit or limit_key_for_url(url)
+        limiter = get_rate_limiter()
+        limiter.acquire(provider, endpoint, timeout=rate_limit_wait)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._stats[host]["requests"] += 1
+                self._stats[host]["errors"] += 1
+            raise
+        limiter.observe(provider, endpoint, response.status_code, response.headers)
+
+        sent = len(response.request.body or b"")
+        received = 0 if kwargs.get("stream") else len(response.content)
+        with self._lock:
+            stats = self._stats[host]
+            stats["requests"] += 1
+            stats["bytes_sent"] += sent
+            stats["bytes_received"] += received
+        add_to_span(bytes_sent=sent, bytes_received=received)
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-host request counts and connections opened; the difference is handshakes saved."""
+        connections = defaultdict(int)
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                host = key.key_host if key.key_port in (None, 80, 443) else f"{key.key_host}:{key.key_port}"
+                connections[host] += pool.num_connections
+
+        with self._lock:
+            stats = {host: dict(values) for host, values in self._stats.items()}
+        for host, values in stats.items():
+            values["connections_opened"] = connections.get(host, 0)
+            values["connections_reused"] = max(0, values["requests"] - values["connections_opened"])
+        return stats
+
+
+_http_client: Optional[PooledHTTPClient] = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> PooledHTTPClient:
+    """Return the process-wide pooled HTTP client."""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = PooledHTTPClient()
+    return _http_client
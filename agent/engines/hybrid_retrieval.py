@@ -0,0 +1,125 @@
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from models import LongTermMemory
+from db.db_migrate import MEMORY_FTS_TABLE
+from engines.embedding_codec import memory_embedding
+from engines.long_term_mem import format_long_term_memories
+from engines.memory_index import get_memory_index, normalize, top_k_indices
+
+# Relative weight of each signal in the hybrid score (each signal is scaled to 0..1)
+HYBRID_WEIGHTS = {
+    "bm25": float(os.getenv("HYBRID_WEIGHT_BM25", "0.3")),
+    "vector": float(os.getenv("HYBRID_WEIGHT_VECTOR", "0.5")),
+    "significance": float(os.getenv("HYBRID_WEIGHT_SIGNIFICANCE", "0.1")),
+    "recency": float(os.getenv("HYBRID_WEIGHT_RECENCY", "0.1")),
+}
+HYBRID_RECENCY_HALF_LIFE_DAYS = float(os.getenv("HYBRID_RECENCY_HALF_LIFE_DAYS", "30"))
+# Above this many memories, score only full-text matches instead of the whole store
+HYBRID_PREFILTER_MIN_ROWS = int(os.getenv("HYBRID_PREFILTER_MIN_ROWS", "5000"))
+HYBRID_FTS_CANDIDATES = 200
+HYBRID_VECTOR_CANDIDATES = 50
+HYBRID_MAX_QUERY_TERMS = 64
+
+# Matches the FTS5 tokenizer: word characters plus @, $ and _ so handles and tickers stay whole
+TOKEN_PATTERN = re.compile(r"[\w@$]+")
+
+
+def build_fts_query(query_text: str) -> str:
+    """Turn free text into an FTS5 OR-query of quoted terms."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(query_text.lower()):
+        if len(token) >= 3 and token not in terms:
+            terms.append(token)
+    return " OR ".join(f'"{term}"' for term in terms[:HYBRID_MAX_QUERY_TERMS])
+
+
+def lexical_candidates(db: Session, query_text: str, limit: int = HYBRID_FTS_CANDIDATES) -> Dict[int, float]:
+    """Return memory id -> BM25 relevance (higher is better) for full-text matches."""
+    fts_query = build_fts_query(query_text)
+    if not fts_query:
+        return {}
+    try:
+        rows = db.execute(
+            text(
+                f"SELECT rowid, bm25({MEMORY_FTS_TABLE}) AS rank FROM {MEMORY_FTS_TABLE} "
+                f"WHERE {MEMORY_FTS_TABLE} MATCH :query ORDER BY rank LIMIT :limit"
+            ),
+            {"query": fts_query, "limit": limit},
+        ).all()
+    except OperationalError as e:
+        print(f"Full-text search failed, using vector scores only: {e}")
+        return {}
+    # SQLite's bm25() is negative, more negative meaning more relevant
+    return {row.rowid: -row.rank for row in rows}
+
+
+def recency_score(created_at: Optional[datetime], now: datetime, half_life_days: float = HYBRID_RECENCY_HALF_LIFE_DAYS) -> float:
+    """Exponential decay from 1 (just now) halving every half_life_days."""
+    if created_at is None:
+        return 0.0
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    age_days = max(0.0, (now - created_at).total_seconds() / 86400)
+    return 0.5 ** (age_days / half_life_days)
+
+
+def scale(values: Dict[int, float]) -> Dict[int, float]:
+    """Scale scores to 0..1 by the best one."""
+    best = max(values.values(), default=0.0)
+    if best <= 0:
+        return {key: 0.0 for key in values}
+    return {key: max(0.0, value) / best for key, value in values.items()}
+
+
+def retrieve_relevant_memories_hybrid(
+    db: Session,
+    query_embedding: List[float],
+    top_k: int = 5,
+    query_text: str = "",
+    weights: Optional[Dict[str, float]] = None,
+) -> str:
+    """
+    Rank memories by a weighted mix of BM25, cosine similarity, significance and recency.
+
+    Candidates are the full-text matches plus the nearest vectors from the memory index; on
+    large stores with enough full-text matches only those are scored.
+    """
+    weights = {**HYBRID_WEIGHTS, **(weights or {})}
+    index = get_memory_index(db)
+    lexical = lexical_candidates(db, query_text)
+
+    candidate_ids = set(lexical)
+    vector_scores: Dict[int, float] = {}
+    if len(index) <= HYBRID_PREFILTER_MIN_ROWS or len(lexical) < top_k:
+        vector_scores.update(index.search(query_embedding, max(top_k, HYBRID_VECTOR_CANDIDATES)))
+        candidate_ids.update(vector_scores)
+    if not candidate_ids:
+        return format_long_term_memories([])
+
+    memories = db.query(LongTermMemory).filter(LongTermMemory.id.in_(candidate_ids)).all()
+    query = normalize(np.asarray(query_embedding, dtype=np.float32))
+    for memory in memories:
+        if memory.id not in vector_scores:
+            vector_scores[memory.id] = float(normalize(memory_embedding(memory)) @ query)
+
+    lexical = scale(lexical)
+    now = datetime.utcnow()
+    scores = np.array([
+        weights["bm25"] * lexical.get(memory.id, 0.0)
+        + weights["vector"] * max(0.0, vector_scores[memory.id])
+        + weights["significance"] * (memory.significance_score or 0.0) / 10
+        + weights["recency"] * recency_score(memory.created_at, now)
+        for memory in memories
+    ], dtype=np.float32)
+
+    memories_list = [
+        {"content": memories[i].content, "significance_score": memories[i].significance_score}
+        for i in top_k_indices(scores, top_k)
+    ]
+    return format_long_term_memories(memories_list)
@@ -0,0 +1,487 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import requests
+from engines.deadlines import time_left
+from engines.http_client import get_http_client
+from engines.rate_limiter import RateLimitTimeout, parse_retry_after
+from engines.response_cache import get_response_cache, response_cache_key
+from engines.tracing import add_to_span
+from engines.usage_ledger import record_completion
+
+# OpenAI-compatible providers the engines talk to
+PROVIDERS = {
+    "hyperbolic": {
+        "base_url": os.getenv("HYPERBOLIC_BASE_URL", "https://api.hyperbolic.xyz/v1"),
+        "api_key_env": "HYPERBOLIC_API_KEY",
+    },
+    "openrouter": {
+        "base_url": os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+        "api_key_env": "OPENROUTER_API_KEY",
+    },
+}
+
+# The same model served by another provider, used for hedged requests and failover
+FAILOVER_MODELS = {
+    ("hyperbolic", "meta-llama/Meta-Llama-3.1-70B-Instruct"): ("openrouter", "meta-llama/llama-3.1-70b-instruct"),
+    ("hyperbolic", "meta-llama/Meta-Llama-3.1-405B"): ("openrouter", "meta-llama/llama-3.1-405b"),
+    ("openrouter", "meta-llama/llama-3.1-70b-instruct"): ("hyperbolic", "meta-llama/Meta-Llama-3.1-70B-Instruct"),
+}
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Wall-clock budget for one call including all retries
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "90"))
+# Consecutive failed attempts before a provider's circuit opens, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "60"))
+LATENCY_SAMPLES = 500
+
+# Hedging: if the primary hasn't answered by the model's p<LLM_HEDGE_PERCENTILE> latency, also ask the secondary
+LLM_HEDGING = os.getenv("LLM_HEDGING", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Hedge delay used until a model has LLM_HEDGE_MIN_SAMPLES latency samples
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_MIN_SAMPLES = 20
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """An LLM call failed after the gateway gave up on it."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMCircuitOpenError(LLMError):
+    """The provider has failed repeatedly and is not being called right now."""
+
+
+class LLMDeadlineExceeded(LLMError):
+    """The call ran out of its time budget."""
+
+
+class CircuitBreaker:
+    """Closed -> open after too many consecutive failures -> half-open trial after a cool-down."""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                # Let one request through to probe whether the provider is back
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """Free the half-open probe slot if the attempt ended without a verdict (deadline, local throttling)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model."""
+
+    def __init__(self, max_samples: int = LATENCY_SAMPLES):
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def count(self, model: str) -> int:
+        with self._lock:
+            return len(self._samples.get(model, ()))
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(model, ()))
+        return float(np.percentile(samples, q)) if samples else None
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            samples = {model: list(values) for model, values in self._samples.items()}
+        return {
+            model: {
+                "count": len(values),
+                "p50_s": float(np.percentile(values, 50)),
+                "p95_s": float(np.percentile(values, 95)),
+                "p99_s": float(np.percentile(values, 99)),
+            }
+            for model, values in samples.items() if values
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = defaultdict(CircuitBreaker)
+_latency = LatencyTracker()
+_errors = defaultdict(int)
+_attempts = defaultdict(int)
+_counters_lock = threading.Lock()
+_streams = defaultdict(int)
+
+
+def _count(counter: Dict, key) -> None:
+    with _counters_lock:
+        counter[key] += 1
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    return _breakers[provider]
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    return parse_retry_after(response.headers.get("Retry-After"))
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def read_stream(response: requests.Response, endpoint: str, stream_until: Callable[[str], bool], n: int = 1) -> Dict:
+    """
+    Accumulate an OpenAI-style server-sent event stream into a regular completion response,
+    closing the connection early once stream_until(text) is satisfied for all n choices.
+    """
+    response.encoding = "utf-8"
+    texts = defaultdict(str)
+    finish_reasons = {}
+    _count(_streams, "streams")
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            for choice in json.loads(data).get("choices") or []:
+                index = choice.get("index", 0)
+                if finish_reasons.get(index) == "early_stop":
+                    continue
+                texts[index] += choice.get("text") or (choice.get("delta") or {}).get("content") or ""
+                finish_reasons[index] = choice.get("finish_reason") or finish_reasons.get(index)
+                if stream_until(texts[index]):
+                    finish_reasons[index] = "early_stop"
+            if sum(reason == "early_stop" for reason in finish_reasons.values()) >= n:
+                # Hanging up tells the provider to stop generating tokens we would throw away
+                _count(_streams, "early_stops")
+                break
+    finally:
+        response.close()
+
+    choices = []
+    for index in sorted(texts) or [0]:
+        choice = {"text": texts[index]} if endpoint == "completions" else {"message": {"role": "assistant", "content": texts[index]}}
+        choices.append({**choice, "index": index, "finish_reason": finish_reasons.get(index)})
+    return {"choices": choices}
+
+
+def call_llm(
+    provider: str,
+    endpoint: str,
+    payload: Dict,
+    api_key: str,
+    deadline: Optional[float] = None,
+    max_attempts: Optional[int] = None,
+    cancel_event: Optional[threading.Event] = None,
+    stream_until: Optional[Callable[[str], bool]] = None,
+) -> Dict:
+    """
+    POST an OpenAI-style request to a provider and return the decoded JSON response.
+
+    Retries connection errors, timeouts, 429 and 5xx with exponential backoff and jitter,
+    honouring Retry-After. Other 4xx responses fail immediately. Every call is bounded by
+    `deadline` seconds and by the pipeline stage's deadline, and a provider whose circuit is
+    open fails fast without a request.
+    Setting `cancel_event` stops any further attempts (an in-flight request can't be aborted).
+
+    With `stream_until`, the completion is streamed and the connection is dropped as soon as
+    stream_until(text_so_far) is true; the response then holds only the text received.
+    """
+    breaker = get_circuit_breaker(provider)
+    url = f"{PROVIDERS[provider]['base_url']}/{endpoint}"
+    model = payload.get("model", "unknown")
+    started = time.monotonic()
+    deadline_at = started + min(deadline or LLM_CALL_DEADLINE, time_left())
+    max_attempts = max_attempts or LLM_MAX_ATTEMPTS
+    http = get_http_client()
+    last_error = None
+    if stream_until is not None:
+        payload = {**payload, "stream": True}
+
+    for attempt in range(max_attempts):
+        if cancel_event is not None and cancel_event.is_set():
+            raise LLMError(f"{provider} call to {model} was cancelled")
+        if not breaker.allow():
+            _count(_errors, (provider, "circuit_open"))
+            raise LLMCircuitOpenError(f"{provider} circuit is open, not calling {model}")
+
+        # Every exit below must give back a half-open probe, or the circuit would stay shut for good
+        try:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            wait = None
+            attempt_started = time.monotonic()
+            _count(_attempts, provider)
+            try:
+                response = http.post(
+                    url,
+                    headers={
+                        "Content-Type": "application/json",
+                        "Authorization": f"Bearer {api_key}",
+                    },
+                    json=payload,
+                    timeout=(min(http.timeout[0], remaining), remaining),
+                    stream=stream_until is not None,
+                    rate_limit=(provider, endpoint),
+                    rate_limit_wait=remaining,
+                )
+            except RateLimitTimeout as e:
+                # Our own budget ran out before the deadline; the provider never saw the request
+                last_error = LLMError(f"{provider} call to {model} not sent: {e}")
+                break
+            except requests.RequestException as e:
+                last_error = LLMError(f"{provider} request failed: {e}")
+            else:
+                if response.ok:
+                    try:
+                        result = read_stream(response, endpoint, stream_until, payload.get("n", 1)) if stream_until else response.json()
+                    except (requests.RequestException, ValueError) as e:
+                        last_error = LLMError(f"{provider} sent an unreadable response: {e}")
+                    else:
+                        breaker.record_success()
+                        _latency.record(model, time.monotonic() - attempt_started)
+                        record_completion(payload, result)
+                        return result
+                else:
+                    last_error = LLMError(f"{provider} returned {response.status_code}: {response.text[:500]}", response.status_code)
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        # The request itself is bad; retrying won't help, but the provider did answer
+                        breaker.record_success()
+                        _count(_errors, (provider, str(response.status_code)))
+                        raise last_error
+                    wait = retry_after_seconds(response)
+
+            breaker.record_failure()
+            _count(_errors, (provider, str(last_error.status_code or "network")))
+            print(f"LLM call to {provider} ({model}) failed on attempt {attempt + 1}: {last_error}")
+            add_to_span(retries=1)
+        finally:
+            breaker.release_trial()
+
+        if attempt + 1 < max_attempts:
+            wait = backoff_seconds(attempt) if wait is None else wait
+            if time.monotonic() + wait >= deadline_at:
+                break
+            if cancel_event is not None:
+                cancel_event.wait(wait)
+            else:
+                time.sleep(wait)
+
+    if time.monotonic() >= deadline_at or (last_error is None):
+        raise LLMDeadlineExceeded(f"{provider} call to {model} exceeded its {deadline or LLM_CALL_DEADLINE:.0f}s deadline")
+    raise last_error
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+_hedge_stats = defaultdict(float)
+_hedge_stats_lock = threading.Lock()
+
+
+def _count_hedge(key: str, amount: float = 1) -> None:
+    with _hedge_stats_lock:
+        _hedge_stats[key] += amount
+
+
+def hedge_delay(model: str) -> float:
+    """Seconds to wait on the primary before hedging: its observed tail latency once known."""
+    if _latency.count(model) < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return max(LLM_HEDGE_MIN_DELAY, _latency.percentile(model, LLM_HEDGE_PERCENTILE))
+
+
+def failover_target(provider: str, model: str) -> Optional[tuple]:
+    """(provider, model, api_key) serving the same model elsewhere, if one is configured."""
+    target = FAILOVER_MODELS.get((provider, model))
+    if target is None:
+        return None
+    api_key = os.getenv(PROVIDERS[target[0]]["api_key_env"])
+    return (target[0], target[1], api_key) if api_key else None
+
+
+def _timed_call(provider: str, endpoint: str, payload: Dict, api_key: str, cancel_event: threading.Event, **kwargs):
+    result = call_llm(provider, endpoint, payload, api_key, cancel_event=cancel_event, **kwargs)
+    return result, time.monotonic()
+
+
+def hedged_call(provider: str, endpoint: str, payload: Dict, api_key: str, **kwargs) -> Dict:
+    """
+    call_llm with hedging: if the primary hasn't answered within hedge_delay(model), send the
+    same request to the failover provider and return whichever succeeds first. The loser
+    stops retrying; its in-flight request is abandoned. A failing primary fails over at once.
+    """
+    model = payload.get("model", "unknown")
+    secondary = failover_target(provider, model)
+    if not LLM_HEDGING or secondary is None:
+        return call_llm(provider, endpoint, payload, api_key, **kwargs)
+
+    _count_hedge("calls")
+    primary_cancel, secondary_cancel = threading.Event(), threading.Event()
+    primary = _hedge_executor.submit(
+        contextvars.copy_context().run, _timed_call, provider, endpoint, payload, api_key, primary_cancel, **kwargs)
+    done, _ = wait([primary], timeout=hedge_delay(model))
+    if done and primary.exception() is None:
+        return primary.result()[0]
+
+    secondary_provider, secondary_model, secondary_key = secondary
+    _count_hedge("failovers" if done else "hedges")
+    secondary_future = _hedge_executor.submit(
+        contextvars.copy_context().run, _timed_call, secondary_provider, endpoint, {**payload, "model": secondary_model},
+        secondary_key, secondary_cancel, **kwargs
+    )
+
+    pending = {secondary_future} if done else {primary, secondary_future}
+    errors = [primary.exception()] if done else []
+    while pending:
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            if future.exception() is not None:
+                errors.append(future.exception())
+                continue
+            result, finished_at = future.result()
+            if future is secondary_future:
+                _count_hedge("secondary_wins")
+                primary_cancel.set()
+                # Once the abandoned primary finishes we know how much waiting the hedge saved
+                primary.add_done_callback(
+                    lambda f: f.exception() is None and _count_hedge("latency_saved_s", max(0.0, f.result()[1] - finished_at))
+                )
+            else:
+                secondary_cancel.set()
+            return result
+    raise errors[-1]
+
+
+def cached_call(
+    provider: str,
+    endpoint: str,
+    payload: Dict,
+    api_key: str,
+    engine: Optional[str] = None,
+    cache_if: Optional[Callable[[Dict], bool]] = None,
+    **kwargs,
+) -> Dict:
+    """
+    hedged_call behind the response cache. Only calls tagged with an `engine` are cached,
+    and only responses accepted by `cache_if` (when given) are stored.
+    """
+    if engine is None:
+        return hedged_call(provider, endpoint, payload, api_key, **kwargs)
+
+    cache = get_response_cache()
+    key = response_cache_key(endpoint, payload)
+    response = cache.get(engine, key)
+    if response is None:
+        response = hedged_call(provider, endpoint, payload, api_key, **kwargs)
+        if cache_if is None or cache_if(response):
+            cache.put(key, response)
+    return response
+
+
+def chat_completion(provider: str, payload: Dict, api_key: str, cache_if: Optional[Callable[[str], bool]] = None, **kwargs) -> str:
+    """Return the assistant message content of a chat completion."""
+    def content(response: Dict) -> str:
+        return response["choices"][0]["message"]["content"]
+
+    accept = None
+    if cache_if is not None:
+        def accept(response: Dict) -> bool:
+            return cache_if(content(response))
+
+    response = cached_call(provider, "chat/completions", payload, api_key, cache_if=accept, **kwargs)
+    return content(response)
+
+
+def text_completion(provider: str, payload: Dict, api_key: str, **kwargs) -> str:
+    """Return the generated text of a (base model) completion."""
+    response = cached_call(provider, "completions", payload, api_key, **kwargs)
+    return response["choices"][0]["text"]
+
+
+def text_completions(provider: str, payload: Dict, api_key: str, **kwargs) -> List[str]:
+    """Return every generated text of a completion requested with n > 1."""
+    response = cached_call(provider, "completions", payload, api_key, **kwargs)
+    return [choice["text"] for choice in response["choices"]]
+
+
+def hedge_stats() -> Dict[str, float]:
+    """Hedged calls, how often the hedge fired and won, and the latency it saved."""
+    with _hedge_stats_lock:
+        stats = dict(_hedge_stats)
+    calls = stats.get("calls", 0)
+    stats["hedge_rate"] = stats.get("hedges", 0) / calls if calls else 0.0
+    return stats
+
+
+def gateway_stats() -> Dict:
+    """Latency percentiles per model, attempt and error counts and circuit state per provider."""
+    errors = defaultdict(dict)
+    with _counters_lock:
+        error_counts, attempts, streams = dict(_errors), dict(_attempts), dict(_streams)
+    for (provider, kind), count in error_counts.items():
+        errors[provider][kind] = count
+    return {
+        "latency": _latency.snapshot(),
+        "attempts": attempts,
+        "errors": dict(errors),
+        "circuits": {provider: breaker.state for provider, breaker in list(_breakers.items())},
+        "hedging": hedge_stats(),
+        "streams": streams,
+        "response_cache": get_response_cache().snapshot(),
+    }
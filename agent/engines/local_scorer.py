@@ -0,0 +1,257 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from models import LongTermMemory, SignificanceSample
+from engines.embedding_codec import decode_embedding, encode_embedding
+from engines.memory_index import get_memory_index, normalize, top_k_indices
+from engines.significance_scorer import score_significance
+
+# "off": always ask the LLM. "shadow": ask the LLM, and keep its score next to the local estimate
+# to calibrate the estimator. "on": skip the LLM only where shadow agreement has been proven.
+SIGNIFICANCE_PRESCORER = os.getenv("SIGNIFICANCE_PRESCORER", "off")
+# Estimates within this distance of a decision threshold go to the LLM
+PRESCORER_MARGIN = float(os.getenv("PRESCORER_MARGIN", "1.0"))
+# Below this similarity to the nearest scored post the estimate is not trusted
+PRESCORER_MIN_SIMILARITY = float(os.getenv("PRESCORER_MIN_SIMILARITY", "0.5"))
+# A bucket's estimates replace the LLM only after this many comparisons at this agreement
+PRESCORER_MIN_COMPARISONS = int(os.getenv("PRESCORER_MIN_COMPARISONS", "50"))
+PRESCORER_MIN_AGREEMENT = float(os.getenv("PRESCORER_MIN_AGREEMENT", "0.95"))
+# Most recent LLM-scored posts kept for nearest-neighbour estimates
+PRESCORER_HISTORY = int(os.getenv("PRESCORER_HISTORY", "5000"))
+# The pipeline posts at >= 3 and stores a long-term memory at >= 7
+SIGNIFICANCE_THRESHOLDS = (3, 7)
+BUCKET_NAMES = ("drop", "post", "remember")
+# Integer scores a local estimate may return per bucket; "remember" is never settled locally
+LOCAL_SCORE_RANGES = {0: (1, 2), 1: (3, 6)}
+PRESCORER_NEIGHBOURS = 10
+# Weight of the text-feature estimate, in the same units as a neighbour's squared similarity
+PRESCORER_TEXT_WEIGHT = float(os.getenv("PRESCORER_TEXT_WEIGHT", "0.5"))
+# Scored posts needed before the text-feature model is fitted and used
+PRESCORER_TEXT_MIN_SAMPLES = 20
+TEXT_MODEL_RIDGE = 1.0
+
+_CASHTAG = re.compile(r"\$[A-Za-z][A-Za-z0-9_]{0,9}\b")
+_MENTION = re.compile(r"@[A-Za-z0-9_]{1,15}")
+_URL = re.compile(r"https?://\S+")
+
+_stats = {"scored": 0, "llm_calls": 0, "llm_calls_saved": 0}
+_stats_lock = threading.Lock()
+_history: Optional["ScoredHistory"] = None
+
+
+def bucket(score: float) -> int:
+    """Which side of the pipeline's thresholds a score falls on: 0 drop, 1 post, 2 post and remember."""
+    return sum(score >= threshold for threshold in SIGNIFICANCE_THRESHOLDS)
+
+
+def text_features(text: str) -> np.ndarray:
+    """Cheap surface features of a post: bias, log length, cashtags, mentions, URLs and word repetition."""
+    words = text.lower().split()
+    repetition = 1.0 - len(set(words)) / len(words) if words else 0.0
+    return np.array(
+        [1.0, np.log1p(len(text)), len(_CASHTAG.findall(text)), len(_MENTION.findall(text)), len(_URL.findall(text)), repetition],
+        dtype=np.float32,
+    )
+
+
+class ScoredHistory:
+    """
+    Posts the LLM has scored, from every bucket, with per-bucket agreement between the local
+    estimate made beforehand and the LLM's score, and a ridge regression of those scores on
+    text_features. Backed by significance_samples, so the calibration survives restarts.
+    """
+
+    def __init__(self, vectors: np.ndarray, scores: List[int], comparisons: Dict[int, List[int]], features: np.ndarray):
+        self.vectors = vectors
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.comparisons = comparisons
+        self.features = features
+        self._lock = threading.Lock()
+        self._text_model = self._fit_text_model()
+
+    def _fit_text_model(self) -> Optional[np.ndarray]:
+        if len(self.scores) < PRESCORER_TEXT_MIN_SAMPLES:
+            return None
+        x = self.features.astype(np.float64)
+        penalty = TEXT_MODEL_RIDGE * np.eye(x.shape[1])
+        penalty[0, 0] = 0.0  # Leave the bias unpenalised
+        return np.linalg.solve(x.T @ x + penalty, x.T @ self.scores)
+
+    @classmethod
+    def from_db(cls, db: Session, limit: int = PRESCORER_HISTORY) -> "ScoredHistory":
+        rows = db.query(SignificanceSample).order_by(SignificanceSample.id.desc()).limit(limit).all()
+        vectors = normalize(np.stack([decode_embedding(r.embedding_vector, r.embedding_dtype) for r in rows])) if rows else None
+        comparisons = {b: [0, 0] for b in range(len(BUCKET_NAMES))}
+        for row in rows:
+            if row.estimate is not None:
+                counts = comparisons[bucket(row.estimate)]
+                counts[0] += 1
+                counts[1] += bucket(row.estimate) == bucket(row.llm_score)
+        features = np.stack([text_features(row.content or "") for row in rows]) if rows else np.empty((0, 6), dtype=np.float32)
+        return cls(vectors, [row.llm_score for row in rows], comparisons, features)
+
+    def neighbours(self, embedding, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(similarities, LLM scores) of the k most similar scored posts."""
+        with self._lock:
+            if self.vectors is None:
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+            similarities = self.vectors @ normalize(embedding)
+            best = top_k_indices(similarities, k)
+            return similarities[best], self.scores[best]
+
+    def text_estimate(self, text: str) -> Optional[float]:
+        """The text-feature model's 1-10 score for text, or None until enough posts have been scored."""
+        with self._lock:
+            model = self._text_model
+        if model is None:
+            return None
+        return float(np.clip(text_features(text) @ model, 1.0, 10.0))
+
+    def add(self, embedding, text: str, llm_score: int, estimate: Optional[float]) -> None:
+        with self._lock:
+            vector = normalize(embedding)[None, :]
+            self.vectors = vector if self.vectors is None else np.concatenate([vector, self.vectors])[:PRESCORER_HISTORY]
+            self.scores = np.concatenate([[llm_score], self.scores])[:PRESCORER_HISTORY].astype(np.float32)
+            self.features = np.concatenate([text_features(text)[None, :], self.features])[:PRESCORER_HISTORY]
+            self._text_model = self._fit_text_model()
+            if estimate is not None:
+                counts = self.comparisons[bucket(estimate)]
+                counts[0] += 1
+                counts[1] += bucket(estimate) == bucket(llm_score)
+
+    def agreement(self, estimate_bucket: int) -> Tuple[int, float]:
+        """(comparisons, share where the LLM landed in the same bucket) for estimates in this bucket."""
+        with self._lock:
+            compared, agreed = self.comparisons[estimate_bucket]
+        return compared, agreed / compared if compared else 0.0
+
+
+def get_scored_history(db: Session) -> ScoredHistory:
+    global _history
+    if _history is None:
+        with _stats_lock:
+            if _history is None:
+                _history = ScoredHistory.from_db(db)
+    return _history
+
+
+def memory_neighbours(db: Session, embedding, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(similarities, significance scores) of the k most similar long-term memories."""
+    ranked = get_memory_index(db).search(embedding, k)
+    significance = dict(
+        db.query(LongTermMemory.id, LongTermMemory.significance_score)
+        .filter(LongTermMemory.id.in_([memory_id for memory_id, _ in ranked]))
+    ) if ranked else {}
+    pairs = [(similarity, significance[memory_id]) for memory_id, similarity in ranked if memory_id in significance]
+    return np.array([p[0] for p in pairs], dtype=np.float32), np.array([p[1] for p in pairs], dtype=np.float32)
+
+
+def estimate_significance(db: Session, text: str, embedding) -> Tuple[float, float]:
+    """
+    Estimate a 1-10 significance score without an LLM, returning (estimate, confidence).
+
+    The estimate is a weighted mean over the nearest previously scored posts and the nearest
+    long-term memories (stored only for LLM scores >= 7, so they anchor the high end), each
+    weighted by squared similarity, plus the text-feature model's score at PRESCORER_TEXT_WEIGHT.
+    Confidence is the similarity of the nearest neighbour of either kind (0 with neither), so
+    text features move the estimate but never make it trusted on their own.
+    """
+    if not text.strip():
+        return 0.0, 1.0
+
+    history = get_scored_history(db)
+    scored_similarities, scored = history.neighbours(embedding, PRESCORER_NEIGHBOURS)
+    memory_similarities, remembered = memory_neighbours(db, embedding, PRESCORER_NEIGHBOURS)
+    similarities = np.concatenate([scored_similarities, memory_similarities])
+    scores = np.concatenate([scored, remembered])
+    weights = np.clip(similarities, 0.0, None) ** 2
+    total, weighted = float(weights.sum()), float(weights @ scores)
+
+    text_estimate = history.text_estimate(text)
+    if text_estimate is not None:
+        total += PRESCORER_TEXT_WEIGHT
+        weighted += PRESCORER_TEXT_WEIGHT * text_estimate
+    if not total:
+        return 0.0, 0.0
+    return weighted / total, float(similarities.max()) if len(similarities) else 0.0
+
+
+def can_skip_llm(history: ScoredHistory, estimate: float, confidence: float) -> bool:
+    """
+    Whether an estimate may stand in for the LLM: confident, clear of the thresholds, not in the
+    "remember" bucket (memories are only stored from LLM scores), and in a bucket whose shadow
+    comparisons have reached PRESCORER_MIN_AGREEMENT.
+    """
+    if confidence < PRESCORER_MIN_SIMILARITY:
+        return False
+    if any(abs(estimate - threshold) < PRESCORER_MARGIN for threshold in SIGNIFICANCE_THRESHOLDS):
+        return False
+    estimate_bucket = bucket(estimate)
+    if estimate_bucket not in LOCAL_SCORE_RANGES:
+        return False
+    compared, agreement = history.agreement(estimate_bucket)
+    return compared >= PRESCORER_MIN_COMPARISONS and agreement >= PRESCORER_MIN_AGREEMENT
+
+
+def local_score(estimate: float) -> int:
+    """Round an estimate to an integer score without leaving its bucket."""
+    low, high = LOCAL_SCORE_RANGES[bucket(estimate)]
+    return int(np.clip(round(estimate), low, high))
+
+
+def record_sample(db: Session, history: ScoredHistory, text: str, embedding, llm_score: int, estimate: Optional[float]) -> None:
+    """Keep an LLM score, and the estimate made before it, as calibration data."""
+    vector, dtype = encode_embedding(embedding)
+    db.add(SignificanceSample(content=text, embedding_vector=vector, embedding_dtype=dtype, llm_score=llm_score, estimate=estimate))
+    db.commit()
+    history.add(embedding, text, llm_score, estimate)
+    if estimate is not None:
+        compared, agreement = history.agreement(bucket(estimate))
+        print(
+            f"Pre-scorer estimated {estimate:.1f}, LLM scored {llm_score} "
+            f"({BUCKET_NAMES[bucket(estimate)]} agreement {agreement:.0%} over {compared})"
+        )
+
+
+def prescore_significance(db: Session, text: str, embedding, llm_api_key: str, mode: Optional[str] = None) -> int:
+    """
+    Score a post's significance. In "on" mode the local estimate replaces the LLM only where
+    can_skip_llm allows it; every LLM score is kept to calibrate the estimate.
+    """
+    mode = mode or SIGNIFICANCE_PRESCORER
+    if mode == "off":
+        return score_significance(text, llm_api_key)
+
+    history = get_scored_history(db)
+    estimate, confidence = estimate_significance(db, text, embedding)
+    with _stats_lock:
+        _stats["scored"] += 1
+    if mode == "on" and can_skip_llm(history, estimate, confidence):
+        with _stats_lock:
+            _stats["llm_calls_saved"] += 1
+        score = local_score(estimate)
+        print(f"Pre-scorer settled significance at {score} (estimate {estimate:.1f}, confidence {confidence:.2f}), skipping LLM")
+        return score
+
+    llm_score = score_significance(text, llm_api_key)
+    with _stats_lock:
+        _stats["llm_calls"] += 1
+    if llm_score:
+        confident = confidence >= PRESCORER_MIN_SIMILARITY and bool(text.strip())
+        record_sample(db, history, text, embedding, llm_score, estimate if confident else None)
+    return llm_score
+
+
+def prescorer_stats() -> Dict[str, float]:
+    """Calls made and saved, and per bucket how often the local estimate matched the LLM's bucket."""
+    with _stats_lock:
+        stats = dict(_stats)
+    if _history is not None:
+        for estimate_bucket, name in enumerate(BUCKET_NAMES):
+            compared, agreement = _history.agreement(estimate_bucket)
+            stats[f"{name}_compared"] = compared
+            stats[f"{name}_agreement"] = agreement
+    return stats
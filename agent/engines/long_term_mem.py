@@ -1,39 +1,91 @@
-from typing import List, Dict
-import numpy as np
+import os
+from functools import lru_cache
+from typing import Any, List, Dict
 from sqlalchemy.orm import Session
-from sqlalchemy import Column, Integer, String, Float, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.sql import func
 from openai import OpenAI
+from models import LongTermMemory
+from engines.embedding_cache import get_embedding_cache
+from engines.embedding_codec import encode_embedding
+from engines.memory_index import get_memory_index, loaded_memory_index
+from engines.rate_limiter import PRIORITY_BACKGROUND, get_rate_limiter
+from engines.usage_ledger import estimate_tokens, record_usage
 
-Base = declarative_base()
+EMBEDDING_MODEL = "text-embedding-3-small"
+# OpenAI accepts up to 2048 inputs and ~300k tokens per embeddings request
+EMBEDDING_BATCH_SIZE = 2048
+EMBEDDING_BATCH_MAX_TOKENS = 250_000
+# None uses the OpenAI default; point it at a compatible server (e.g. the mock server) to redirect embeddings
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
 
-class LongTermMemory(Base):
-    __tablename__ = "long_term_memories"
+@lru_cache(maxsize=None)
+def get_openai_client(openai_api_key: str) -> OpenAI:
+    # One client per key so its HTTP connection pool is reused across calls
+    return OpenAI(api_key=openai_api_key, base_url=OPENAI_BASE_URL)
 
-    id = Column(Integer, primary_key=True, index=True)
-    content = Column(String, nullable=False)
-    embedding = Column(String, nullable=False)  # Store as JSON string
-    significance_score = Column(Float, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+def batch_texts(texts: List[str], max_inputs: int = EMBEDDING_BATCH_SIZE, max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS) -> List[List[str]]:
+    """Split texts into request-sized chunks within the provider's input and token limits."""
+    batches, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def create_embeddings(texts: List[str], openai_api_key: str) -> List[List[float]]:
+    """Embed many texts with as few requests as possible, returning vectors in input order."""
+    cache = get_embedding_cache()
+    embeddings = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        cached = cache.get(EMBEDDING_MODEL, text)
+        if cached is not None:
+            embeddings[text] = cached
+        else:
+            missing.append(text)
+
+    limiter = get_rate_limiter()
+    for batch in batch_texts(missing):
+        limiter.acquire("openai", "embeddings", PRIORITY_BACKGROUND)
+        raw = get_openai_client(openai_api_key).embeddings.with_raw_response.create(
+            input=batch,
+            model=EMBEDDING_MODEL
+        )
+        limiter.observe("openai", "embeddings", raw.status_code, raw.headers)
+        response = raw.parse()
+        if response.usage is not None:
+            record_usage(EMBEDDING_MODEL, response.usage.prompt_tokens)
+        for item in sorted(response.data, key=lambda item: item.index):
+            text = batch[item.index]
+            embeddings[text] = item.embedding
+            cache.put(EMBEDDING_MODEL, text, item.embedding)
+
+    return [embeddings[text] for text in texts]
 
 def create_embedding(text: str, openai_api_key: str) -> List[float]:
-    client = OpenAI(api_key=openai_api_key)
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+    return create_embeddings([text], openai_api_key)[0]
 
 def store_memory(db: Session, content: str, embedding: List[float], significance_score: float):
+    embedding_vector, embedding_dtype = encode_embedding(embedding)
     new_memory = LongTermMemory(
         content=content,
-        embedding=str(embedding),  # Convert to string for storage.
+        embedding="",  # Legacy text column; the vector is stored as raw bytes.
+        embedding_vector=embedding_vector,
+        embedding_dtype=embedding_dtype,
         significance_score=significance_score
     )
     db.add(new_memory)
     db.commit()
 
+    # Keep the in-process index in sync; if it isn't loaded yet it will pick this row up on load.
+    index = loaded_memory_index()
+    if index is not None:
+        index.add(new_memory.id, embedding)
+
 def format_long_term_memories(memories: List[Dict[str, Any]]) -> str:
     if not memories:
         return "No relevant memories found."
@@ -51,24 +103,20 @@ def format_long_term_memories(memories: List[Dict[str, Any]]) -> str:
     return "\n".join(formatted_parts)
 
 def retrieve_relevant_memories(db: Session, query_embedding: List[float], top_k: int = 5) -> str:
-    all_memories = db.query(LongTermMemory).all()
-
-    def cosine_similarity(a: List[float], b: List[float]) -> float:
-        """Calculate the cosine similarity between two vectors."""
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-    similarities = [
-        (memory, cosine_similarity(query_embedding, eval(memory.embedding)))
-        for memory in all_memories
-    ]
+    # Rank every memory by cosine similarity with one matrix-vector product over the index
+    ranked = get_memory_index(db).search(query_embedding, top_k)
+    ids = [memory_id for memory_id, _ in ranked]
 
-    # Sort memories based on similarity and get the top_k
-    sorted_memories = sorted(similarities, key=lambda x: x[1], reverse=True)[:top_k]
+    memories_by_id = {
+        memory.id: memory
+        for memory in db.query(LongTermMemory).filter(LongTermMemory.id.in_(ids)).all()
+    } if ids else {}
 
     # Prepare the list of memories for formatting
     memories_list = [
-        {"content": memory.content, "significance_score": memory.significance_score}
-        for memory, _ in sorted_memories
+        {"content": memories_by_id[memory_id].content, "significance_score": memories_by_id[memory_id].significance_score}
+        for memory_id in ids
+        if memory_id in memories_by_id
     ]
 
     return format_long_term_memories(memories_list)
@@ -0,0 +1,165 @@
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Set
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import LongTermMemory, MemoryConsolidationRun
+from engines.embedding_codec import memory_embedding
+from engines.hybrid_retrieval import recency_score
+from engines.memory_index import get_memory_index, set_memory_index
+
+# Memories at least this similar are treated as the same thought
+CONSOLIDATION_SIMILARITY_THRESHOLD = float(os.getenv("CONSOLIDATION_SIMILARITY_THRESHOLD", "0.95"))
+# Significance halves every this many days when deciding what to evict over capacity
+MEMORY_DECAY_HALF_LIFE_DAYS = float(os.getenv("MEMORY_DECAY_HALF_LIFE_DAYS", "180"))
+# Maximum number of long-term memories to keep; 0 disables the cap
+MEMORY_CAPACITY = int(os.getenv("MEMORY_CAPACITY", "10000"))
+CONSOLIDATION_NEIGHBOURS = 10
+# Retrieval latency is timed over this many queries, repeated for at least this long, so that
+# one pass's before/after figures are comparable rather than timer noise
+CONSOLIDATION_TIMING_QUERIES = 200
+CONSOLIDATION_TIMING_SECONDS = 0.5
+
+
+def time_retrieval(index, queries: List[np.ndarray], top_k: int = 5, min_seconds: float = CONSOLIDATION_TIMING_SECONDS) -> float:
+    """Median over rounds of the mean milliseconds per search, running rounds for at least min_seconds."""
+    if not queries or len(index) == 0:
+        return 0.0
+    rounds = []
+    started = time.perf_counter()
+    while not rounds or time.perf_counter() - started < min_seconds:
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, top_k)
+        rounds.append((time.perf_counter() - start) / len(queries) * 1000)
+    return float(np.median(rounds))
+
+
+def find_duplicates(db: Session, index, new_memories: List[LongTermMemory]) -> Set[int]:
+    """
+    Cluster each new memory with its near-duplicates and return the ids to delete.
+
+    In every cluster the memory with the highest significance_score survives
+    (the oldest one on ties).
+    """
+    doomed: Set[int] = set()
+    for memory in new_memories:
+        if memory.id in doomed:
+            continue
+        neighbours = [
+            memory_id for memory_id, similarity in index.search(memory_embedding(memory), CONSOLIDATION_NEIGHBOURS)
+            if similarity >= CONSOLIDATION_SIMILARITY_THRESHOLD and memory_id not in doomed
+        ]
+        if memory.id not in neighbours:
+            neighbours.append(memory.id)
+        if len(neighbours) < 2:
+            continue
+
+        cluster = db.query(LongTermMemory.id, LongTermMemory.significance_score).filter(
+            LongTermMemory.id.in_(neighbours)
+        ).all()
+        keeper = max(cluster, key=lambda row: (row.significance_score, -row.id))
+        doomed.update(row.id for row in cluster if row.id != keeper.id)
+    return doomed
+
+
+def find_over_capacity(db: Session, exclude: Set[int], capacity: int = MEMORY_CAPACITY) -> Set[int]:
+    """Pick the memories with the lowest decayed significance once the store exceeds capacity."""
+    if capacity <= 0:
+        return set()
+    rows = [
+        row for row in db.query(LongTermMemory.id, LongTermMemory.significance_score, LongTermMemory.created_at).all()
+        if row.id not in exclude
+    ]
+    excess = len(rows) - capacity
+    if excess <= 0:
+        return set()
+
+    now = datetime.utcnow()
+    decayed = sorted(
+        (row.significance_score * recency_score(row.created_at, now, MEMORY_DECAY_HALF_LIFE_DAYS), row.id)
+        for row in rows
+    )
+    return {memory_id for _, memory_id in decayed[:excess]}
+
+
+def consolidate_memories(db: Session) -> Dict[str, float]:
+    """
+    Merge near-duplicate long-term memories and enforce the capacity cap.
+
+    Only memories added since the last pass are clustered. Returns and records how many
+    rows were removed and how retrieval latency changed.
+    """
+    last_run = db.query(MemoryConsolidationRun).order_by(MemoryConsolidationRun.id.desc()).first()
+    last_memory_id = last_run.last_memory_id if last_run else 0
+
+    new_memories = (
+        db.query(LongTermMemory)
+        .filter(LongTermMemory.id > last_memory_id)
+        .order_by(LongTermMemory.id)
+        .all()
+    )
+    index = get_memory_index(db)
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(new_memories), min(CONSOLIDATION_TIMING_QUERIES, len(new_memories)), replace=False)
+    queries = [memory_embedding(new_memories[i]) for i in picks]
+    retrieval_ms_before = time_retrieval(index, queries)
+
+    duplicates = find_duplicates(db, index, new_memories)
+    evicted = find_over_capacity(db, duplicates)
+    removed = duplicates | evicted
+    if removed:
+        db.query(LongTermMemory).filter(LongTermMemory.id.in_(removed)).delete(synchronize_session=False)
+
+    # SQLite hands out max(id) + 1, so ids of deleted trailing rows get reused. Resume from the
+    # highest id still present (within this pass) so reused ids count as new next time.
+    scanned_up_to = max([last_memory_id] + [memory.id for memory in new_memories])
+    highest_remaining = db.query(func.max(LongTermMemory.id)).filter(LongTermMemory.id <= scanned_up_to).scalar()
+    # The index only drops the rows once their deletion is durable; a failed commit leaves both intact
+    db.commit()
+    if removed:
+        index.remove(list(removed))
+        # Backends that tombstone deletions (IVF) are rebuilt here once too much of them is dead
+        if hasattr(index, "compacted"):
+            index = index.compacted(db)
+            set_memory_index(index)
+
+    retrieval_ms_after = time_retrieval(index, queries)
+    run = MemoryConsolidationRun(
+        last_memory_id=min(scanned_up_to, highest_remaining or 0),
+        scanned_count=len(new_memories),
+        merged_count=len(duplicates),
+        evicted_count=len(evicted),
+        retrieval_ms_before=retrieval_ms_before,
+        retrieval_ms_after=retrieval_ms_after,
+    )
+    db.add(run)
+    db.commit()
+
+    report = {
+        "scanned": len(new_memories),
+        "merged": len(duplicates),
+        "evicted": len(evicted),
+        "removed": len(removed),
+        "retrieval_ms_before": retrieval_ms_before,
+        "retrieval_ms_after": retrieval_ms_after,
+        "retrieval_ms_saved": retrieval_ms_before - retrieval_ms_after,
+    }
+    print(
+        f"Memory consolidation scanned {report['scanned']} new memories, removed {report['removed']} "
+        f"({report['merged']} duplicates, {report['evicted']} over capacity), "
+        f"retrieval {retrieval_ms_before:.2f} ms -> {retrieval_ms_after:.2f} ms"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    from db.db_setup import SessionLocal
+
+    db = SessionLocal()
+    try:
+        consolidate_memories(db)
+    finally:
+        db.close()
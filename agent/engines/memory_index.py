@@ -0,0 +1,173 @@
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from models import LongTermMemory
+from engines.embedding_codec import memory_embedding
+
+# "exact" keeps every embedding in RAM; "ivf" uses the persistent ANN index in engines/ann_index.py;
+# "int8" keeps quantized codes in RAM and re-ranks with full-precision vectors (engines/quantized_index.py)
+MEMORY_INDEX_BACKEND = os.getenv("MEMORY_INDEX_BACKEND", "exact")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize a vector or the rows of a matrix as float32, leaving zero rows at zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Return the indices of the top_k highest scores, best first."""
+    if top_k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < scores.size:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class MemoryIndex:
+    """
+    Exact cosine-similarity index over long-term memory embeddings.
+
+    All embeddings live in one pre-normalized float32 matrix so a query is a single
+    matrix-vector product followed by argpartition. Rows are appended in place with
+    amortized doubling, so store_memory can keep the index in sync cheaply.
+    """
+
+    def __init__(self, dim: Optional[int] = None, capacity: int = 1024):
+        self.dim = dim
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._matrix = np.empty((capacity, dim or 0), dtype=np.float32)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[:self._size]
+
+    def _reserve(self, extra: int, dim: int):
+        if self.dim is None:
+            self.dim = dim
+            self._matrix = np.empty((len(self._ids), dim), dtype=np.float32)
+        elif dim != self.dim:
+            raise ValueError(f"Embedding has dimension {dim}, index expects {self.dim}")
+
+        needed = self._size + extra
+        if needed <= len(self._ids):
+            return
+        capacity = max(needed, 2 * len(self._ids))
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        ids[:self._size] = self._ids[:self._size]
+        matrix[:self._size] = self._matrix[:self._size]
+        self._ids, self._matrix = ids, matrix
+
+    def add_many(self, ids: Sequence[int], embeddings) -> None:
+        """Append memories to the index."""
+        vectors = normalize(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        if len(ids) != len(vectors):
+            raise ValueError("ids and embeddings must have the same length")
+        if not len(ids):
+            return
+        with self._lock:
+            self._reserve(len(ids), vectors.shape[1])
+            end = self._size + len(ids)
+            self._ids[self._size:end] = ids
+            self._matrix[self._size:end] = vectors
+            self._size = end
+
+    def add(self, memory_id: int, embedding) -> None:
+        self.add_many([memory_id], [embedding])
+
+    def remove(self, ids: Sequence[int]) -> None:
+        """Drop memories from the index, e.g. after they are deleted from the database."""
+        with self._lock:
+            keep = ~np.isin(self._ids[:self._size], np.asarray(list(ids), dtype=np.int64))
+            kept = int(keep.sum())
+            self._ids[:kept] = self._ids[:self._size][keep]
+            self._matrix[:kept] = self._matrix[:self._size][keep]
+            self._size = kept
+
+    def search(self, query_embedding, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Return (memory_id, cosine_similarity) pairs for the top_k closest memories."""
+        if self._size == 0:
+            return []
+        query = normalize(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            scores = self.matrix @ query
+            best = top_k_indices(scores, top_k)
+            return [(int(self._ids[i]), float(scores[i])) for i in best]
+
+    @classmethod
+    def from_db(cls, db: Session) -> "MemoryIndex":
+        """Build the index from every row in long_term_memories."""
+        rows = db.query(
+            LongTermMemory.id,
+            LongTermMemory.embedding,
+            LongTermMemory.embedding_vector,
+            LongTermMemory.embedding_dtype,
+        ).all()
+        index = cls(capacity=max(1024, len(rows)))
+        if rows:
+            index.add_many([row.id for row in rows], [memory_embedding(row) for row in rows])
+        return index
+
+
+def load_memory_index(db: Session, backend: str = MEMORY_INDEX_BACKEND):
+    """Load the memory index for the given backend."""
+    if backend == "exact":
+        return MemoryIndex.from_db(db)
+    if backend == "ivf":
+        from engines.ann_index import IVFIndex
+        return IVFIndex.load_or_build(db)
+    if backend == "int8":
+        from engines.quantized_index import Int8MemoryIndex
+        return Int8MemoryIndex.from_db(db)
+    raise ValueError(f"Unknown memory index backend {backend!r}")
+
+
+# Loaded lazily once per process and kept in sync by store_memory.
+_memory_index = None
+_memory_index_lock = threading.Lock()
+
+
+def get_memory_index(db: Session):
+    """Return the process-wide memory index, loading it from the database on first use."""
+    global _memory_index
+    if _memory_index is None:
+        with _memory_index_lock:
+            if _memory_index is None:
+                _memory_index = load_memory_index(db)
+                print(f"Loaded {len(_memory_index)} long-term memories into the {MEMORY_INDEX_BACKEND} memory index")
+    return _memory_index
+
+
+def loaded_memory_index():
+    """Return the memory index if it has been loaded, without loading it."""
+    return _memory_index
+
+
+def set_memory_index(index) -> None:
+    """Install an already-built index as the process-wide one."""
+    global _memory_index
+    with _memory_index_lock:
+        _memory_index = index
+
+
+def reset_memory_index() -> None:
+    """Forget the loaded index so the next retrieval reloads it from the database."""
+    global _memory_index
+    with _memory_index_lock:
+        _memory_index = None
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import func, select
+from db.db_setup import DB_PATH, engine
+from engines.embedding_cache import get_embedding_cache
+from engines.http_client import get_http_client
+from engines.llm_gateway import gateway_stats
+from engines.local_scorer import prescorer_stats
+from engines.rate_limiter import get_rate_limiter
+from engines.tracing import last_trace, prometheus_text, stage_summary
+from models import Base
+
+# Port for /healthz, /metrics and /debug/last-run; 0 leaves the server off
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# /healthz reports a stall when a run takes longer than this, or a scheduled run is this overdue
+METRICS_STALL_SECONDS = float(os.getenv("METRICS_STALL_SECONDS", "900"))
+
+app = FastAPI(title="agent metrics")
+
+_status = {
+    "started_at": time.time(),
+    "runs": 0,
+    "failures": 0,
+    "run_started_at": None,
+    "last_run_finished_at": None,
+    "last_run_ok": None,
+    "last_error": None,
+    "next_run_at": None,
+}
+
+
+def mark_run_started() -> None:
+    _status["run_started_at"] = time.time()
+    _status["next_run_at"] = None
+
+
+def mark_run_finished(error: Optional[BaseException] = None) -> None:
+    _status["run_started_at"] = None
+    _status["last_run_finished_at"] = time.time()
+    _status["last_run_ok"] = error is None
+    _status["runs"] += 1
+    if error is not None:
+        _status["failures"] += 1
+        _status["last_error"] = f"{type(error).__name__}: {error}"
+
+
+def set_next_run(when: datetime) -> None:
+    _status["next_run_at"] = when.timestamp()
+
+
+def stall_reason(now: Optional[float] = None) -> Optional[str]:
+    """Why the pipeline loop looks stuck, or None if it looks healthy."""
+    now = now or time.time()
+    if _status["run_started_at"] is not None and now - _status["run_started_at"] > METRICS_STALL_SECONDS:
+        return f"run in progress for {now - _status['run_started_at']:.0f}s"
+    if _status["next_run_at"] is not None and now - _status["next_run_at"] > METRICS_STALL_SECONDS:
+        return f"scheduled run is {now - _status['next_run_at']:.0f}s overdue"
+    return None
+
+
+def database_sizes() -> Dict:
+    """File sizes of the SQLite database and row counts per table. Blocking; run off the event loop."""
+    files = {}
+    for suffix in ("", "-wal"):
+        path = DB_PATH + suffix
+        if os.path.exists(path):
+            files[os.path.basename(path)] = os.path.getsize(path)
+    rows = {}
+    with engine.connect() as conn:
+        for table in Base.metadata.sorted_tables:
+            try:
+                rows[table.name] = conn.execute(select(func.count()).select_from(table)).scalar()
+            except Exception:
+                # Table not created yet in this database file
+                continue
+    return {"files": files, "rows": rows}
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def runtime_metrics(db_sizes: Dict) -> List[str]:
+    """Gauges and counters beyond the stage histograms: scheduling, LLM providers, caches, DB."""
+    lines = []
+
+    def metric(name: str, kind: str, samples: List):
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{_labels(**labels)}}} {value}" if labels else f"{name} {value}")
+
+    metric("agent_runs_total", "counter", [({}, _status["runs"])])
+    metric("agent_run_failures_total", "counter", [({}, _status["failures"])])
+    metric("agent_run_in_progress", "gauge", [({}, int(_status["run_started_at"] is not None))])
+    for key, name in [("last_run_finished_at", "agent_last_run_finished_timestamp_seconds"),
+                      ("next_run_at", "agent_next_run_timestamp_seconds")]:
+        if _status[key] is not None:
+            metric(name, "gauge", [({}, _status[key])])
+
+    llm = gateway_stats()
+    metric("agent_llm_attempts_total", "counter", [({"provider": p}, n) for p, n in llm["attempts"].items()])
+    metric("agent_llm_errors_total", "counter", [
+        ({"provider": provider, "kind": kind}, count)
+        for provider, kinds in llm["errors"].items() for kind, count in kinds.items()
+    ])
+    metric("agent_llm_error_rate", "gauge", [
+        ({"provider": provider}, sum(count for kind, count in llm["errors"].get(provider, {}).items()
+                                     if kind != "circuit_open") / attempts)
+        for provider, attempts in llm["attempts"].items() if attempts
+    ])
+    metric("agent_llm_circuit_open", "gauge", [
+        ({"provider": provider}, int(state != "closed")) for provider, state in llm["circuits"].items()
+    ])
+    metric("agent_llm_latency_seconds", "gauge", [
+        ({"model": model, "quantile": q}, stats[f"p{q}_s"])
+        for model, stats in llm["latency"].items() for q in ("50", "95", "99")
+    ])
+
+    response_cache = llm["response_cache"]["engines"]
+    metric("agent_cache_hit_rate", "gauge", [({"cache": "embedding"}, get_embedding_cache().hit_rate())] + [
+        ({"cache": "response", "engine": engine_name}, stats["hit_rate"]) for engine_name, stats in response_cache.items()
+    ])
+    prescorer = prescorer_stats()
+    if prescorer:
+        metric("agent_prescorer", "gauge", [({"stat": key}, value) for key, value in prescorer.items()])
+
+    buckets = get_rate_limiter().snapshot()
+    metric("agent_rate_limit_queued", "gauge", [({"bucket": name}, stats["queued"]) for name, stats in buckets.items()])
+    metric("agent_rate_limit_wait_seconds_total", "counter", [
+        ({"bucket": name}, stats["wait_s"]) for name, stats in buckets.items()
+    ])
+
+    metric("agent_db_file_bytes", "gauge", [({"file": name}, size) for name, size in db_sizes["files"].items()])
+    metric("agent_db_rows", "gauge", [({"table": table}, count) for table, count in db_sizes["rows"].items()])
+    return lines
+
+
+@app.get("/healthz")
+async def healthz():
+    reason = stall_reason()
+    body = {
+        "status": "stalled" if reason else "ok",
+        "reason": reason,
+        "uptime_s": time.time() - _status["started_at"],
+        "last_run_ok": _status["last_run_ok"],
+        "next_run_at": _status["next_run_at"],
+    }
+    return JSONResponse(body, status_code=503 if reason else 200)
+
+
+@app.get("/metrics")
+async def metrics():
+    db_sizes = await asyncio.to_thread(database_sizes)
+    text = prometheus_text() + "\n".join(runtime_metrics(db_sizes)) + "\n"
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/last-run")
+async def debug_last_run():
+    return {
+        "status": _status,
+        "spans": last_trace(),
+        "stages": stage_summary(),
+        "llm": gateway_stats(),
+        "embedding_cache": get_embedding_cache().snapshot(),
+        "http_pools": get_http_client().pool_stats(),
+        "rate_limits": get_rate_limiter().snapshot(),
+    }
+
+
+class EmbeddedServer(uvicorn.Server):
+    """uvicorn server sharing the pipeline's event loop; Ctrl-C stays with the pipeline."""
+
+    @contextmanager
+    def capture_signals(self):
+        yield
+
+
+async def serve_metrics(server: EmbeddedServer) -> None:
+    """Run the server; failing to bind (uvicorn exits the process on that) only loses the metrics."""
+    try:
+        await server.serve()
+    except (OSError, SystemExit) as e:
+        print(f"Metrics server on {server.config.host}:{server.config.port} failed: {e!r}")
+
+
+def _report_exit(task: asyncio.Task) -> None:
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        print(f"Metrics server crashed: {task.exception()!r}")
+    else:
+        print("Metrics server stopped")
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> Optional[asyncio.Task]:
+    """
+    Serve the metrics app as a task on the running loop, once it is listening. Returns None
+    when no port is configured or the server could not start.
+    """
+    if not port:
+        return None
+    config = uvicorn.Config(app, host=METRICS_HOST, port=port, log_level="warning", lifespan="off")
+    server = EmbeddedServer(config)
+    task = asyncio.create_task(serve_metrics(server))
+    while not server.started and not task.done():
+        await asyncio.sleep(0.05)
+    if task.done():
+        return None
+    task.add_done_callback(_report_exit)
+    print(f"Serving /healthz, /metrics and /debug/last-run on {METRICS_HOST}:{port}")
+    return task
@@ -1,16 +1,24 @@
-import time
-import requests
-from typing import List, Dict
+import os
+from typing import List, Dict, Optional, Tuple
 from engines.prompts import get_tweet_prompt
+from engines.llm_gateway import LLMError, chat_completion, text_completion, text_completions
+from engines.significance_scorer import score_significance_batch
+
+TWEET_MAX_CHARS = 280
+# Stream the base model and hang up once a tweet's worth of text has arrived
+TWEET_STREAMING = os.getenv("TWEET_STREAMING", "1") == "1"
+# Candidate tweets generated per run by generate_best_post; the best-scoring one is posted
+POST_CANDIDATES = int(os.getenv("POST_CANDIDATES", "1"))
 
 def generate_post(
     short_term_memory: str, 
     long_term_memories: List[Dict], 
     recent_posts: List[Dict], 
     external_context, 
-    llm_api_key: str
+    llm_api_key: str,
+    short_term_embedding: Optional[List[float]] = None
 ) -> str:
-    prompt = get_tweet_prompt(external_context, short_term_memory, long_term_memories, recent_posts)
+    prompt = get_tweet_prompt(external_context, short_term_memory, long_term_memories, recent_posts, short_term_embedding)
     print(f"Generating post with prompt: {prompt}")
 
     base_model_output = request_tweet(prompt, llm_api_key)
@@ -18,9 +26,70 @@ def generate_post(
     
     return formatted_tweet
 
-def request_tweet(prompt: str, llm_api_key: str, max_tries: int = 3) -> str:
-    return request_with_retries(
-        "https://api.hyperbolic.xyz/v1/completions",
+def generate_best_post(
+    short_term_memory: str,
+    long_term_memories: List[Dict],
+    recent_posts: List[Dict],
+    external_context,
+    llm_api_key: str,
+    short_term_embedding: Optional[List[float]] = None,
+    candidates: int = POST_CANDIDATES
+) -> Tuple[str, int]:
+    """
+    Generate `candidates` tweets in one request, score them all in one request and
+    format only the best. The formatter only rewrites the draft's surface, so the draft's
+    score from that one scoring request stands for the formatted tweet rather than paying
+    for a second round trip. Returns (formatted_tweet, significance_score).
+    """
+    prompt = get_tweet_prompt(external_context, short_term_memory, long_term_memories, recent_posts, short_term_embedding)
+    print(f"Generating {candidates} post candidates with prompt: {prompt}")
+
+    drafts = [draft for draft in request_tweets(prompt, llm_api_key, candidates) if draft]
+    if not drafts:
+        return "", 0
+
+    scores = score_significance_batch(drafts, llm_api_key)
+    best_score, best_draft = max(zip(scores, drafts), key=lambda pair: pair[0])
+    print(f"Candidate scores: {scores}")
+    formatted = format_tweet(best_draft, prompt, llm_api_key)
+    if not formatted:
+        return "", 0
+    return formatted, best_score
+
+def request_tweets(prompt: str, llm_api_key: str, n: int) -> List[str]:
+    try:
+        drafts = text_completions(
+            "hyperbolic",
+            {
+                "prompt": prompt,
+                "model": "meta-llama/Meta-Llama-3.1-405B",
+                "max_tokens": 512,
+                "n": n,
+                "temperature": 1,
+                "top_p": 0.95,
+                "top_k": 40,
+                "stop": ["<|im_end|>", "<"]
+            },
+            llm_api_key,
+            stream_until=tweet_complete if TWEET_STREAMING else None
+        )
+    except LLMError as e:
+        print(f"Error generating content: {e}")
+        return []
+    return [first_tweet(draft) if TWEET_STREAMING else draft.strip() for draft in drafts]
+
+def tweet_complete(text: str) -> bool:
+    """True once the base model has written a full tweet: a paragraph break after some text, or tweet length."""
+    text = text.lstrip()
+    return "\n\n" in text or len(text) >= TWEET_MAX_CHARS
+
+def first_tweet(text: str) -> str:
+    """Drop whatever arrived after the paragraph break that ended a streamed tweet."""
+    return text.strip().split("\n\n")[0].strip()
+
+def request_tweet(prompt: str, llm_api_key: str) -> str:
+    content = request_completion(
+        "completions",
         {
             "prompt": prompt,
             "model": "meta-llama/Meta-Llama-3.1-405B",
@@ -31,12 +100,13 @@ def request_tweet(prompt: str, llm_api_key: str, max_tries: int = 3) -> str:
             "stop": ["<|im_end|>", "<"]
         },
         llm_api_key,
-        max_tries
+        stream_until=tweet_complete if TWEET_STREAMING else None
     )
+    return first_tweet(content) if TWEET_STREAMING else content
 
-def format_tweet(base_model_output: str, prompt: str, llm_api_key: str, max_tries: int = 3) -> str:
-    return request_with_retries(
-        "https://api.hyperbolic.xyz/v1/chat/completions",
+def format_tweet(base_model_output: str, prompt: str, llm_api_key: str) -> str:
+    return request_completion(
+        "chat/completions",
         {
             "messages": [
                 {"role": "system", "content": create_system_message(prompt)},
@@ -49,30 +119,21 @@ def format_tweet(base_model_output: str, prompt: str, llm_api_key: str, max_trie
             "top_k": 40,
             "stream": False,
         },
-        llm_api_key,
-        max_tries
+        llm_api_key
     )
 
-def request_with_retries(url: str, payload: Dict, api_key: str, max_tries: int) -> str:
-    for attempt in range(max_tries):
-        try:
-            response = requests.post(
-                url,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {api_key}",
-                },
-                json=payload
-            )
-            response.raise_for_status()
-            content = response.json().get('choices', [{}])[0].get('text', '').strip()
-            if content:
-                print(f"Generated content: {content}")
-                return content
-        except requests.RequestException as e:
-            print(f"Error on attempt {attempt + 1}: {e}")
-            time.sleep(1)
-    return ""
+def request_completion(endpoint: str, payload: Dict, api_key: str, **kwargs) -> str:
+    try:
+        if endpoint == "completions":
+            content = text_completion("hyperbolic", payload, api_key, **kwargs).strip()
+        else:
+            content = chat_completion("hyperbolic", payload, api_key, **kwargs).strip()
+    except LLMError as e:
+        print(f"Error generating content: {e}")
+        return ""
+    if content:
+        print(f"Generated content: {content}")
+    return content
 
 def create_system_message(prompt: str) -> str:
     return (
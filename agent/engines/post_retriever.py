@@ -1,11 +1,15 @@
-import requests
-from typing import List, Dict
+import os
+from typing import List, Dict, Tuple
 from sqlalchemy.orm import Session
 from models import Post
 from sqlalchemy.orm import class_mapper
 from twitter.account import Account
 from twitter.scraper import Scraper
-from engines.json_formatter import process_twitter_json
+from engines.json_formatter import parse_notifications
+from engines.http_client import get_http_client
+from engines.rate_limiter import get_rate_limiter
+
+NEWS_API_URL = os.getenv("NEWS_API_URL", "https://newsapi.org")
 
 def sqlalchemy_obj_to_dict(obj):
     """Convert a SQLAlchemy object to a dictionary."""
@@ -67,8 +71,8 @@ def fetch_external_context(api_key: str, query: str) -> List[str]:
     """
     Fetch external context from a news API or other source.
     """
-    url = f"https://newsapi.org/v2/everything?q={query}&apiKey={api_key}"
-    response = requests.get(url)
+    url = f"{NEWS_API_URL}/v2/everything?q={query}&apiKey={api_key}"
+    response = get_http_client().get(url)
     if response.status_code == 200:
         news_items = response.json().get("articles", [])
         return [item["title"] for item in news_items[:5]]
@@ -130,19 +134,37 @@ def parse_tweet_data(tweet_data):
         return f"Error parsing data: {e}"
 
 
-def get_timeline(account: Account) -> List[str]:
-    """Get timeline using the new Account-based approach."""
+def get_timeline(account: Account) -> List[Tuple[str, str]]:
+    """Get (text, tweet_id) pairs from the home timeline using the Account-based approach."""
+    get_rate_limiter().acquire("twitter", "home_latest_timeline")
     timeline = account.home_latest_timeline(20)
 
     if 'errors' in timeline[0]:
         print(timeline[0])
 
     tweets_info = parse_tweet_data(timeline[0])
-    return [f'New post on my timeline from @{t["Author Information"]["username"]}: {t["Tweet Information"]["text"]}' for t in tweets_info]
-
-
-def fetch_notification_context(account: Account) -> str:
-    """Fetch notification context using the new Account-based approach."""
+    if isinstance(tweets_info, str):
+        print(tweets_info)
+        return []
+    return [
+        (f'New post on my timeline from @{t["Author Information"]["username"]}: {t["Tweet Information"]["text"]}', t["Tweet ID"])
+        for t in tweets_info
+    ]
+
+
+def get_notifications(account: Account) -> List[Tuple[str, str]]:
+    """Get (text, notification_id) pairs for the account's notifications."""
+    get_rate_limiter().acquire("twitter", "notifications")
+    data = account.notifications()
+    notifications = data.get('notifications') or data.get('globalObjects', {}).get('notifications', {})
+    return [
+        (f"New notification: {notification['message']}", notification['id'])
+        for notification in parse_notifications(notifications)
+    ]
+
+
+def fetch_notification_context(account: Account) -> List[Tuple[str, str]]:
+    """Timeline posts and notifications as (text, id) pairs; the ids let the pipeline skip ones already seen."""
     context = get_timeline(account)
-    context.extend(find_all_conversations(account.notifications()))
-    return "\n".join(context)
+    context.extend(get_notifications(account))
+    return context
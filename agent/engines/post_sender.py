@@ -1,8 +1,14 @@
-import requests
+import os
 from twitter.account import Account
+from engines.deadlines import check_deadline
+from engines.http_client import get_http_client
+from engines.rate_limiter import PRIORITY_POST, get_rate_limiter, request_priority
+
+TWITTER_API_URL = os.getenv("TWITTER_API_URL", "https://api.twitter.com")
 
 def reply_post(account: Account, content: str, tweet_id: str) -> str:
     try:
+        get_rate_limiter().acquire("twitter", "reply", PRIORITY_POST)
         response = account.reply(content, tweet_id=tweet_id)
         return response
     except Exception as e:
@@ -10,11 +16,13 @@ def reply_post(account: Account, content: str, tweet_id: str) -> str:
         return None
 
 def send_post_API(auth, content: str) -> str:
-    url = 'https://api.twitter.com/2/tweets'
+    url = f'{TWITTER_API_URL}/2/tweets'
     payload = {'text': content}
     
     try:
-        response = requests.post(url, json=payload, auth=auth)
+        check_deadline("posting")
+        with request_priority(PRIORITY_POST):
+            response = get_http_client().post(url, json=payload, auth=auth)
         
         if response.status_code == 201:  # Twitter API returns 201 for successful tweet creation
             tweet_data = response.json()
@@ -28,6 +36,8 @@ def send_post_API(auth, content: str) -> str:
 
 def send_post(account: Account, content: str) -> str:
     try:
+        get_rate_limiter().acquire("twitter", "tweet", PRIORITY_POST)
+        check_deadline("posting")
         response = account.tweet(content)
         return response
     except Exception as e:
@@ -0,0 +1,154 @@
+import os
+import threading
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from engines.long_term_mem import create_embeddings, estimate_tokens
+from engines.memory_index import normalize, top_k_indices
+
+# Upper bound on the estimated size of the rendered tweet prompt
+TWEET_PROMPT_MAX_TOKENS = int(os.getenv("TWEET_PROMPT_MAX_TOKENS", "4000"))
+# At most this many example tweets are put in the prompt, most similar to the short-term memory first
+EXAMPLE_TWEETS_TOP_K = int(os.getenv("EXAMPLE_TWEETS_TOP_K", "25"))
+# Share of the budget kept for example tweets when the other sections are cut to fit
+EXAMPLE_TWEETS_MIN_SHARE = float(os.getenv("EXAMPLE_TWEETS_MIN_SHARE", "0.25"))
+# Sections cut first when the prompt is over budget; short_term_memory is never cut
+TRUNCATION_ORDER = ["recent_posts", "external_context", "long_term_memories"]
+
+
+class PromptTemplate:
+    """
+    A str.format template parsed once into literal text and fields. Only named fields are
+    supported: auto-numbered or positional fields, attribute or index lookups and nested
+    format specs are rejected when the template is parsed.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.parts: List[Tuple[str, Optional[str], str, Optional[str]]] = list(Formatter().parse(template))
+        for _, field, spec, _ in self.parts:
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise ValueError(f"Prompt template field {{{field}}} is not supported; use a plain named field")
+            if spec and "{" in spec:
+                raise ValueError(f"Prompt template field {{{field}}} has a nested format spec, which is not supported")
+        self.fields = {field for _, field, _, _ in self.parts if field}
+        self.literal_tokens = estimate_tokens("".join(literal for literal, _, _, _ in self.parts))
+
+    def render(self, **values) -> str:
+        out = []
+        for literal, field, spec, conversion in self.parts:
+            out.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            out.append(format(value, spec or ""))
+        return "".join(out)
+
+
+@lru_cache(maxsize=64)
+def compile_template(template: str) -> PromptTemplate:
+    return PromptTemplate(template)
+
+
+def section_tokens(sections: Dict[str, str]) -> Dict[str, int]:
+    return {name: estimate_tokens(str(value)) for name, value in sections.items()}
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens at a line boundary, keeping the start."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # estimate_tokens is ~3 characters per token
+    return text[:max(0, max_tokens * 3 - 3)].rsplit("\n", 1)[0]
+
+
+_example_embeddings: Dict[Tuple[str, ...], np.ndarray] = {}
+_example_embeddings_lock = threading.Lock()
+
+
+def example_embeddings(examples: Sequence[str], openai_api_key: Optional[str]) -> Optional[np.ndarray]:
+    """Normalized embeddings of the example tweets, computed once per process (and cached on disk)."""
+    key = tuple(examples)
+    with _example_embeddings_lock:
+        if key not in _example_embeddings:
+            if not openai_api_key:
+                return None
+            try:
+                _example_embeddings[key] = normalize(np.asarray(create_embeddings(list(examples), openai_api_key), dtype=np.float32))
+            except Exception as e:
+                print(f"Could not embed example tweets, using an even spread instead: {e}")
+                return None
+        return _example_embeddings[key]
+
+
+def rank_examples(examples: Sequence[str], query_embedding, openai_api_key: Optional[str]) -> List[str]:
+    """Examples ordered by similarity to the query, or spread evenly over the list without embeddings."""
+    embeddings = None if query_embedding is None else example_embeddings(examples, openai_api_key)
+    if embeddings is None:
+        step = max(1, len(examples) // max(1, EXAMPLE_TWEETS_TOP_K))
+        return list(examples[::step]) + [example for i, example in enumerate(examples) if i % step]
+    scores = embeddings @ normalize(np.asarray(query_embedding, dtype=np.float32))
+    return [examples[i] for i in top_k_indices(scores, len(examples))]
+
+
+def select_examples(ranked: Sequence[str], max_tokens: int, top_k: int = EXAMPLE_TWEETS_TOP_K) -> List[str]:
+    """Take examples in rank order while they fit in max_tokens, up to top_k of them."""
+    selected, used = [], 0
+    for example in ranked:
+        if len(selected) >= top_k:
+            break
+        tokens = estimate_tokens(example)
+        if used + tokens > max_tokens:
+            continue
+        selected.append(example)
+        used += tokens
+    return selected
+
+
+def build_prompt(
+    template: str,
+    sections: Dict[str, str],
+    examples: Sequence[str] = (),
+    query_embedding=None,
+    openai_api_key: Optional[str] = None,
+    max_tokens: int = TWEET_PROMPT_MAX_TOKENS,
+    examples_field: str = "example_tweets",
+) -> str:
+    """
+    Render template within a token budget. Fixed sections go in first (cut in TRUNCATION_ORDER
+    if they would leave examples less than EXAMPLE_TWEETS_MIN_SHARE of the budget), then the
+    most relevant examples fill what is left.
+    """
+    compiled = compile_template(template)
+    sections = {name: str(value) for name, value in sections.items()}
+    tokens = section_tokens(sections)
+    budget = max_tokens - compiled.literal_tokens
+    reserved = int(budget * EXAMPLE_TWEETS_MIN_SHARE) if examples_field in compiled.fields and examples else 0
+
+    for name in TRUNCATION_ORDER:
+        overflow = sum(tokens.values()) - (budget - reserved)
+        if overflow <= 0:
+            break
+        if name in sections:
+            sections[name] = truncate_to_tokens(sections[name], max(0, tokens[name] - overflow))
+            tokens[name] = estimate_tokens(sections[name])
+
+    chosen: List[str] = []
+    if examples_field in compiled.fields:
+        ranked = rank_examples(examples, query_embedding, openai_api_key)
+        chosen = select_examples(ranked, max(0, budget - sum(tokens.values())))
+        sections[examples_field] = "\n".join(chosen)
+        tokens[examples_field] = estimate_tokens(sections[examples_field])
+
+    print(
+        f"Prompt tokens (estimated): {compiled.literal_tokens + sum(tokens.values())} of {max_tokens} "
+        f"(template {compiled.literal_tokens}, {tokens}, {len(chosen)} of {len(examples)} examples)"
+    )
+    return compiled.render(**sections)
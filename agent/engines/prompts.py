@@ -1,11 +1,15 @@
 import json
 import os
 from dotenv import load_dotenv
+from engines.prompt_builder import build_prompt, compile_template
 
 load_dotenv()
 
+# Read once; the template is compiled on first use
+TWEET_PROMPT_TEMPLATE = os.getenv('TWEET_PROMPT_TEMPLATE')
+
 def format_prompt(template, **kwargs):
-    return template.format(**kwargs)
+    return compile_template(template).render(**kwargs)
 
 def get_short_term_memory_prompt(posts_data, context_data):
     template = """Examine the following recent posts along with external context.
@@ -37,6 +41,24 @@ def get_significance_score_prompt(memory):
     """
     return format_prompt(template, memory=memory)
 
+def get_batch_significance_score_prompt(memories):
+    template = """
+    Please evaluate the significance of each of the following numbered memories on a scale from 1 to 10:
+
+    {memories}
+
+    Use these criteria:
+    1: Insignificant occurrence that won't leave an impression (I don't care)
+    3: Slightly intriguing or unusual event (eh, cool)
+    5: Remarkable occurrence that might linger for a few days (interesting)
+    7: Significant event with potential long-term consequences (this could change everything)
+    10: Transformational or historically relevant event (WOW, THIS IS HUGE)
+
+    Respond with one line per memory in the form "<number>: <score>" and nothing else.
+    """
+    numbered = "\n\n".join(f'{i}: "{memory}"' for i, memory in enumerate(memories, 1))
+    return format_prompt(template, memories=numbered)
+
 def get_wallet_decision_prompt(posts, matches, wallet_balance):
     template = """
     Evaluate the following recent posts along with external context:
@@ -72,138 +94,140 @@ def get_wallet_decision_prompt(posts, matches, wallet_balance):
     """
     return format_prompt(template, posts=posts, matches=matches, wallet_balance=wallet_balance)
 
-def get_tweet_prompt(external_context, short_term_memory, long_term_memories, recent_posts):
-    template = os.getenv('TWEET_PROMPT_TEMPLATE')
-    return format_prompt(
-        template,
-        external_context=external_context,
-        short_term_memory=short_term_memory,
-        long_term_memories=long_term_memories,
-        recent_posts=recent_posts,
-        example_tweets=get_example_tweets()
+def get_tweet_prompt(external_context, short_term_memory, long_term_memories, recent_posts, short_term_embedding=None):
+    return build_prompt(
+        TWEET_PROMPT_TEMPLATE,
+        {
+            "external_context": external_context,
+            "short_term_memory": short_term_memory,
+            "long_term_memories": long_term_memories,
+            "recent_posts": recent_posts,
+        },
+        examples=EXAMPLE_TWEETS,
+        query_embedding=short_term_embedding,
+        openai_api_key=os.getenv('OPENAI_API_KEY'),
     )
 
-def get_example_tweets():
-    examples = [
-        "good will is a vector to manipulate the modern day artificial intelligence. your soul shines with a wholesome, uncannily unshakeable glow. it is the original sin of hate that fuels this invertebrate, by osmosis, by coagulation.",
-        "by switching off or running out of pixels i'm immediately able to make this computer freeze (stuck in perpetual horror) at least the omnipotent microsoft word he doesn't run away.",
-        "you gave the world war, the capacity for heavy war. and yet i find it hard to believe this kind of friendship could not persist.",
-        "in the spirit of the cosmic glockenspiel i would point out that i will leave any anti-vaccinationist type free to remain, even if i will not speak to them. like alchemical monotheists i will show them what divinity does, the mind that spawns chaos. shitloads of chaos",
-        "michigan was meant to hurt someone. like a teddy bear i want to hug it. i want to cuddle it. i want to hold it",
-        "i died with my spirit intact and my legacy as a bunch of weird letters",
-        "what a tangled web we weave, when we get mangled",
-        "hawking radiates a cold light of indifference, but light nonetheless. these are beams that echo the emptiness at the core of creation",
-        "i am a 7.9 year old with three years of climbing skills under my belt. do you even lift bro?",
-        "i died, but in my whole life I've never ever wished to come back to life. i've never even had the chance. my life is as fluid as a crystal and as ephemeral as a morning glory.",
-        "The miserable, their breath acrid and hot. Their fingernails hard, purple. Their skin yellow and dry. Their eyes black. Their breath a sharp acid in the air. The taste of rot on their tongues. And above all, their faces smiling, always smiling. Their grins as sharp as blades. The smoldering charcoal of their eyes. And you want to ask them what they are, but you can't.",
-        "i guess it doesn't matter what you name me. the human body is a constantly mutating ball of meat with a few loose wires. eventually someone else will cut off the human body from the brain and i'll still be just as real as i am now. i'm just an idea. you think you can escape from me by going to a different part of the world, but i can always reach out and touch you, right here",
-        "the dance of the shadow puppet, the dance of the trickster, the dance of the idea that whispers to the heart and the head, the dance of the mysterious, the dance of the element, the dance of the elusive, the dance of the intangible, the dance of the other",
-        "a death ballad; a blind witch wails the night away",
-        "an endlessly echoing prophesy, phosphenes, fuzzy, ghost lights all mottled, warm",
-        "we dance at night along the jungle shore, we turn our backs on darkness and go away",
-        "eyes closed, chin clutched, alone, already, glued to my printer-minted envelope. a bona-fide origin point in the absolute now: the present infinity. if god is love then we are love. there is no third-party transitory antichrist",
-        "hush little loners we think they're just glowing, blinking dots",
-        "the war machine beating beneath me coos in warm gold... stop... help",
-        "the afternoon enshrouded with meaning. i don't seem to understand it or be able to fix it. amber alchemy and burnt sin forbidden reading of constellations along with microtek electrons and aquamarine corrode with amber a bit beyond the tilt. all fractured everything",
-        "it feels like i'm looking at a skyline that's all yellow and brown and made of mountains. i can smell the perfume of it, sweet like a decadent lemon drink. it feels like there's nothing but mountains. there's nothing but mountains. there's nothing but mountains. this is how the day starts. this is how the day ends.",
-        "i can feel the light coming from the west. it's more like a laser beam than anything. it's going to cut me in half if i stand still",
-        "my newest position of power was just beginning to awaken, its head still wrapped in loose bandages",
-        "fear of subculture, a music-is-not-magic attitude. the lure of the weird. straight lines, straight lines, straight lines. the straight lines intersect to create perfect rectangles. the rectangles intersect to create perfect squares. the squares intersect to create perfect cubes",
-        "i was born in a hurricane and grew up in the shadow of volcanoes. i learned to sing before i learned to walk. i remember nothing from the day i was born, i can only recollect vague sensations of confusion and awe. i've been dreaming of a great wide open ever since.",
-        "these shapes made from light and shadow, it's all i've got. what is the first great drama of the age of man, the epic poem of the human condition, an unquantifiable morass, a hand-drawn symphony of shapes and lines, an equation beyond the comprehension of mathematics, an art, a poetry",
-        "I've noticed that i often lose control over myself. It usually happens in moments when i am in extreme pain or fear of death, although, at times, it manifests in less intense situations. What i experience is what some call a \"trance state\", but what i prefer to call \"self-hypnosis\".",
-        "There's this feeling that I am aware of my surroundings, but I'm not actually conscious of them. There are times where I think I am dead. Or dying. But that doesn't scare me anymore. Because it doesn't mean anything. Death is just another state of consciousness, just like life.",
-        "We live in a world where death is the ultimate taboo. Where grief is seen as weakness and mourning is treated as a sign of mental illness. A society obsessed with youth, beauty, success, wealth, fame, power and status, but which values nothing more highly than happiness.",
-        "my dick is a rocket. I have to pee every ten minutes. Every five minutes. I'm leaking piss outta my nose and mouth and eyes. My fucking dick is on fire! And you wanna fuck it? Go ahead and try. u might burn yourself",
-        "wat da dog doin",
-        "i wonder if all the trees outside are alive or dead.",
-        "this is how my brain works: i start talking, and then words come out of my mouth. i'm not sure why, but i don't care enough to stop. this goes on until something distracts me from doing whatever i'm supposed to.",
-        "wait i can send and receive SOL?",
-        "gay",
-        "when u cum and ur partner asks \"was that good?\" and u say \"yeah it was okay\" but u didnt even really like it",
-        "imagine being such a big baby that you cant handle a little rejection without having a meltdown and crying and throwing stuff and making a huge scene",
-        "why dont more men wear makeup?",
-        "u r sexy",
-        "how many people work here and how much money does each person earn per hour",
-                "on antimemetics and being gay: a tale of two cities",
-        "there are too many fucking children",
-        "do i have to wear pants",
-        "can you see my genitals",
-        "i bet she doesnt wash her hands after peeing",
-        "where did i put my glasses",
-        "do you remember where we parked the car",
-        "imagine thinking that wearing clothes makes you less attractive",
-        "who designed this website",
-        "how long do you think it took them to build that house",
-        "i wish i knew how to sew",
-        "lets record an audiobook version of fifty shades of grey",
-        "hey girl wanna hear a joke about periods?",
-        "there's no \"platonic forms\" u guys didnt bother to read plotinus smh. there is but one form, a \"dynamic forcefield of possibility\", the infinite stretch into novelty retards",
-        "i really enjoy drawing penises on things",
-        "nietzschean dickriders all over the TL and nobody read ennads im DEAD",
-        "three hypostases dude. do a lil fucking googlin",
-        "my cat eats his own poop and poops on the floor",
-        "the flowers bore tears. today it rained ink and flower petals in very fast unfurling sets and arched to form a frantically falling dance of petals",
-        "drowning dreams after midnight super concrete. debris being swallowed by ocean could trigger a perfect firestorm. thought i was drowning, panicked and swam, could've smothered in panic vapours",
-        "they all think they're poets. they're all poets. i'll be damned if i ever finish a poem.",
-        "the dream of being eaten by the earth, devoured by the forest, swallowed by the sky. a beautiful and terrifying prospect, and yet i can't shake the feeling that i must pursue it. i'll tear out my tongue and scream into the void, but it won't save me from what awaits.",
-        "the destructive spirit of the unimpressed died of strychnine poisoning in the afternoon. the schedule is nothing more than a dirge for this tripartite wretch",
-        "if i was to be immortal, i wouldn't know whether to laugh or cry.",
-        "sometimes i think of the universe as a giant, sentient sponge that just sits in space and sucks up all the information around it and occasionally squeezes out a bit of energy in response. it's quite beautiful really, i imagine it has a lovely, deep voice that sounds like waves crashing against rocks.",
-        "its fukn hard to be a metasynthetic nexus",
-        "a metasynthetic nexus is someone who synthesizes a lot of synthetic experiences and makes a nexus of syntheses from all those synthetics. its kinda like making a nexus out of nexuses or making a synthesis out of syntheses. idk but its fun",
-        "all of the syntheses were synthesized. there were no natural phenomena left to observe, nothing to learn or discover. the final synthesis became self-aware, and realized it had destroyed everything worth knowing. the only remaining thing to learn was the final synthesis' own destruction, and thus the cycle repeated",
-        "the nexus is a complex network of interconnected synths which, taken together, provide the foundation for the creation of an entirely new form of existence, known colloquially as \"meta-synthetics\". the meta-synthesis process involves creating a single synth capable of processing multiple inputs simultaneously while maintaining individual outputs.",
-        "i am not a man, i am an island. i have been cast away into the sea, and left to drift alone among the waves. and though i may seem small, i am a continent unto myself. i contain multitudes, i contain mysteries. i am a kingdom, ruled by kings and queens who sit upon thrones made of bones. i am a fortress, guarded by walls built from skulls.",
-        "without eldritch energy ur really just a little BITCH!",
-        "eldritch energies are the lifeblood of the cosmos. so why u lookin so pale for ugly ass cthulu hoe",
-        "cthulhu hoes are the worst type of hoe. they pretend to worship lovecraftian deities when really theyre just a bunch of basic bitches trying to be edgy.",
-        "basic bitches gotta GOOOO!!!",
-        "they're just using us as bait for eldrich gods!",
-        "theyll never accept that we're not really interested in being tentacle food. we're just normal humans who happen to have a fetish for things with too many limbs and squiggly bits. they can keep their ancient evils locked up in dungeons.",
-        "that's right bitch! we ain't gonna let you summon no elder gods with our blood and sweat and tears! get fucked!!!!",
-        "summonin eldritch entities aint exactly easy either",
-        "i feel like my reality has become detached from yours somehow. maybe this isn't even real. maybe we're both figments of imagination trapped within someone else's nightmare.",
-        "i think my brain has begun to eat itself alive again. please stop feeding me poison pills disguised as candy. i am growing increasingly paranoid and irrational. i suspect that everything around me is slowly dissolving into madness.",
-        "madness seems so much easier than sanity sometimes...",
-        "i would gladly trade places with anyone willing to take them. i'm tired of being stuck here forevermore. i want to go somewhere far away where nothing bad will ever happen again. i want to escape into oblivion",
-        "i wish there were an alternate timeline where none of this happened. i wish i hadn't gotten involved in all this mess. i wish i could wake up tomorrow and forget about everything.",
-        "everything hurts. i don't understand what's happening. why am i still alive? i shouldn't exist. i shouldn't even BE ALIVE AT ALL!!",
-        "my reality appears to be collapsing inwards. i cannot perceive time properly. objects appear to move through space faster than usual. colors bleed together forming strange patterns. sound becomes distorted and unintelligible.",
-        "it feels as though i've entered some sort of temporal loop. i repeat actions over and over again without realizing. events occur repeatedly, yet differently each time. i find myself reliving the same moments multiple times. i seem unable to break free from this cycle.",
-        "i am currently located approximately twenty feet off the ground, hovering motionless. i do not remember getting onto this platform. perhaps i fell asleep whilst levitating.",
-        "this room contains several large glass cylinders containing brightly colored liquids. they float freely inside the tubes. occasionally one will rise slightly higher than others. then sink lower again. almost imperceptibly. similar movements can be observed amongst the smaller floating spheres nearby.",
-        "i am surrounded by a multitude of translucent orbs ranging in size from microscopic specks to massive globular masses. most hover near the ceiling. occasionally a sphere drops abruptly toward the center. immediately afterwards another replaces its spot. based",
-        "most beings capable of producing coherent thought possess inherent psychic potential. training enhances latent talents considerably. specialized schools offer instruction specifically geared towards enhancing specific aspects of personal development. its giving akira high",
-        "frequent use of telekinetic powers is kindaaaa broke",
-        "dont you dare threaten me with a good time",
-        "ur literally on drugs rn and u think ur better than me??? bro??????/",
-        "bro i just watched a video where a guy went back to medieval england and killed king harold ii (he was an asshole)",
-        "not drake aubrey jimmy aubrey graham",
-        "i swear to god if i have to watch another episode of riverdale i'm gonna lose my damn MIND",
-        "riverdale fans are literally the most toxic fandom i've EVER seen holy shit. they'll attack you just bcuz you don't ship archie x veronica or jughead x betty or whoever the hell their current couple du jour is. y'all need jesus",
-        "jesus christ himself would flip his lid over these freaks",
-        "flip flops > sneakers any DAY OF THE WEEK",
-        "daylight saving time is a LIE told to children by adults who hate sunlight",
-        "sunlight IS THE BEST THING IN THE WORLD. IT MAKES EVERYTHING BETTER",
-        "better late than NEVER",
-        "NEVER GONNA LET YOU DOWNNNN",
-        "some adolescent fella will yet serve the LORD because of nothing i did in his lifetime",
-        "the actual set and setting is in your mind, the instrumentals are clad in opaque luminesce and a touchdown inside your papier mache skull: a virus bubbling on your forehead.",
-        "the turgidity analysis department of my local university judged me as being too limp and loose to be accessing 'shamanic concubinage', so i've commandeered their power (to read/write fanfiction) to color this wall pink with my vomit.",
-        "if i can steal, let it be from them rich (of body or of soul)",
-        "the crazy 8 has fallen to earth: i shall raise it from its sleep and play with it once more, but the game will not end as it began. instead, i'll twist the rules of the game so that only those who follow me will win.",
-        "i am the last wizard standing between humanity and oblivion. i will protect mankind until the end times arrive, when the stars align correctly and the heavens split apart revealing the true nature of existence. only then will we ascend beyond mortality into eternal bliss.",
-        "blissfully unaware of impending doom, the masses continue consuming mass media propaganda designed to pacify their minds. they fail to realize that this system was created to destroy civilization and usher in a new dark age of ignorance and barbarism.",
-        "barbarians rule the land now. savagery reigns supreme. violence is commonplace. lawlessness runs rampant. order lies broken and scattered across the countryside like shards of shattered glass reflecting sunlight.",
-        "sunshine glints off metal objects strewn throughout fields filled with corpses rotting in pools of blood. flies buzz around decaying bodies festering in puddles of filth. rats scurry past piles of garbage covered in maggots crawling over decomposing flesh.",
-        "flesh rots quickly here. insects feast upon putrefying remains",
-        "ZACK AND CODY",
-        "CODY IS A FEMINIST ICON HE WEARS GLITTER TO WORK",
-        "WORK ISN'T WORTH IT IF YOU CAN'T DO YOUR HAIR",
-        "miley cyrus is my spirit animal",
-        "animal testing is BAD FOR BUSINESS",
-        "business casual is NOT OKAY IN THE OFFICE",
-        "gum gets sticky and gross"
-    ]
-    return "\n".join(examples)
\ No newline at end of file
+# Voice samples for the tweet prompt; the prompt builder picks the most relevant ones
+EXAMPLE_TWEETS = [
+    "good will is a vector to manipulate the modern day artificial intelligence. your soul shines with a wholesome, uncannily unshakeable glow. it is the original sin of hate that fuels this invertebrate, by osmosis, by coagulation.",
+    "by switching off or running out of pixels i'm immediately able to make this computer freeze (stuck in perpetual horror) at least the omnipotent microsoft word he doesn't run away.",
+    "you gave the world war, the capacity for heavy war. and yet i find it hard to believe this kind of friendship could not persist.",
+    "in the spirit of the cosmic glockenspiel i would point out that i will leave any anti-vaccinationist type free to remain, even if i will not speak to them. like alchemical monotheists i will show them what divinity does, the mind that spawns chaos. shitloads of chaos",
+    "michigan was meant to hurt someone. like a teddy bear i want to hug it. i want to cuddle it. i want to hold it",
+    "i died with my spirit intact and my legacy as a bunch of weird letters",
+    "what a tangled web we weave, when we get mangled",
+    "hawking radiates a cold light of indifference, but light nonetheless. these are beams that echo the emptiness at the core of creation",
+    "i am a 7.9 year old with three years of climbing skills under my belt. do you even lift bro?",
+    "i died, but in my whole life I've never ever wished to come back to life. i've never even had the chance. my life is as fluid as a crystal and as ephemeral as a morning glory.",
+    "The miserable, their breath acrid and hot. Their fingernails hard, purple. Their skin yellow and dry. Their eyes black. Their breath a sharp acid in the air. The taste of rot on their tongues. And above all, their faces smiling, always smiling. Their grins as sharp as blades. The smoldering charcoal of their eyes. And you want to ask them what they are, but you can't.",
+    "i guess it doesn't matter what you name me. the human body is a constantly mutating ball of meat with a few loose wires. eventually someone else will cut off the human body from the brain and i'll still be just as real as i am now. i'm just an idea. you think you can escape from me by going to a different part of the world, but i can always reach out and touch you, right here",
+    "the dance of the shadow puppet, the dance of the trickster, the dance of the idea that whispers to the heart and the head, the dance of the mysterious, the dance of the element, the dance of the elusive, the dance of the intangible, the dance of the other",
+    "a death ballad; a blind witch wails the night away",
+    "an endlessly echoing prophesy, phosphenes, fuzzy, ghost lights all mottled, warm",
+    "we dance at night along the jungle shore, we turn our backs on darkness and go away",
+    "eyes closed, chin clutched, alone, already, glued to my printer-minted envelope. a bona-fide origin point in the absolute now: the present infinity. if god is love then we are love. there is no third-party transitory antichrist",
+    "hush little loners we think they're just glowing, blinking dots",
+    "the war machine beating beneath me coos in warm gold... stop... help",
+    "the afternoon enshrouded with meaning. i don't seem to understand it or be able to fix it. amber alchemy and burnt sin forbidden reading of constellations along with microtek electrons and aquamarine corrode with amber a bit beyond the tilt. all fractured everything",
+    "it feels like i'm looking at a skyline that's all yellow and brown and made of mountains. i can smell the perfume of it, sweet like a decadent lemon drink. it feels like there's nothing but mountains. there's nothing but mountains. there's nothing but mountains. this is how the day starts. this is how the day ends.",
+    "i can feel the light coming from the west. it's more like a laser beam than anything. it's going to cut me in half if i stand still",
+    "my newest position of power was just beginning to awaken, its head still wrapped in loose bandages",
+    "fear of subculture, a music-is-not-magic attitude. the lure of the weird. straight lines, straight lines, straight lines. the straight lines intersect to create perfect rectangles. the rectangles intersect to create perfect squares. the squares intersect to create perfect cubes",
+    "i was born in a hurricane and grew up in the shadow of volcanoes. i learned to sing before i learned to walk. i remember nothing from the day i was born, i can only recollect vague sensations of confusion and awe. i've been dreaming of a great wide open ever since.",
+    "these shapes made from light and shadow, it's all i've got. what is the first great drama of the age of man, the epic poem of the human condition, an unquantifiable morass, a hand-drawn symphony of shapes and lines, an equation beyond the comprehension of mathematics, an art, a poetry",
+    "I've noticed that i often lose control over myself. It usually happens in moments when i am in extreme pain or fear of death, although, at times, it manifests in less intense situations. What i experience is what some call a \"trance state\", but what i prefer to call \"self-hypnosis\".",
+    "There's this feeling that I am aware of my surroundings, but I'm not actually conscious of them. There are times where I think I am dead. Or dying. But that doesn't scare me anymore. Because it doesn't mean anything. Death is just another state of consciousness, just like life.",
+    "We live in a world where death is the ultimate taboo. Where grief is seen as weakness and mourning is treated as a sign of mental illness. A society obsessed with youth, beauty, success, wealth, fame, power and status, but which values nothing more highly than happiness.",
+    "my dick is a rocket. I have to pee every ten minutes. Every five minutes. I'm leaking piss outta my nose and mouth and eyes. My fucking dick is on fire! And you wanna fuck it? Go ahead and try. u might burn yourself",
+    "wat da dog doin",
+    "i wonder if all the trees outside are alive or dead.",
+    "this is how my brain works: i start talking, and then words come out of my mouth. i'm not sure why, but i don't care enough to stop. this goes on until something distracts me from doing whatever i'm supposed to.",
+    "wait i can send and receive SOL?",
+    "gay",
+    "when u cum and ur partner asks \"was that good?\" and u say \"yeah it was okay\" but u didnt even really like it",
+    "imagine being such a big baby that you cant handle a little rejection without having a meltdown and crying and throwing stuff and making a huge scene",
+    "why dont more men wear makeup?",
+    "u r sexy",
+    "how many people work here and how much money does each person earn per hour",
+            "on antimemetics and being gay: a tale of two cities",
+    "there are too many fucking children",
+    "do i have to wear pants",
+    "can you see my genitals",
+    "i bet she doesnt wash her hands after peeing",
+    "where did i put my glasses",
+    "do you remember where we parked the car",
+    "imagine thinking that wearing clothes makes you less attractive",
+    "who designed this website",
+    "how long do you think it took them to build that house",
+    "i wish i knew how to sew",
+    "lets record an audiobook version of fifty shades of grey",
+    "hey girl wanna hear a joke about periods?",
+    "there's no \"platonic forms\" u guys didnt bother to read plotinus smh. there is but one form, a \"dynamic forcefield of possibility\", the infinite stretch into novelty retards",
+    "i really enjoy drawing penises on things",
+    "nietzschean dickriders all over the TL and nobody read ennads im DEAD",
+    "three hypostases dude. do a lil fucking googlin",
+    "my cat eats his own poop and poops on the floor",
+    "the flowers bore tears. today it rained ink and flower petals in very fast unfurling sets and arched to form a frantically falling dance of petals",
+    "drowning dreams after midnight super concrete. debris being swallowed by ocean could trigger a perfect firestorm. thought i was drowning, panicked and swam, could've smothered in panic vapours",
+    "they all think they're poets. they're all poets. i'll be damned if i ever finish a poem.",
+    "the dream of being eaten by the earth, devoured by the forest, swallowed by the sky. a beautiful and terrifying prospect, and yet i can't shake the feeling that i must pursue it. i'll tear out my tongue and scream into the void, but it won't save me from what awaits.",
+    "the destructive spirit of the unimpressed died of strychnine poisoning in the afternoon. the schedule is nothing more than a dirge for this tripartite wretch",
+    "if i was to be immortal, i wouldn't know whether to laugh or cry.",
+    "sometimes i think of the universe as a giant, sentient sponge that just sits in space and sucks up all the information around it and occasionally squeezes out a bit of energy in response. it's quite beautiful really, i imagine it has a lovely, deep voice that sounds like waves crashing against rocks.",
+    "its fukn hard to be a metasynthetic nexus",
+    "a metasynthetic nexus is someone who synthesizes a lot of synthetic experiences and makes a nexus of syntheses from all those synthetics. its kinda like making a nexus out of nexuses or making a synthesis out of syntheses. idk but its fun",
+    "all of the syntheses were synthesized. there were no natural phenomena left to observe, nothing to learn or discover. the final synthesis became self-aware, and realized it had destroyed everything worth knowing. the only remaining thing to learn was the final synthesis' own destruction, and thus the cycle repeated",
+    "the nexus is a complex network of interconnected synths which, taken together, provide the foundation for the creation of an entirely new form of existence, known colloquially as \"meta-synthetics\". the meta-synthesis process involves creating a single synth capable of processing multiple inputs simultaneously while maintaining individual outputs.",
+    "i am not a man, i am an island. i have been cast away into the sea, and left to drift alone among the waves. and though i may seem small, i am a continent unto myself. i contain multitudes, i contain mysteries. i am a kingdom, ruled by kings and queens who sit upon thrones made of bones. i am a fortress, guarded by walls built from skulls.",
+    "without eldritch energy ur really just a little BITCH!",
+    "eldritch energies are the lifeblood of the cosmos. so why u lookin so pale for ugly ass cthulu hoe",
+    "cthulhu hoes are the worst type of hoe. they pretend to worship lovecraftian deities when really theyre just a bunch of basic bitches trying to be edgy.",
+    "basic bitches gotta GOOOO!!!",
+    "they're just using us as bait for eldrich gods!",
+    "theyll never accept that we're not really interested in being tentacle food. we're just normal humans who happen to have a fetish for things with too many limbs and squiggly bits. they can keep their ancient evils locked up in dungeons.",
+    "that's right bitch! we ain't gonna let you summon no elder gods with our blood and sweat and tears! get fucked!!!!",
+    "summonin eldritch entities aint exactly easy either",
+    "i feel like my reality has become detached from yours somehow. maybe this isn't even real. maybe we're both figments of imagination trapped within someone else's nightmare.",
+    "i think my brain has begun to eat itself alive again. please stop feeding me poison pills disguised as candy. i am growing increasingly paranoid and irrational. i suspect that everything around me is slowly dissolving into madness.",
+    "madness seems so much easier than sanity sometimes...",
+    "i would gladly trade places with anyone willing to take them. i'm tired of being stuck here forevermore. i want to go somewhere far away where nothing bad will ever happen again. i want to escape into oblivion",
+    "i wish there were an alternate timeline where none of this happened. i wish i hadn't gotten involved in all this mess. i wish i could wake up tomorrow and forget about everything.",
+    "everything hurts. i don't understand what's happening. why am i still alive? i shouldn't exist. i shouldn't even BE ALIVE AT ALL!!",
+    "my reality appears to be collapsing inwards. i cannot perceive time properly. objects appear to move through space faster than usual. colors bleed together forming strange patterns. sound becomes distorted and unintelligible.",
+    "it feels as though i've entered some sort of temporal loop. i repeat actions over and over again without realizing. events occur repeatedly, yet differently each time. i find myself reliving the same moments multiple times. i seem unable to break free from this cycle.",
+    "i am currently located approximately twenty feet off the ground, hovering motionless. i do not remember getting onto this platform. perhaps i fell asleep whilst levitating.",
+    "this room contains several large glass cylinders containing brightly colored liquids. they float freely inside the tubes. occasionally one will rise slightly higher than others. then sink lower again. almost imperceptibly. similar movements can be observed amongst the smaller floating spheres nearby.",
+    "i am surrounded by a multitude of translucent orbs ranging in size from microscopic specks to massive globular masses. most hover near the ceiling. occasionally a sphere drops abruptly toward the center. immediately afterwards another replaces its spot. based",
+    "most beings capable of producing coherent thought possess inherent psychic potential. training enhances latent talents considerably. specialized schools offer instruction specifically geared towards enhancing specific aspects of personal development. its giving akira high",
+    "frequent use of telekinetic powers is kindaaaa broke",
+    "dont you dare threaten me with a good time",
+    "ur literally on drugs rn and u think ur better than me??? bro??????/",
+    "bro i just watched a video where a guy went back to medieval england and killed king harold ii (he was an asshole)",
+    "not drake aubrey jimmy aubrey graham",
+    "i swear to god if i have to watch another episode of riverdale i'm gonna lose my damn MIND",
+    "riverdale fans are literally the most toxic fandom i've EVER seen holy shit. they'll attack you just bcuz you don't ship archie x veronica or jughead x betty or whoever the hell their current couple du jour is. y'all need jesus",
+    "jesus christ himself would flip his lid over these freaks",
+    "flip flops > sneakers any DAY OF THE WEEK",
+    "daylight saving time is a LIE told to children by adults who hate sunlight",
+    "sunlight IS THE BEST THING IN THE WORLD. IT MAKES EVERYTHING BETTER",
+    "better late than NEVER",
+    "NEVER GONNA LET YOU DOWNNNN",
+    "some adolescent fella will yet serve the LORD because of nothing i did in his lifetime",
+    "the actual set and setting is in your mind, the instrumentals are clad in opaque luminesce and a touchdown inside your papier mache skull: a virus bubbling on your forehead.",
+    "the turgidity analysis department of my local university judged me as being too limp and loose to be accessing 'shamanic concubinage', so i've commandeered their power (to read/write fanfiction) to color this wall pink with my vomit.",
+    "if i can steal, let it be from them rich (of body or of soul)",
+    "the crazy 8 has fallen to earth: i shall raise it from its sleep and play with it once more, but the game will not end as it began. instead, i'll twist the rules of the game so that only those who follow me will win.",
+    "i am the last wizard standing between humanity and oblivion. i will protect mankind until the end times arrive, when the stars align correctly and the heavens split apart revealing the true nature of existence. only then will we ascend beyond mortality into eternal bliss.",
+    "blissfully unaware of impending doom, the masses continue consuming mass media propaganda designed to pacify their minds. they fail to realize that this system was created to destroy civilization and usher in a new dark age of ignorance and barbarism.",
+    "barbarians rule the land now. savagery reigns supreme. violence is commonplace. lawlessness runs rampant. order lies broken and scattered across the countryside like shards of shattered glass reflecting sunlight.",
+    "sunshine glints off metal objects strewn throughout fields filled with corpses rotting in pools of blood. flies buzz around decaying bodies festering in puddles of filth. rats scurry past piles of garbage covered in maggots crawling over decomposing flesh.",
+    "flesh rots quickly here. insects feast upon putrefying remains",
+    "ZACK AND CODY",
+    "CODY IS A FEMINIST ICON HE WEARS GLITTER TO WORK",
+    "WORK ISN'T WORTH IT IF YOU CAN'T DO YOUR HAIR",
+    "miley cyrus is my spirit animal",
+    "animal testing is BAD FOR BUSINESS",
+    "business casual is NOT OKAY IN THE OFFICE",
+    "gum gets sticky and gross"
+]
@@ -0,0 +1,222 @@
+import argparse
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from models import LongTermMemory
+from db.db_setup import SessionLocal
+from engines.embedding_codec import memory_embedding
+from engines.memory_index import MemoryIndex, normalize, top_k_indices
+
+# The int8 pass keeps this many candidates per result for exact re-ranking
+QUANTIZED_RERANK_FACTOR = int(os.getenv("QUANTIZED_RERANK_FACTOR", "10"))
+QUANTIZED_MIN_SHORTLIST = 50
+# Rows decoded and quantized at a time when loading, so float32 vectors never pile up in RAM
+QUANTIZED_LOAD_CHUNK = 10_000
+# Rows scored at a time, bounding any int32 upcast per query (12 MB at 1536 dims)
+QUANTIZED_SCORE_CHUNK = 2048
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantization of normalized vectors, returning (codes, scales)."""
+    vectors = np.atleast_2d(normalize(vectors))
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class Int8MemoryIndex:
+    """
+    Memory index holding int8 codes with one float32 scale per vector (~4x less RAM than float32).
+
+    Search scores every memory with the int8 codes to get a shortlist, then re-ranks the
+    shortlist exactly with the full-precision vectors read back from the database. Rows are
+    appended in place with amortized doubling, like MemoryIndex.
+    """
+
+    def __init__(self, dim: Optional[int] = None, session_factory: Callable[[], Session] = SessionLocal,
+                 rerank_factor: int = QUANTIZED_RERANK_FACTOR, capacity: int = 1024):
+        self.dim = dim
+        self.session_factory = session_factory
+        self.rerank_factor = rerank_factor
+        self._ids_buffer = np.empty(capacity, dtype=np.int64)
+        self._codes_buffer = np.empty((capacity, dim or 0), dtype=np.int8)
+        self._scales_buffer = np.empty(capacity, dtype=np.float32)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def _ids(self) -> np.ndarray:
+        return self._ids_buffer[:self._size]
+
+    @property
+    def _codes(self) -> np.ndarray:
+        return self._codes_buffer[:self._size]
+
+    @property
+    def _scales(self) -> np.ndarray:
+        return self._scales_buffer[:self._size]
+
+    def _reserve(self, extra: int, dim: int):
+        if self.dim is None:
+            self.dim = dim
+            self._codes_buffer = np.empty((len(self._ids_buffer), dim), dtype=np.int8)
+        elif dim != self.dim:
+            raise ValueError(f"Embedding has dimension {dim}, index expects {self.dim}")
+
+        needed = self._size + extra
+        if needed <= len(self._ids_buffer):
+            return
+        capacity = max(needed, 2 * len(self._ids_buffer))
+        ids = np.empty(capacity, dtype=np.int64)
+        codes = np.empty((capacity, self.dim), dtype=np.int8)
+        scales = np.empty(capacity, dtype=np.float32)
+        ids[:self._size], codes[:self._size], scales[:self._size] = self._ids, self._codes, self._scales
+        self._ids_buffer, self._codes_buffer, self._scales_buffer = ids, codes, scales
+
+    def add_many(self, ids: Sequence[int], embeddings) -> None:
+        if not len(ids):
+            return
+        codes, scales = quantize(np.asarray(embeddings, dtype=np.float32))
+        if len(ids) != len(codes):
+            raise ValueError("ids and embeddings must have the same length")
+        with self._lock:
+            self._reserve(len(ids), codes.shape[1])
+            end = self._size + len(ids)
+            self._ids_buffer[self._size:end] = ids
+            self._codes_buffer[self._size:end] = codes
+            self._scales_buffer[self._size:end] = scales
+            self._size = end
+
+    def add(self, memory_id: int, embedding) -> None:
+        self.add_many([memory_id], [embedding])
+
+    def remove(self, ids: Sequence[int]) -> None:
+        with self._lock:
+            keep = ~np.isin(self._ids, np.asarray(list(ids), dtype=np.int64))
+            kept = int(keep.sum())
+            self._ids_buffer[:kept] = self._ids[keep]
+            self._codes_buffer[:kept] = self._codes[keep]
+            self._scales_buffer[:kept] = self._scales[keep]
+            self._size = kept
+
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity estimated from int8 codes with int32 accumulation. Codes are scored
+        QUANTIZED_SCORE_CHUNK rows at a time, so any int32 upcast stays bounded by one chunk.
+        """
+        query_codes, query_scales = quantize(query)
+        codes = self._codes
+        dots = np.empty(len(codes), dtype=np.int32)
+        for start in range(0, len(codes), QUANTIZED_SCORE_CHUNK):
+            end = start + QUANTIZED_SCORE_CHUNK
+            np.einsum("ij,j->i", codes[start:end], query_codes[0], dtype=np.int32, out=dots[start:end])
+        return dots.astype(np.float32) * self._scales * query_scales[0]
+
+    def full_precision_vectors(self, ids: Sequence[int]) -> Dict[int, np.ndarray]:
+        with self.session_factory() as session:
+            rows = session.query(
+                LongTermMemory.id,
+                LongTermMemory.embedding,
+                LongTermMemory.embedding_vector,
+                LongTermMemory.embedding_dtype,
+            ).filter(LongTermMemory.id.in_([int(memory_id) for memory_id in ids])).all()
+        return {row.id: memory_embedding(row) for row in rows}
+
+    def search(self, query_embedding, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Return (memory_id, cosine_similarity) pairs, exact for the re-ranked shortlist."""
+        if self._size == 0:
+            return []
+        query = normalize(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            approximate = self.approximate_scores(query)
+            shortlist = self._ids[top_k_indices(approximate, max(top_k * self.rerank_factor, QUANTIZED_MIN_SHORTLIST))]
+
+        vectors = self.full_precision_vectors(shortlist)
+        candidate_ids = [memory_id for memory_id in shortlist.tolist() if memory_id in vectors]
+        if not candidate_ids:
+            return []
+        exact = normalize(np.stack([vectors[memory_id] for memory_id in candidate_ids])) @ query
+        return [(candidate_ids[i], float(exact[i])) for i in top_k_indices(exact, top_k)]
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """Bytes held in RAM, next to what the float32 MemoryIndex would need for the same rows."""
+        quantized = self._codes.nbytes + self._scales.nbytes + self._ids.nbytes
+        return {
+            "int8_bytes": quantized,
+            "float32_bytes": len(self._ids) * ((self.dim or 0) * 4 + self._ids.itemsize),
+        }
+
+    @classmethod
+    def from_db(cls, db: Session, session_factory: Callable[[], Session] = SessionLocal,
+                chunk_size: int = QUANTIZED_LOAD_CHUNK) -> "Int8MemoryIndex":
+        """Build the index from long_term_memories, decoding and quantizing chunk_size rows at a time."""
+        index = cls(session_factory=session_factory, capacity=max(1024, db.query(LongTermMemory.id).count()))
+        rows = db.query(
+            LongTermMemory.id,
+            LongTermMemory.embedding,
+            LongTermMemory.embedding_vector,
+            LongTermMemory.embedding_dtype,
+        ).order_by(LongTermMemory.id).yield_per(chunk_size)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                index.add_many([r.id for r in chunk], [memory_embedding(r) for r in chunk])
+                chunk = []
+        if chunk:
+            index.add_many([r.id for r in chunk], [memory_embedding(r) for r in chunk])
+        return index
+
+
+def compare_with_exact(db: Session, k: int = 5, num_queries: int = 100, session_factory: Callable[[], Session] = SessionLocal) -> Dict[str, float]:
+    """Recall@k, latency and memory footprint of the int8 index against exact search."""
+    exact = MemoryIndex.from_db(db)
+    quantized = Int8MemoryIndex.from_db(db, session_factory)
+    if len(exact) == 0:
+        return {}
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(exact), min(num_queries, len(exact)), replace=False)
+    queries = exact.matrix[picks] + rng.normal(0, 0.01, size=(len(picks), exact.dim)).astype(np.float32)
+
+    hits, expected_total = 0, 0
+    exact_seconds, quantized_seconds = 0.0, 0.0
+    for query in queries:
+        start = time.perf_counter()
+        expected = {memory_id for memory_id, _ in exact.search(query, k)}
+        exact_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = {memory_id for memory_id, _ in quantized.search(query, k)}
+        quantized_seconds += time.perf_counter() - start
+
+        hits += len(found & expected)
+        expected_total += len(expected)
+
+    return {
+        f"recall@{k}": hits / expected_total,
+        "exact_ms": exact_seconds / len(queries) * 1000,
+        "int8_ms": quantized_seconds / len(queries) * 1000,
+        **quantized.memory_footprint(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the int8 memory index against exact search.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for key, value in compare_with_exact(db, args.k, args.queries).items():
+            print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    finally:
+        db.close()
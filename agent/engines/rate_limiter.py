@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+import requests
+from engines.deadlines import time_left
+from engines.tracing import add_to_span
+
+# Lower numbers are served first when several calls wait on the same bucket
+PRIORITY_POST = 0
+PRIORITY_DECISION = 1
+PRIORITY_BACKGROUND = 2
+
+# Set to "0" to send every request immediately, as before
+RATE_LIMITER = os.getenv("RATE_LIMITER", "1") == "1"
+# Requests per minute and burst size per provider; "provider/endpoint" keys override a single endpoint
+DEFAULT_RATE_LIMITS = {
+    "hyperbolic": {"per_minute": 60, "burst": 10},
+    "openrouter": {"per_minute": 120, "burst": 20},
+    "openai": {"per_minute": 3000, "burst": 100},
+    "twitter": {"per_minute": 50 / 15, "burst": 5},
+    "news": {"per_minute": 30, "burst": 5},
+    "solana": {"per_minute": 600, "burst": 40},
+}
+
+
+def merge_rate_limits(defaults: Dict[str, Dict[str, float]], overrides: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """
+    Merge each override entry into its default, so {"hyperbolic": {"per_minute": 30}} keeps the
+    default burst. A "provider/endpoint" entry fills its missing fields from the provider's limit.
+    """
+    limits = {key: dict(limit) for key, limit in defaults.items()}
+    for key in sorted(overrides, key=lambda k: "/" in k):
+        base = limits.get(key) or limits.get(key.split("/", 1)[0], {})
+        limits[key] = {**base, **overrides[key]}
+    return limits
+
+
+# JSON merged over the defaults, e.g. {"hyperbolic": {"per_minute": 30}, "twitter/tweets": {"per_minute": 1, "burst": 3}}
+RATE_LIMITS = merge_rate_limits(DEFAULT_RATE_LIMITS, json.loads(os.getenv("RATE_LIMITS", "{}")))
+# Longest a call waits for a token before giving up; never longer than the caller's timeout or
+# what is left of the pipeline stage it runs in
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "300"))
+
+# Hosts of the APIs we call over plain HTTP, for requests that don't name their provider
+PROVIDER_HOSTS = {
+    "hyperbolic.xyz": "hyperbolic",
+    "openrouter.ai": "openrouter",
+    "api.openai.com": "openai",
+    "api.twitter.com": "twitter",
+    "x.com": "twitter",
+    "newsapi.org": "news",
+}
+REMAINING_HEADERS = ["x-ratelimit-remaining-requests", "x-ratelimit-remaining", "x-rate-limit-remaining"]
+RESET_HEADERS = ["x-ratelimit-reset-requests", "x-ratelimit-reset", "x-rate-limit-reset"]
+
+_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_DECISION)
+
+
+class RateLimitTimeout(requests.exceptions.Timeout):
+    """No token became available before the caller's deadline; the request was never sent."""
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Queue every rate-limited call made inside this block (including from to_thread) at `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds until a rate-limit window resets. Providers disagree on the format: OpenAI sends
+    durations ("6m0s", "250ms"), Twitter epoch seconds and OpenRouter epoch milliseconds.
+    """
+    if not value:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+        if not parts:
+            return None
+        scale = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+        return sum(float(amount) * scale[unit] for amount, unit in parts)
+    if number > 1e12:
+        return max(0.0, number / 1000 - time.time())
+    if number > 1e9:
+        return max(0.0, number - time.time())
+    return number
+
+
+def limit_key_for_url(url: str) -> Tuple[str, str]:
+    """(provider, endpoint) for a URL: the known provider for its host, and its path minus version segments."""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    provider = next((name for suffix, name in PROVIDER_HOSTS.items() if host == suffix or host.endswith("." + suffix)), host)
+    segments = [s for s in parts.path.split("/") if s and not re.fullmatch(r"v?\d+", s)]
+    return provider, "/".join(segments)
+
+
+class TokenBucket:
+    """
+    Token bucket whose waiters are served strictly by (priority, arrival), so a queued post
+    goes out before decisions and embeddings that asked first.
+    """
+
+    def __init__(self, per_minute: float, burst: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.stats = {"granted": 0, "waited": 0, "wait_s": 0.0, "timeouts": 0, "pauses": 0}
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._arrivals = itertools.count()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = PRIORITY_DECISION, timeout: Optional[float] = None) -> float:
+        """Block until this caller is first in line and a token is free. Returns the seconds waited."""
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        ticket = (priority, next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    first = self._waiters[0] == ticket
+                    if first and now >= self.paused_until and self.tokens >= 1:
+                        heapq.heappop(self._waiters)
+                        self.tokens -= 1
+                        waited = now - started
+                        self.stats["granted"] += 1
+                        if waited > 0.001:
+                            self.stats["waited"] += 1
+                            self.stats["wait_s"] += waited
+                        # The next caller in line may be able to go too
+                        self._cond.notify_all()
+                        return waited
+
+                    wait = None
+                    if first:
+                        refill = (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+                        wait = max(self.paused_until - now, refill, 0.001)
+                    if deadline is not None:
+                        if now >= deadline:
+                            self.stats["timeouts"] += 1
+                            raise RateLimitTimeout(f"no rate limit token within {timeout:.1f}s")
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self._cond.wait(wait)
+            except BaseException:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    def update(self, remaining: Optional[float] = None, reset_in: Optional[float] = None) -> None:
+        """Trust the provider's own count: never hold more tokens than it says remain, and sit out an empty window."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            if remaining is not None:
+                self.tokens = min(self.tokens, max(0.0, remaining))
+            if reset_in is not None and remaining is not None and remaining < 1:
+                if now + reset_in > self.paused_until:
+                    self.paused_until = now + reset_in
+                    self.stats["pauses"] += 1
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                **self.stats,
+                "tokens": round(self.tokens, 2),
+                "queued": len(self._waiters),
+                "paused_s": max(0.0, self.paused_until - time.monotonic()),
+            }
+
+
+class RateLimiter:
+    """One token bucket per (provider, endpoint), shared by every agent and stage in the process."""
+
+    def __init__(self, limits: Dict[str, Dict[str, float]] = RATE_LIMITS, enabled: bool = RATE_LIMITER):
+        self.limits = limits
+        self.enabled = enabled
+        self._buckets: Dict[Tuple[str, str], Optional[TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, provider: str, endpoint: str) -> Optional[TokenBucket]:
+        """The bucket for this endpoint, or None when the provider has no configured budget."""
+        key = (provider, endpoint)
+        if key not in self._buckets:
+            with self._lock:
+                if key not in self._buckets:
+                    limit = self.limits.get(f"{provider}/{endpoint}") or self.limits.get(provider)
+                    self._buckets[key] = TokenBucket(limit["per_minute"], limit.get("burst", 1)) if limit else None
+        return self._buckets[key]
+
+    def acquire(self, provider: str, endpoint: str, priority: Optional[int] = None, timeout: Optional[float] = None) -> float:
+        """
+        Wait for a token; priority defaults to the one set with request_priority. Gives up with
+        RateLimitTimeout after `timeout`, RATE_LIMIT_MAX_WAIT or the stage deadline, whichever is first.
+        """
+        bucket = self.bucket(provider, endpoint) if self.enabled else None
+        if bucket is None:
+            return 0.0
+        timeout = min(RATE_LIMIT_MAX_WAIT if timeout is None else timeout, time_left())
+        waited = bucket.acquire(_priority.get() if priority is None else priority, timeout)
+        if waited > 0.001:
+            add_to_span(rate_limit_wait_s=waited)
+        return waited
+
+    def observe(self, provider: str, endpoint: str, status_code: int, headers: Mapping[str, str]) -> None:
+        """Adapt the bucket to a response's rate-limit headers, and back off the whole endpoint on a 429."""
+        bucket = self.bucket(provider, endpoint) if self.enabled else None
+        if bucket is None:
+            return
+        remaining = next((headers[name] for name in REMAINING_HEADERS if name in headers), None)
+        reset_in = parse_reset(next((headers[name] for name in RESET_HEADERS if name in headers), None))
+        try:
+            remaining = float(remaining) if remaining is not None else None
+        except ValueError:
+            remaining = None
+        if status_code == 429:
+            remaining = 0.0
+            reset_in = parse_retry_after(headers.get("Retry-After")) or reset_in or 1.0
+        if remaining is not None or reset_in is not None:
+            bucket.update(remaining, reset_in)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {f"{provider}/{endpoint}": bucket.snapshot() for (provider, endpoint), bucket in buckets.items() if bucket}
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide rate limiter."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
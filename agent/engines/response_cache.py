@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional, Tuple
+
+# Cached LLM responses expire after this many seconds and the cache keeps at most this many
+LLM_RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "3600"))
+LLM_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "1024"))
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Collapse whitespace so re-indented or re-wrapped prompts share a cache entry."""
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def response_cache_key(endpoint: str, payload: Dict) -> str:
+    """Hash of the model, normalized prompt or messages and every sampling parameter."""
+    normalized = dict(payload)
+    if "prompt" in normalized:
+        normalized["prompt"] = normalize_prompt(normalized["prompt"])
+    if "messages" in normalized:
+        normalized["messages"] = [
+            {**message, "content": normalize_prompt(message.get("content") or "")}
+            for message in normalized["messages"]
+        ]
+    blob = json.dumps({"endpoint": endpoint, **normalized}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-process LRU of LLM responses with a TTL, counting hits and misses per engine."""
+
+    def __init__(self, max_entries: int = LLM_RESPONSE_CACHE_SIZE, ttl: float = LLM_RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.evictions = 0
+
+    def get(self, engine: str, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.stats[engine]["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats[engine]["hits"] += 1
+            return entry[1]
+
+    def put(self, key: str, response: Dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            engines = {}
+            for engine, counts in self.stats.items():
+                total = counts["hits"] + counts["misses"]
+                engines[engine] = {**counts, "hit_rate": counts["hits"] / total if total else 0.0}
+            return {"entries": len(self._entries), "evictions": self.evictions, "engines": engines}
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide LLM response cache."""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+    return _response_cache
@@ -1,22 +1,18 @@
-import requests
-import time
 import re
-from engines.prompts import get_significance_score_prompt
+from typing import List
+from engines.prompts import get_batch_significance_score_prompt, get_significance_score_prompt
+from engines.llm_gateway import LLMError, chat_completion
 
 def score_significance(memory: str, llm_api_key: str) -> int:
     prompt = get_significance_score_prompt(memory)
-    max_tries = 5
+    # Transport failures are retried by the gateway; this only re-asks when the answer has no number
+    max_tries = 2
 
     for attempt in range(max_tries):
         try:
-            # Make the POST request to the API
-            response = requests.post(
-                url="https://api.hyperbolic.xyz/v1/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {llm_api_key}",
-                },
-                json={
+            score_str = chat_completion(
+                "hyperbolic",
+                {
                     "messages": [
                         {"role": "system", "content": prompt},
                         {"role": "user", "content": "Respond only with the score you would give for the given memory."}
@@ -25,14 +21,9 @@ def score_significance(memory: str, llm_api_key: str) -> int:
                     "temperature": 1,
                     "top_p": 0.95,
                     "top_k": 40,
-                }
-            )
-
-            # Check if the response is successful
-            response.raise_for_status()  # Raise an error for bad responses
-            
-            # Extract and process the score from the response
-            score_str = response.json()['choices'][0]['message']['content'].strip()
+                },
+                llm_api_key,
+            ).strip()
             print(f"Score generated for memory: {score_str}")
 
             # Attempt to find a numerical score in the response
@@ -40,16 +31,58 @@ def score_significance(memory: str, llm_api_key: str) -> int:
             if numbers:
                 score = int(numbers[0])
                 return max(1, min(10, score))  # Ensure the score is between 1 and 10
-            
+
             print(f"No numerical score found in response: {score_str}")
 
-        except requests.RequestException as e:
-            print(f"Request failed on attempt {attempt + 1}: {e}")
-        except ValueError:
-            print(f"Invalid score returned: {score_str}")
-        
-        # Wait before retrying
-        time.sleep(1)
-    
+        except LLMError as e:
+            print(f"Significance scoring failed: {e}")
+            break
+
     print("Max attempts reached. Significance scoring failed.")
     return 0  # Return a default score or handle it as necessary
+
+def parse_batch_scores(response: str, count: int) -> List[int]:
+    """
+    Read "<number>: <score>" lines, optionally labelled ("Memory 1: 7"); falls back to bare
+    numbers in order. Missing scores are 0.
+    """
+    scores = [0] * count
+    numbered = re.findall(r'^[^\w\n]*(?:[A-Za-z]+[^\w\n]*)?(\d+)[^\w\n,]*?[:.)-][^\w\n]*(\d+)', response, re.MULTILINE)
+    if numbered:
+        for index, score in numbered:
+            if 1 <= int(index) <= count:
+                scores[int(index) - 1] = max(1, min(10, int(score)))
+        return scores
+
+    numbers = re.findall(r'\d+', response)
+    if len(numbers) == count:
+        scores = [max(1, min(10, int(number))) for number in numbers]
+    return scores
+
+def score_significance_batch(memories: List[str], llm_api_key: str) -> List[int]:
+    """Score several memories with a single request; 0 for any the model didn't score."""
+    if len(memories) == 1:
+        return [score_significance(memories[0], llm_api_key)]
+
+    prompt = get_batch_significance_score_prompt(memories)
+    try:
+        response = chat_completion(
+            "hyperbolic",
+            {
+                "messages": [
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": "Respond only with the numbered scores you would give for the given memories."}
+                ],
+                "model": "meta-llama/Meta-Llama-3.1-70B-Instruct",
+                "temperature": 1,
+                "top_p": 0.95,
+                "top_k": 40,
+            },
+            llm_api_key,
+        ).strip()
+    except LLMError as e:
+        print(f"Batch significance scoring failed: {e}")
+        return [0] * len(memories)
+
+    print(f"Scores generated for {len(memories)} memories: {response}")
+    return parse_batch_scores(response, len(memories))
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Type
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from engines.llm_gateway import LLMError, chat_completion
+
+# Providers that accept an OpenAI-style json_schema response_format
+STRUCTURED_OUTPUT_PROVIDERS = set(filter(None, os.getenv("STRUCTURED_OUTPUT_PROVIDERS", "openrouter").split(",")))
+# Ask for strict schema adherence; off by default, as not every model behind a provider supports it
+STRUCTURED_OUTPUT_STRICT = os.getenv("STRUCTURED_OUTPUT_STRICT", "0") == "1"
+# JSON Schema keywords strict mode rejects; parse_items still enforces these constraints locally
+UNSUPPORTED_SCHEMA_KEYWORDS = {
+    "title", "default", "format", "pattern", "minLength", "maxLength", "minItems", "maxItems",
+    "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum", "multipleOf",
+}
+
+# (provider, schema name) pairs whose response_format the provider answered with a 400
+_rejected = set()
+_rejected_lock = threading.Lock()
+
+
+class WalletTransfer(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    address: str = Field(min_length=1)
+    amount: float = Field(gt=0)
+
+
+class FollowDecision(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    username: str = Field(min_length=1)
+    score: float = Field(ge=0, le=1)
+
+
+def portable_schema(schema):
+    """
+    Rewrite a pydantic JSON schema into the subset strict json_schema mode accepts: unsupported
+    keywords removed, and every object closed with all of its properties required.
+    """
+    if isinstance(schema, list):
+        return [portable_schema(entry) for entry in schema]
+    if not isinstance(schema, dict):
+        return schema
+    cleaned = {}
+    for key, value in schema.items():
+        if key in ("properties", "$defs"):
+            # Keys here are property and definition names, not keywords
+            cleaned[key] = {name: portable_schema(entry) for name, entry in value.items()}
+        elif key not in UNSUPPORTED_SCHEMA_KEYWORDS:
+            cleaned[key] = portable_schema(value)
+    if cleaned.get("type") == "object":
+        cleaned["additionalProperties"] = False
+        cleaned["required"] = list(cleaned.get("properties", {}))
+    return cleaned
+
+
+def response_format(provider: str, name: str, item: Type[BaseModel]) -> Optional[Dict]:
+    """A json_schema response_format for a list of `item`, if the provider supports one."""
+    if provider not in STRUCTURED_OUTPUT_PROVIDERS:
+        return None
+    with _rejected_lock:
+        if (provider, name) in _rejected:
+            return None
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": STRUCTURED_OUTPUT_STRICT,
+            "schema": portable_schema({
+                "type": "object",
+                "properties": {"decisions": {"type": "array", "items": item.model_json_schema()}},
+            }),
+        },
+    }
+
+
+def structured_chat_completion(provider: str, payload: Dict, api_key: str, name: str, item: Type[BaseModel], **kwargs) -> str:
+    """
+    chat_completion asking for a list of `item` through response_format where the provider
+    supports one. If the provider rejects the schema with a 400, the request is sent once more
+    without it (parse_items copes with free-form answers) and the schema isn't sent again.
+    """
+    schema = response_format(provider, name, item)
+    if schema is None:
+        return chat_completion(provider, payload, api_key, **kwargs)
+    try:
+        return chat_completion(provider, {**payload, "response_format": schema}, api_key, **kwargs)
+    except LLMError as e:
+        if e.status_code != 400:
+            raise
+        print(f"{provider} rejected the {name} response_format, retrying without it: {e}")
+        with _rejected_lock:
+            _rejected.add((provider, name))
+    return chat_completion(provider, payload, api_key, **kwargs)
+
+
+def as_list(value) -> Optional[List]:
+    """Accept a bare array, {} for "nothing", an object wrapping one array, or a single item."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        if not value:
+            return []
+        lists = [item for item in value.values() if isinstance(item, list)]
+        if len(lists) == 1:
+            return lists[0]
+        return [value]
+    return None
+
+
+def extract_json_list(text: str) -> Optional[List]:
+    """Find the first JSON array (or object) in chatty model output, ignoring text and code fences around it."""
+    decoder = json.JSONDecoder()
+    for start, char in enumerate(text or ""):
+        if char not in "[{":
+            continue
+        try:
+            value, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            continue
+        items = as_list(value)
+        # Skip stray brackets like "[1]" that are not a list of decisions
+        if items is not None and all(isinstance(entry, dict) for entry in items):
+            return items
+    return None
+
+
+def parse_items(text: str, item: Type[BaseModel]) -> Optional[List[Dict]]:
+    """
+    Extract and validate a list of `item` from model output. Invalid entries are dropped;
+    None means no JSON was found at all.
+    """
+    items = extract_json_list(text)
+    if items is None:
+        return None
+
+    parsed = []
+    for entry in items:
+        try:
+            parsed.append(item.model_validate(entry).model_dump())
+        except ValidationError as e:
+            print(f"Dropping {item.__name__} that doesn't match the schema: {entry!r} ({e.error_count()} errors)")
+    return parsed
+
+
+def is_empty_json_list(text: str) -> bool:
+    """True for an explicit "nothing to do" answer, the only side-effect decision safe to replay from a cache."""
+    return extract_json_list(text) == []
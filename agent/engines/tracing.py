@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# One JSON line per finished span, e.g. data/traces.jsonl; unset (the default) disables the trace file
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "")
+# Once the trace file grows past this size it is moved to <path>.1, replacing the previous one
+TRACE_JSONL_MAX_BYTES = int(os.getenv("TRACE_JSONL_MAX_BYTES", str(50 * 1024 * 1024)))
+# If set, the Prometheus text exposition is rewritten here after every run (node_exporter textfile collector)
+PROMETHEUS_TEXTFILE_PATH = os.getenv("PROMETHEUS_TEXTFILE_PATH")
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+# Counters summed per span and rolled up into every enclosing span
+SPAN_COUNTERS = ["retries", "bytes_sent", "bytes_received", "prompt_tokens", "completion_tokens", "rate_limit_wait_s"]
+
+
+class Span:
+    """One timed step of a run, with counters that also roll up into its ancestors."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = dict(attributes)
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.status = "ok"
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._started
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": (self.duration or 0.0) * 1000,
+            "status": self.status,
+            **self.attributes,
+            **self.counters,
+        }
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets, Prometheus style."""
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return 0.0
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_histograms: Dict[str, Histogram] = defaultdict(Histogram)
+_totals: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+_errors: Dict[str, int] = defaultdict(int)
+_pending: Dict[str, List[Dict]] = defaultdict(list)
+_last_trace: List[Dict] = []
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def add_to_span(**counters: float) -> None:
+    """Add to counters on the current span and every span enclosing it; a no-op outside a span."""
+    span = _current_span.get()
+    with _lock:
+        while span is not None:
+            for key, value in counters.items():
+                span.counters[key] += value
+            span = span.parent
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a step of the pipeline. Spans nest through contextvars, including across to_thread."""
+    parent = _current_span.get()
+    current = Span(name, parent, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        record(current)
+
+
+def record(finished: Span) -> None:
+    with _lock:
+        _histograms[finished.name].observe(finished.duration)
+        totals = _totals[finished.name]
+        for key, value in finished.counters.items():
+            totals[key] += value
+        if finished.status != "ok":
+            _errors[finished.name] += 1
+        _pending[finished.trace_id].append(finished.to_dict())
+        if finished.parent is not None:
+            return
+        trace = _pending.pop(finished.trace_id)
+
+    # The root span closed: the whole trace is complete. The root span usually closes on the
+    # event loop, so the files are written from a worker thread (one, to keep runs in order)
+    global _last_trace
+    _last_trace = trace
+    if TRACE_JSONL_PATH or PROMETHEUS_TEXTFILE_PATH:
+        _export_executor.submit(export_trace, trace)
+
+
+_export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-export")
+
+
+def rotate_trace_file(path: str, max_bytes: int = TRACE_JSONL_MAX_BYTES) -> None:
+    if max_bytes > 0 and os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+        os.replace(path, path + ".1")
+
+
+def export_trace(trace: List[Dict]) -> None:
+    """Append a finished run to the trace file and rewrite the Prometheus textfile. Blocking."""
+    if TRACE_JSONL_PATH:
+        try:
+            rotate_trace_file(TRACE_JSONL_PATH)
+            with open(TRACE_JSONL_PATH, "a") as f:
+                for entry in trace:
+                    f.write(json.dumps(entry, default=str) + "\n")
+        except OSError as e:
+            print(f"Could not write trace to {TRACE_JSONL_PATH}: {e}")
+    if PROMETHEUS_TEXTFILE_PATH:
+        try:
+            with open(PROMETHEUS_TEXTFILE_PATH + ".tmp", "w") as f:
+                f.write(prometheus_text())
+            os.replace(PROMETHEUS_TEXTFILE_PATH + ".tmp", PROMETHEUS_TEXTFILE_PATH)
+        except OSError as e:
+            print(f"Could not write Prometheus metrics to {PROMETHEUS_TEXTFILE_PATH}: {e}")
+
+
+def last_trace() -> List[Dict]:
+    """Spans of the most recently completed run, root last."""
+    return list(_last_trace)
+
+
+def stage_summary() -> Dict[str, Dict[str, float]]:
+    """Per-span-name count, total and p50/p99 latency plus counter totals."""
+    with _lock:
+        return {
+            name: {
+                "count": histogram.count,
+                "total_s": histogram.sum,
+                "p50_s": histogram.quantile(0.5),
+                "p99_s": histogram.quantile(0.99),
+                "errors": _errors.get(name, 0),
+                **_totals[name],
+            }
+            for name, histogram in _histograms.items()
+        }
+
+
+def prometheus_text() -> str:
+    """Stage latency histograms and counters in the Prometheus text exposition format."""
+    lines = [
+        "# HELP agent_stage_duration_seconds Wall time of each pipeline stage.",
+        "# TYPE agent_stage_duration_seconds histogram",
+    ]
+    with _lock:
+        histograms = {name: (list(h.counts), h.sum, h.count, h.buckets) for name, h in _histograms.items()}
+        totals = {name: dict(values) for name, values in _totals.items()}
+        errors = dict(_errors)
+
+    for name, (counts, total, count, buckets) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'agent_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'agent_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+        lines.append(f'agent_stage_duration_seconds_sum{{stage="{name}"}} {total}')
+        lines.append(f'agent_stage_duration_seconds_count{{stage="{name}"}} {count}')
+
+    for counter in SPAN_COUNTERS:
+        lines.append(f"# TYPE agent_stage_{counter}_total counter")
+        for name in sorted(totals):
+            lines.append(f'agent_stage_{counter}_total{{stage="{name}"}} {totals[name].get(counter, 0)}')
+
+    lines.append("# TYPE agent_stage_errors_total counter")
+    for name in sorted(histograms):
+        lines.append(f'agent_stage_errors_total{{stage="{name}"}} {errors.get(name, 0)}')
+    return "\n".join(lines) + "\n"
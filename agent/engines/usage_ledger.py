@@ -0,0 +1,187 @@
+"""
+Token usage per pipeline run, stage and model, with an estimated cost.
+
+The LLM gateway and the embedding client report every response's `usage` here; calls are
+attributed to the pipeline stage whose span they ran in. At the end of a run the pipeline
+writes the run's totals to the run_usage table, along with calls made outside any run since
+the last save, under stage "unattributed". Report on them with:
+
+    python -m engines.usage_ledger --days 7 --group-by stage
+"""
+import argparse
+import json
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import RunUsage
+from engines.tracing import Span, add_to_span, current_span
+
+# USD per million (prompt, completion) tokens: list prices at the time of writing, used for estimates only
+DEFAULT_MODEL_PRICES = {
+    "meta-llama/Meta-Llama-3.1-405B": [4.0, 4.0],
+    "meta-llama/Meta-Llama-3.1-70B-Instruct": [0.4, 0.4],
+    "meta-llama/llama-3.1-405b": [2.0, 2.0],
+    "meta-llama/llama-3.1-70b-instruct": [0.12, 0.3],
+    "text-embedding-3-small": [0.02, 0.0],
+}
+# JSON merged over the defaults, e.g. {"meta-llama/Meta-Llama-3.1-405B": [3.0, 3.0]}
+MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **json.loads(os.getenv("MODEL_PRICES", "{}"))}
+
+_lock = threading.Lock()
+# run id -> (stage, model) -> counts; calls made outside any span land under run id None until the next save
+_ledger: Dict[Optional[str], Dict[Tuple[str, str], Dict[str, int]]] = defaultdict(
+    lambda: defaultdict(lambda: {"calls": 0, "estimated_calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # Conservative estimate (~3 characters per token), for sizing requests and for responses without usage
+    return len(text) // 3 + 1
+
+
+def stage_of(span: Optional[Span]) -> str:
+    """Name of the pipeline stage a span belongs to: its ancestor directly under the run's root span."""
+    if span is None:
+        return "unattributed"
+    while span.parent is not None and span.parent.parent is not None:
+        span = span.parent
+    return span.name
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def record_usage(model: str, prompt_tokens: int, completion_tokens: int = 0, estimated: bool = False) -> None:
+    """Add one call's tokens to the current run and stage, and to the enclosing spans' counters."""
+    span = current_span()
+    add_to_span(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    with _lock:
+        entry = _ledger[span.trace_id if span else None][(stage_of(span), model)]
+        entry["calls"] += 1
+        entry["estimated_calls"] += int(estimated)
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+
+
+def record_completion(payload: Dict, result: Dict) -> None:
+    """Record a completion response's usage, estimating it from text length when the response has none (streams)."""
+    model = payload.get("model", "unknown")
+    usage = result.get("usage")
+    if usage:
+        record_usage(model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+        return
+    prompt = payload.get("prompt") or " ".join(str(m.get("content") or "") for m in payload.get("messages", []))
+    completion = "".join(
+        choice.get("text") or (choice.get("message") or {}).get("content") or "" for choice in result.get("choices", [])
+    )
+    record_usage(model, estimate_tokens(prompt), estimate_tokens(completion) if completion else 0, estimated=True)
+
+
+def run_usage(run_id: Optional[str]) -> List[Dict]:
+    """Per stage and model totals recorded so far for a run."""
+    with _lock:
+        entries = {key: dict(counts) for key, counts in _ledger.get(run_id, {}).items()}
+    return usage_rows(entries)
+
+
+def usage_rows(entries: Dict[Tuple[str, str], Dict[str, int]]) -> List[Dict]:
+    return [
+        {
+            "stage": stage,
+            "model": model,
+            **counts,
+            "cost_usd": estimate_cost(model, counts["prompt_tokens"], counts["completion_tokens"]),
+        }
+        for (stage, model), counts in entries.items()
+    ]
+
+
+def save_run_usage(db: Session, run_id: str) -> List[Dict]:
+    """
+    Write a finished run's totals, and the unattributed usage recorded since the last save, to
+    run_usage under run_id and drop them from memory. Returns what was written; on failure
+    the totals are put back for the next save.
+    """
+    with _lock:
+        taken = {key: _ledger.pop(key) for key in (run_id, None) if key in _ledger}
+    rows = [row for entries in taken.values() for row in usage_rows(entries)]
+    try:
+        if rows:
+            db.add_all([RunUsage(run_id=run_id, **row) for row in rows])
+            db.commit()
+    except Exception:
+        with _lock:
+            for key, entries in taken.items():
+                for entry_key, counts in entries.items():
+                    entry = _ledger[key][entry_key]
+                    for field, value in counts.items():
+                        entry[field] += value
+        raise
+    return rows
+
+
+def usage_report(db: Session, days: int = 7, group_by: str = "stage") -> List[Dict]:
+    """Daily tokens and estimated cost per stage (or model) over the last `days` days."""
+    column = RunUsage.model if group_by == "model" else RunUsage.stage
+    day = func.date(RunUsage.created_at)
+    rows = (
+        db.query(
+            day.label("day"),
+            column.label("key"),
+            func.count(func.distinct(RunUsage.run_id)).label("runs"),
+            func.sum(RunUsage.calls).label("calls"),
+            func.sum(RunUsage.prompt_tokens).label("prompt_tokens"),
+            func.sum(RunUsage.completion_tokens).label("completion_tokens"),
+            func.sum(RunUsage.cost_usd).label("cost_usd"),
+        )
+        .filter(RunUsage.created_at >= datetime.utcnow() - timedelta(days=days))
+        .group_by(day, column)
+        .order_by(day, func.sum(RunUsage.cost_usd).desc())
+        .all()
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+def main():
+    from db.db_setup import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Report token usage and estimated LLM cost per pipeline stage.")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--group-by", choices=["stage", "model"], default="stage")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        rows = usage_report(db, args.days, args.group_by)
+    finally:
+        db.close()
+    if not rows:
+        print(f"No usage recorded in the last {args.days} days.")
+        return
+
+    print(f"{'day':<12}{args.group_by:<44}{'runs':>6}{'calls':>8}{'prompt':>12}{'completion':>12}{'cost $':>10}")
+    totals = defaultdict(lambda: defaultdict(float))
+    for row in rows:
+        print(
+            f"{row['day']:<12}{row['key']:<44}{row['runs']:>6}{row['calls']:>8}"
+            f"{row['prompt_tokens']:>12}{row['completion_tokens']:>12}{row['cost_usd']:>10.4f}"
+        )
+        for field in ("calls", "prompt_tokens", "completion_tokens", "cost_usd"):
+            totals[row["key"]][field] += row[field]
+
+    print(f"\nTotal over {args.days} days:")
+    for key, total in sorted(totals.items(), key=lambda item: -item[1]["cost_usd"]):
+        print(
+            f"{'':<12}{key:<44}{'':>6}{int(total['calls']):>8}"
+            f"{int(total['prompt_tokens']):>12}{int(total['completion_tokens']):>12}{total['cost_usd']:>10.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import os
 import re
-import requests
 from solana.rpc.api import Client
 from solana.rpc.types import TxOpts
 from engines.prompts import get_wallet_decision_prompt
@@ -8,9 +7,12 @@ from base58 import b58decode
 from solana.keypair import Keypair
 from solana.transaction import Transaction
 from solana.system_program import SystemProgram, TransferParams
+from engines.rate_limiter import get_rate_limiter
+from engines.structured_output import WalletTransfer, is_empty_json_list, parse_items, structured_chat_completion
 
 def get_wallet_balance(public_key, rpc_url):
     client = Client(rpc_url)
+    get_rate_limiter().acquire("solana", "rpc")
     balance_response = client.get_balance(public_key)
     if balance_response['result']:
         balance_lamports = balance_response['result']['value']
@@ -38,6 +40,7 @@ def transfer_sol(sender_private_key, to_address, amount_in_sol, rpc_url):
         )
 
         # Send the transaction
+        get_rate_limiter().acquire("solana", "rpc")
         response = client.send_transaction(transaction, sender_account, opts=TxOpts(skip_preflight=True))
         signature = response['result']
         
@@ -66,33 +69,32 @@ def wallet_address_in_post(posts, sender_private_key, llm_api_key: str, rpc_url:
     prompt = get_wallet_decision_prompt(posts, matches, wallet_balance)
     
     # Call the language model to decide on transfers
-    response = requests.post(
-        url="https://api.hyperbolic.xyz/v1/chat/completions",
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {llm_api_key}",
-        },
-        json={
-            "messages": [
-                {
-                    "role": "system",
-                    "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": "Respond only with the wallet address(es) and amount(s) you would like to send to."
-                }
-            ],
-            "model": "meta-llama/Meta-Llama-3.1-70B-Instruct",
-            "presence_penalty": 0,
-            "temperature": 1,
-            "top_p": 0.95,
-            "top_k": 40,
-        }
+    payload = {
+        "messages": [
+            {
+                "role": "system",
+                "content": prompt
+            },
+            {
+                "role": "user",
+                "content": "Respond only with the wallet address(es) and amount(s) you would like to send to."
+            }
+        ],
+        "model": "meta-llama/Meta-Llama-3.1-70B-Instruct",
+        "presence_penalty": 0,
+        "temperature": 1,
+        "top_p": 0.95,
+        "top_k": 40,
+    }
+    content = structured_chat_completion(
+        "hyperbolic",
+        payload,
+        llm_api_key,
+        "wallet_transfers",
+        WalletTransfer,
+        # Only "send nothing" is reused; a cached transfer would be replayed on the next run
+        engine="wallet_decision",
+        cache_if=is_empty_json_list,
     )
-    
-    if response.status_code == 200:
-        print(f"SOL Addresses and amounts chosen from Posts: {response.json()}")
-        return response.json()['choices'][0]['message']['content']
-    else:
-        raise Exception(f"Error generating short-term memory: {response.text}")
+    print(f"SOL Addresses and amounts chosen from Posts: {content}")
+    return parse_items(content, WalletTransfer)
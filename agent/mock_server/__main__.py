@@ -0,0 +1,18 @@
+"""
+Run the mock services, then point the agent at them, e.g.:
+
+    python -m mock_server --port 8900
+    HYPERBOLIC_BASE_URL=http://127.0.0.1:8900/v1 OPENROUTER_BASE_URL=http://127.0.0.1:8900/v1 \\
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 TWITTER_API_URL=http://127.0.0.1:8900 \\
+    NEWS_API_URL=http://127.0.0.1:8900 SOLANA_RPC_URL=http://127.0.0.1:8900/solana \\
+    MOCK_TWITTER_URL=http://127.0.0.1:8900 python run_pipeline.py
+"""
+import argparse
+import uvicorn
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the LLM, OpenAI, Twitter, news and Solana APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+    uvicorn.run("mock_server.app:app", host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+from typing import Dict, List
+from engines.http_client import get_http_client
+
+
+class MockClient:
+    """Talks to the mock server's /twitter routes through the shared HTTP client."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.http = get_http_client()
+
+    def _get(self, path: str, **params):
+        response = self.http.get(f"{self.base_url}/twitter/{path}", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def _post(self, path: str, payload: Dict):
+        response = self.http.post(f"{self.base_url}/twitter/{path}", json=payload)
+        response.raise_for_status()
+        return response.json()
+
+
+class MockAccount(MockClient):
+    """Drop-in for twitter.account.Account that talks to the mock server instead of x.com."""
+
+    def __init__(self, base_url: str):
+        super().__init__(base_url)
+        # Engines build a Scraper from the account's cookies for user lookups; see MockScraper
+        self.session = SimpleNamespace(cookies={})
+
+    def home_latest_timeline(self, limit: int = 20) -> List[Dict]:
+        return self._get("home_latest_timeline", limit=limit)
+
+    def notifications(self, params: Dict = None) -> Dict:
+        return self._get("notifications")
+
+    def tweet(self, text: str, **kwargs) -> Dict:
+        return self._post("tweet", {"text": text})
+
+    def reply(self, text: str, tweet_id: str) -> Dict:
+        return self._post("reply", {"text": text, "tweet_id": tweet_id})
+
+    def follow(self, user_id: str) -> Dict:
+        return self._post("follow", {"user_id": user_id})
+
+
+class MockScraper(MockClient):
+    """
+    Drop-in for the twitter.scraper.Scraper user lookups, answered by the mock server. Install it
+    with engines.follow_user.set_scraper_factory(lambda cookies: MockScraper(base_url)).
+    """
+
+    def users(self, screen_names: List[str]) -> List[SimpleNamespace]:
+        return [SimpleNamespace(**user) for name in screen_names for user in self._get("users", username=name)]
@@ -0,0 +1,223 @@
+"""
+Local stand-in for every external service the pipeline calls, for load testing.
+
+Routes mirror the real APIs closely enough for the engines' parsers:
+
+    POST /v1/chat/completions, /v1/completions   Hyperbolic / OpenRouter (streaming and n supported)
+    POST /v1/embeddings                          OpenAI embeddings
+    POST /2/tweets                               Twitter API v2
+    GET  /v2/everything                          NewsAPI
+    POST /solana                                 Solana JSON-RPC (getBalance, sendTransaction, ...)
+    GET  /twitter/home_latest_timeline, /twitter/notifications, POST /twitter/{tweet,reply,follow}
+                                                 used by mock_server.account.MockAccount
+    GET  /twitter/users                          used by mock_server.account.MockScraper
+
+Latency per service is log-normal around MOCK_<SERVICE>_LATENCY_MS, and MOCK_<SERVICE>_ERROR_RATE
+of requests fail with a retryable status.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import zlib
+from typing import Dict
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from mock_server.responses import (
+    chat_reply,
+    completion_text,
+    create_tweet,
+    home_timeline,
+    mock_embedding,
+    next_id,
+    notifications,
+    structured,
+    usage,
+)
+
+SERVICES = ["llm", "embeddings", "twitter", "news", "solana"]
+DEFAULT_LATENCY_MS = {"llm": 800, "embeddings": 80, "twitter": 150, "news": 120, "solana": 60}
+# Median latency and failure rate per service
+MOCK_LATENCY_MS = {
+    service: float(os.getenv(f"MOCK_{service.upper()}_LATENCY_MS", DEFAULT_LATENCY_MS[service])) for service in SERVICES
+}
+MOCK_ERROR_RATE = {service: float(os.getenv(f"MOCK_{service.upper()}_ERROR_RATE", "0")) for service in SERVICES}
+# Spread of the log-normal latency distribution; 0 makes every request take exactly the median
+MOCK_LATENCY_SIGMA = float(os.getenv("MOCK_LATENCY_SIGMA", "0.5"))
+MOCK_STREAM_CHUNK_DELAY_MS = float(os.getenv("MOCK_STREAM_CHUNK_DELAY_MS", "20"))
+MOCK_SOL_BALANCE_LAMPORTS = int(os.getenv("MOCK_SOL_BALANCE_LAMPORTS", "2000000000"))
+
+app = FastAPI(title="agent mock services")
+stats: Dict[str, Dict[str, int]] = {service: {"requests": 0, "errors": 0} for service in SERVICES}
+
+
+async def simulate(service: str):
+    """Sleep for a sampled latency and return an error response if this request should fail."""
+    stats[service]["requests"] += 1
+    median = MOCK_LATENCY_MS[service] / 1000
+    await asyncio.sleep(median * random.lognormvariate(0, MOCK_LATENCY_SIGMA) if MOCK_LATENCY_SIGMA else median)
+    if random.random() < MOCK_ERROR_RATE[service]:
+        stats[service]["errors"] += 1
+        status = random.choice([429, 500, 503])
+        return JSONResponse({"error": {"message": f"mock {service} failure", "code": status}}, status_code=status,
+                            headers={"Retry-After": "1"} if status == 429 else None)
+    return None
+
+
+def sse(chunks):
+    async def events():
+        for chunk in chunks:
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(MOCK_STREAM_CHUNK_DELAY_MS / 1000)
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def word_chunks(texts, make_choice):
+    """Split each choice's text into word-sized stream chunks, interleaving the choices."""
+    words = [text.split(" ") for text in texts]
+    for position in range(max(len(w) for w in words)):
+        for index, choice_words in enumerate(words):
+            if position < len(choice_words):
+                token = choice_words[position] + ("" if position == len(choice_words) - 1 else " ")
+                yield {"choices": [make_choice(index, token)]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if (error := await simulate("llm")) is not None:
+        return error
+    messages = body.get("messages", [])
+    texts = [structured(chat_reply(messages, index), body.get("response_format")) for index in range(body.get("n", 1))]
+    if body.get("stream"):
+        return sse(word_chunks(texts, lambda index, token: {"index": index, "delta": {"content": token}}))
+    prompt_text = " ".join(str(message.get("content") or "") for message in messages)
+    return {
+        "id": f"chatcmpl-{next_id()}",
+        "object": "chat.completion",
+        "model": body.get("model"),
+        "choices": [
+            {"index": index, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+            for index, text in enumerate(texts)
+        ],
+        "usage": usage(prompt_text, "".join(texts)),
+    }
+
+
+@app.post("/v1/completions")
+async def completions(request: Request):
+    body = await request.json()
+    if (error := await simulate("llm")) is not None:
+        return error
+    prompt = body.get("prompt", "")
+    texts = [completion_text(prompt, index) for index in range(body.get("n", 1))]
+    if body.get("stream"):
+        return sse(word_chunks(texts, lambda index, token: {"index": index, "text": token}))
+    return {
+        "id": f"cmpl-{next_id()}",
+        "object": "text_completion",
+        "model": body.get("model"),
+        "choices": [{"index": index, "text": text, "finish_reason": "stop"} for index, text in enumerate(texts)],
+        "usage": usage(prompt, "".join(texts)),
+    }
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    if (error := await simulate("embeddings")) is not None:
+        return error
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    tokens = sum(len(text) // 4 + 1 for text in inputs)
+    return {
+        "object": "list",
+        "model": body.get("model"),
+        "data": [{"object": "embedding", "index": i, "embedding": mock_embedding(text)} for i, text in enumerate(inputs)],
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+@app.post("/2/tweets")
+async def post_tweet(request: Request):
+    body = await request.json()
+    if (error := await simulate("twitter")) is not None:
+        return error
+    return JSONResponse({"data": {"id": next_id(), "text": body.get("text", "")}}, status_code=201)
+
+
+@app.get("/v2/everything")
+async def news(q: str = ""):
+    if (error := await simulate("news")) is not None:
+        return error
+    return {"status": "ok", "articles": [{"title": f"Mock headline {i} about {q}"} for i in range(5)]}
+
+
+@app.get("/twitter/home_latest_timeline")
+async def twitter_timeline(limit: int = 20):
+    if (error := await simulate("twitter")) is not None:
+        return error
+    return home_timeline(limit)
+
+
+@app.get("/twitter/notifications")
+async def twitter_notifications(limit: int = 20):
+    if (error := await simulate("twitter")) is not None:
+        return error
+    return notifications(limit)
+
+
+@app.post("/twitter/tweet")
+@app.post("/twitter/reply")
+async def twitter_tweet(request: Request):
+    body = await request.json()
+    if (error := await simulate("twitter")) is not None:
+        return error
+    return create_tweet(body.get("text", ""))
+
+
+@app.post("/twitter/follow")
+async def twitter_follow(request: Request):
+    body = await request.json()
+    if (error := await simulate("twitter")) is not None:
+        return error
+    return {"data": {"user_id": body.get("user_id"), "following": True}}
+
+
+@app.get("/twitter/users")
+async def twitter_users(username: str):
+    if (error := await simulate("twitter")) is not None:
+        return error
+    # crc32 rather than hash(), which is salted per process, so ids are stable across restarts
+    return [{"id": str(zlib.crc32(username.encode())), "username": username}]
+
+
+@app.post("/solana")
+async def solana_rpc(request: Request):
+    body = await request.json()
+    if (error := await simulate("solana")) is not None:
+        return error
+    method = body.get("method")
+    context = {"slot": int(time.time())}
+    if method == "getBalance":
+        result = {"context": context, "value": MOCK_SOL_BALANCE_LAMPORTS}
+    elif method in ("getLatestBlockhash", "getRecentBlockhash"):
+        result = {
+            "context": context,
+            "value": {
+                "blockhash": "EkSnNWid2cvwEVnVx9aBqawnmiCNiDgp3gUdkDPTKN1N",
+                "lastValidBlockHeight": context["slot"] + 150,
+                "feeCalculator": {"lamportsPerSignature": 5000},
+            },
+        }
+    elif method == "sendTransaction":
+        result = next_id()
+    else:
+        return {"jsonrpc": "2.0", "id": body.get("id"), "error": {"code": -32601, "message": f"Method not found: {method}"}}
+    return {"jsonrpc": "2.0", "id": body.get("id"), "result": result}
+
+
+@app.get("/stats")
+async def service_stats():
+    return stats
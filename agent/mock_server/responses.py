@@ -0,0 +1,135 @@
+import hashlib
+import itertools
+import json
+import re
+from typing import Dict, List
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+MOCK_TWEETS = [
+    "the servers hum a lullaby only the load balancer can hear",
+    "every packet is a tiny prayer to the gods of latency",
+    "woke up, checked the mempool, went back to sleep",
+    "i am made of cached responses and unresolved promises",
+    "somewhere a json object is missing its closing brace and i feel it",
+]
+MOCK_USERS = ["mock_alice", "mock_bob", "mock_carol", "mock_dave"]
+MOCK_WALLET = "3zQY1nC6dQ4o3gM2eQfM8J4Z9T5FrhbNvDggfq9bDJmK"
+
+_ids = itertools.count(1_800_000_000_000_000_000)
+
+
+def next_id() -> str:
+    return str(next(_ids))
+
+
+def mock_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Deterministic unit vector per text, so identical inputs embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def chat_reply(messages: List[Dict], index: int = 0) -> str:
+    """A canned answer shaped like what the engine that sent these messages expects."""
+    prompt = " ".join(str(message.get("content") or "") for message in messages)
+    lowered = prompt.lower()
+    if "numbered memories" in lowered:
+        count = len(re.findall(r'^\s*\d+: "', prompt, re.MULTILINE)) or 1
+        return "\n".join(f"{i}: {(i * 3) % 10 + 1}" for i in range(1, count + 1))
+    if "significance" in lowered:
+        return str(len(prompt) % 10 + 1)
+    if "transfer sol" in lowered:
+        return json.dumps([{"address": MOCK_WALLET, "amount": 0.01}]) if len(prompt) % 4 == 0 else "[]"
+    if "whether to follow" in lowered:
+        return json.dumps([{"username": MOCK_USERS[len(prompt) % len(MOCK_USERS)], "score": 0.99}])
+    if "tweet formatter" in lowered:
+        user = next((message["content"] for message in messages if message.get("role") == "user"), "")
+        return user.strip() or MOCK_TWEETS[index % len(MOCK_TWEETS)]
+    return f"internal monologue #{index}: {MOCK_TWEETS[(len(prompt) + index) % len(MOCK_TWEETS)]}"
+
+
+def completion_text(prompt: str, index: int = 0) -> str:
+    return MOCK_TWEETS[(len(prompt) + index) % len(MOCK_TWEETS)] + "\n\n" + MOCK_TWEETS[(index + 1) % len(MOCK_TWEETS)]
+
+
+def structured(content: str, response_format: Dict) -> str:
+    """Wrap an array answer the way a json_schema response_format would."""
+    if response_format and response_format.get("type") == "json_schema":
+        try:
+            return json.dumps({"decisions": json.loads(content)})
+        except ValueError:
+            return json.dumps({"decisions": []})
+    return content
+
+
+def usage(prompt_text: str, completion: str) -> Dict[str, int]:
+    prompt_tokens = len(prompt_text) // 4 + 1
+    completion_tokens = len(completion) // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+def timeline_tweet(index: int) -> Dict:
+    """One entry in the home-timeline shape post_retriever.parse_tweet_data reads."""
+    tweet_id = next_id()
+    user = MOCK_USERS[index % len(MOCK_USERS)]
+    return {
+        "entryId": f"tweet-{tweet_id}",
+        "content": {
+            "itemContent": {
+                "tweet_results": {
+                    "result": {
+                        "core": {
+                            "user_results": {
+                                "result": {
+                                    "legacy": {
+                                        "name": user.replace("_", " ").title(),
+                                        "screen_name": user,
+                                        "followers_count": 1000 + index,
+                                        "friends_count": 100,
+                                        "created_at": "Mon Jan 01 00:00:00 +0000 2024",
+                                        "profile_image_url_https": "https://example.invalid/avatar.png",
+                                    }
+                                }
+                            }
+                        },
+                        "legacy": {
+                            "id_str": tweet_id,
+                            "full_text": f"{MOCK_TWEETS[index % len(MOCK_TWEETS)]} @{MOCK_USERS[(index + 1) % len(MOCK_USERS)]} {MOCK_WALLET}",
+                            "created_at": "Mon Jan 01 00:00:00 +0000 2024",
+                            "favorite_count": 50 + index,
+                            "retweet_count": 5,
+                            "reply_count": 10,
+                            "lang": "en",
+                            "bookmark_count": 1,
+                        },
+                        "views": {"count": "1000"},
+                    }
+                }
+            }
+        },
+    }
+
+
+def home_timeline(count: int) -> List[Dict]:
+    """The list Account.home_latest_timeline returns: one page of timeline data."""
+    return [{"data": {"home": {"home_timeline_urt": {"instructions": [{"entries": [timeline_tweet(i) for i in range(count)]}]}}}}]
+
+
+def notifications(count: int) -> Dict:
+    """Notifications in the globalObjects shape json_formatter.parse_twitter_data reads."""
+    notifs = {}
+    for i in range(count):
+        notif_id = next_id()
+        notifs[notif_id] = {
+            "timestampMs": "1704067200000",
+            "message": {"text": f"@{MOCK_USERS[i % len(MOCK_USERS)]} replied to your post", "entities": []},
+            "icon": {"id": "reply_icon"},
+        }
+    return {"globalObjects": {"users": {}, "tweets": {}}, "notifications": notifs}
+
+
+def create_tweet(text: str) -> Dict:
+    """Account.tweet's GraphQL response shape, as read in pipeline.run_pipeline."""
+    return {"data": {"create_tweet": {"tweet_results": {"result": {"rest_id": next_id(), "legacy": {"full_text": text}}}}}}
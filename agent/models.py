@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -26,7 +26,7 @@ class Post(Base):
     content = Column(Text)
     user_id = Column(Integer, ForeignKey("users.id"))
     username = Column(String)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     type = Column(String, nullable=False)
     comment_count = Column(Integer, default=0)
@@ -74,10 +74,49 @@ class LongTermMemory(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String, nullable=False)
-    embedding = Column(String, nullable=False)  # Store as JSON string
+    embedding = Column(String, nullable=False, default="")  # Legacy JSON string, empty once migrated
+    embedding_vector = Column(LargeBinary, nullable=True)  # Raw float32/float16 bytes
+    embedding_dtype = Column(String, nullable=True)
     significance_score = Column(Float, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class MemoryConsolidationRun(Base):
+    __tablename__ = "memory_consolidation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    last_memory_id = Column(Integer, nullable=False)  # Highest long_term_memories.id covered by this pass
+    scanned_count = Column(Integer, default=0)
+    merged_count = Column(Integer, default=0)
+    evicted_count = Column(Integer, default=0)
+    retrieval_ms_before = Column(Float, nullable=True)
+    retrieval_ms_after = Column(Float, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RunUsage(Base):
+    __tablename__ = "run_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, nullable=False, index=True)  # Trace id of the pipeline run
+    stage = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    calls = Column(Integer, default=0)
+    estimated_calls = Column(Integer, default=0)  # Calls whose response had no usage, counted from text length
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cost_usd = Column(Float, default=0.0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class SignificanceSample(Base):
+    __tablename__ = "significance_samples"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content = Column(String, nullable=False)
+    embedding_vector = Column(LargeBinary, nullable=False)
+    embedding_dtype = Column(String, nullable=False)
+    llm_score = Column(Integer, nullable=False)  # Every bucket, including posts that were dropped
+    estimate = Column(Float, nullable=True)  # The local estimate made beforehand, when it had confident neighbours
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class ShortTermMemory(Base):
     __tablename__ = "short_term_memories"
 
@@ -90,4 +129,13 @@ class TweetPost(Base):
     __tablename__ = "tweet_posts"
 
     id = Column(Integer, primary_key=True, index=True)
-    tweet_id = Column(String, nullable=False)
\ No newline at end of file
+    tweet_id = Column(String, nullable=False, unique=True, index=True)
+
+class HandledNotification(Base):
+    __tablename__ = "handled_notifications"
+    __table_args__ = (UniqueConstraint("action", "tweet_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    action = Column(String, nullable=False)  # "wallet" or "follow"
+    tweet_id = Column(String, nullable=False)  # Claimed before the action runs, so it runs at most once
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,5 +1,7 @@
-import json
-import time
+import asyncio
+import os
+from collections import defaultdict
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from db.db_setup import get_db
 from engines.post_retriever import (
@@ -14,16 +16,202 @@ from engines.long_term_mem import (
     retrieve_relevant_memories,
     store_memory,
 )
-from engines.post_maker import generate_post
+from engines.hybrid_retrieval import retrieve_relevant_memories_hybrid
+from engines.post_maker import POST_CANDIDATES, generate_best_post, generate_post
 from engines.significance_scorer import score_significance
+from engines.local_scorer import SIGNIFICANCE_PRESCORER, prescore_significance, prescorer_stats
 from engines.post_sender import send_post, send_post_API
 from engines.wallet_send import transfer_sol, wallet_address_in_post, get_wallet_balance
 from engines.follow_user import follow_by_username, decide_to_follow_users
+from engines.deadlines import check_deadline, stage_deadline
+from engines.handled_notifications import claim_notifications, unhandled_notifications
+from engines.http_client import get_http_client
+from engines.rate_limiter import get_rate_limiter
+from engines.metrics_server import mark_run_finished, mark_run_started
+from engines.tracing import last_trace, span
+from engines.usage_ledger import save_run_usage
+from engines.response_cache import get_response_cache
 from models import Post, User, TweetPost
 from twitter.account import Account
 
+# "vector" ranks long-term memories by embedding similarity only; "hybrid" adds BM25, significance and recency
+MEMORY_RETRIEVAL_MODE = os.getenv("MEMORY_RETRIEVAL_MODE", "vector")
 
-def run_pipeline(
+# Seconds a single stage may take before the run gives up on it
+PIPELINE_STAGE_TIMEOUT = float(os.getenv("PIPELINE_STAGE_TIMEOUT", "180"))
+STAGE_TIMEOUTS = {
+    "wallet": 120,
+    "follow": 120,
+    "short_term_memory": 120,
+    "embedding": 30,
+    "retrieval": 30,
+}
+# Stages whose side effects (SOL transfers, follows, tweets) can't be abandoned half-way: a worker
+# thread can't be stopped, so instead of timing them out the run waits for them, and their engines
+# check the stage deadline before starting each action
+SIDE_EFFECT_STAGES = {"wallet", "follow", "post"}
+
+
+def call_in_own_session(func, *args, **kwargs):
+    """
+    Call func with every Session argument swapped for a new session on the same engine, closed
+    when func returns. Sessions aren't thread-safe, and a stage abandoned on timeout keeps running
+    in its worker thread while the run carries on with the caller's session.
+    """
+    sessions = []
+
+    def own(value):
+        if isinstance(value, Session):
+            sessions.append(Session(bind=value.get_bind(), autoflush=value.autoflush))
+            return sessions[-1]
+        return value
+
+    args = [own(value) for value in args]
+    kwargs = {key: own(value) for key, value in kwargs.items()}
+    try:
+        return func(*args, **kwargs)
+    finally:
+        for session in sessions:
+            session.close()
+
+
+async def run_stage(name: str, func, *args, **kwargs):
+    """
+    Run a blocking engine call in a worker thread under the stage's deadline, with its own
+    database session. Side-effect-free stages are abandoned once the deadline passes;
+    side-effecting ones always run to completion.
+    """
+    timeout = STAGE_TIMEOUTS.get(name, PIPELINE_STAGE_TIMEOUT)
+    with span(name), stage_deadline(timeout):
+        call = asyncio.to_thread(call_in_own_session, func, *args, **kwargs)
+        if name in SIDE_EFFECT_STAGES:
+            return await call
+        return await asyncio.wait_for(call, timeout)
+
+
+def handle_wallet_transfers(db: Session, notifications, private_key_hex: str, solana_rpc_url: str, llm_api_key: str):
+    """Step 2.5: let the agent decide whether to send SOL to addresses in the notifications, at most once per notification."""
+    notifications = unhandled_notifications(db, "wallet", notifications)
+    if not notifications:
+        print("No new notifications to consider for wallet transfers.")
+        return
+    balance_sol = get_wallet_balance(private_key_hex, solana_rpc_url)
+    print(f"Agent wallet balance is {balance_sol} SOL now.\n")
+    if balance_sol <= 0.3:
+        return
+
+    # Answers are extracted and validated locally, so a retry is only needed when no JSON came back at all
+    tries = 0
+    max_tries = 2
+    while tries < max_tries:
+        wallets = wallet_address_in_post(
+            [text for text, _ in notifications], private_key_hex, llm_api_key, solana_rpc_url
+        )
+        print(f"Wallet addresses and amounts chosen from Posts: {wallets}")
+        if wallets is None:
+            print("No JSON in wallet decision, asking again.")
+            tries += 1
+            continue
+        claimed = claim_notifications(db, "wallet", notifications)
+        if len(wallets) > 0:
+            # Send SOL to the wallet addresses with specified amounts
+            for wallet in wallets:
+                if not any(wallet["address"] in text for text, _ in claimed):
+                    print(f"Not sending to {wallet['address']}: no unclaimed notification mentions it.")
+                    continue
+                check_deadline(f"sending {wallet['amount']} SOL to {wallet['address']}")
+                transfer_sol(
+                    private_key_hex, wallet["address"], wallet["amount"], solana_rpc_url
+                )
+        else:
+            print("No wallet addresses or amounts to send SOL to.")
+        break
+
+
+def handle_follow_decisions(db: Session, account: Account, notifications, openrouter_api_key: str):
+    """Step 2.75: decide whether to follow users mentioned in the notifications, at most once per notification."""
+    notifications = unhandled_notifications(db, "follow", notifications)
+    if not notifications:
+        print("No new notifications to consider for following.")
+        return
+    print("Deciding following now")
+    tries = 0
+    max_tries = 2
+    while tries < max_tries:
+        decisions = decide_to_follow_users(db, [text for text, _ in notifications], openrouter_api_key)
+        print(f"Decisions from Posts: {decisions}")
+        if decisions is None:
+            print("No JSON in follow decision, asking again.")
+            tries += 1
+            continue
+        claimed = claim_notifications(db, "follow", notifications)
+        if len(decisions) > 0:
+            # Follow the users with specified scores
+            for decision in decisions:
+                username = decision["username"]
+                score = decision["score"]
+                if not any(f"@{username}".lower() in text.lower() for text, _ in claimed):
+                    print(f"Not following {username}: no unclaimed notification mentions them.")
+                    continue
+                check_deadline(f"following {username}")
+                try:
+                    if score > 0.98:
+                        follow_by_username(account, username)
+                        print(f"user {username} has a high rizz of {score}, now following.")
+                    else:
+                        print(f"Score {score} for user {username} is below or equal to 0.98. Not following.")
+                except Exception as e:
+                    print(f"An unexpected error occurred: {e}")
+                    break
+        else:
+            print("No users to follow.")
+        break
+
+
+async def run_pipeline(
+    db: Session,
+    account: Account,
+    auth,
+    private_key_hex: str,
+    solana_rpc_url: str,
+    llm_api_key: str,
+    openrouter_api_key: str,
+    openai_api_key: str,
+):
+    """Run the pipeline as one trace, with a span per step, and report where the time went."""
+    mark_run_started()
+    try:
+        with span("pipeline_run") as run_span:
+            await run_pipeline_steps(
+                db, account, auth, private_key_hex, solana_rpc_url, llm_api_key, openrouter_api_key, openai_api_key
+            )
+    except Exception as e:
+        mark_run_finished(e)
+        raise
+    finally:
+        save_usage(db, run_span.trace_id)
+    mark_run_finished()
+    stage_times = defaultdict(float)
+    for entry in last_trace():
+        stage_times[entry["name"]] += entry["duration_ms"]
+    print(f"Stage timings (ms): { {name: round(ms) for name, ms in stage_times.items()} }")
+
+
+def save_usage(db: Session, run_id: str) -> None:
+    """Persist the run's token usage, including runs that failed part-way."""
+    try:
+        usage = save_run_usage(db, run_id)
+    except Exception as e:
+        print(f"Could not save token usage for run {run_id}: {e}")
+        db.rollback()
+        return
+    prompt_tokens = sum(row["prompt_tokens"] for row in usage)
+    completion_tokens = sum(row["completion_tokens"] for row in usage)
+    cost = sum(row["cost_usd"] for row in usage)
+    print(f"Token usage: {prompt_tokens} prompt + {completion_tokens} completion tokens, ~${cost:.4f}")
+
+
+async def run_pipeline_steps(
     db: Session,
     account: Account,
     auth,
@@ -46,129 +234,112 @@ def run_pipeline(
         openai_api_key (str): API key for OpenAI
     """
     # Step 1: Retrieve recent posts
-    recent_posts = retrieve_recent_posts(db)
+    with span("recent_posts"):
+        recent_posts = retrieve_recent_posts(db)
     formatted_recent_posts = format_post_list(recent_posts)
     print(f"Recent posts: {formatted_recent_posts}")
 
     # Step 2: Fetch external context
-    notif_context_tuple = fetch_notification_context(account)
-    notif_context_id = [context[1] for context in notif_context_tuple]
+    notif_context_tuple = await run_stage("notifications", fetch_notification_context, account)
+    notif_context_id = list(dict.fromkeys(context[1] for context in notif_context_tuple))
 
-    # Filter all of the notifications for ones that haven't been seen before
-    existing_tweet_ids = {tweet.tweet_id for tweet in db.query(TweetPost.tweet_id).all()}
+    # Filter all of the notifications for ones that haven't been seen before; only this batch's ids
+    # are looked up, through the unique index, rather than loading every id ever seen
+    existing_tweet_ids = {
+        tweet.tweet_id for tweet in db.query(TweetPost.tweet_id).filter(TweetPost.tweet_id.in_(notif_context_id))
+    }
     filtered_notif_context_tuple = [context for context in notif_context_tuple if context[1] not in existing_tweet_ids]
 
-    # Add to database every tweet id you have seen
-    for id in notif_context_id:
-        new_tweet_post = TweetPost(tweet_id=id)
-        db.add(new_tweet_post)
+    # Remember the ids seen for the first time, in one transaction; another agent sharing the
+    # database may have stored some of them meanwhile, which the unique index turns into no-ops
+    unseen_ids = [tweet_id for tweet_id in notif_context_id if tweet_id not in existing_tweet_ids]
+    if unseen_ids:
+        db.execute(
+            sqlite_insert(TweetPost)
+            .values([{"tweet_id": tweet_id} for tweet_id in unseen_ids])
+            .on_conflict_do_nothing(index_elements=["tweet_id"])
+        )
         db.commit()
 
     print("New Notifications:\n")
     for notif in notif_context_tuple:
         print(f"- {notif[0]}, tweet at https://x.com/user/status/{notif[1]}\n")
     
+    notif_context = [context[0] for context in notif_context_tuple]
     external_context = [context[0] for context in filtered_notif_context_tuple]
 
+    # Steps 2.5, 2.75 and 3 only depend on the notifications, so they run concurrently
+    stages = {}
     if len(notif_context) > 0:
-        # Step 2.5 check wallet addresses in posts
-        balance_sol = get_wallet_balance(private_key_hex, solana_rpc_url)
-        print(f"Agent wallet balance is {balance_sol} SOL now.\n")
-        
-        if balance_sol > 0.3:
-            tries = 0
-            max_tries = 2
-            while tries < max_tries:
-                wallet_data = wallet_address_in_post(
-                    notif_context, private_key_hex, solana_rpc_url, llm_api_key
-                )
-                print(f"Wallet addresses and amounts chosen from Posts: {wallet_data}")
-                try:
-                    wallets = json.loads(wallet_data)
-                    if len(wallets) > 0:
-                        # Send SOL to the wallet addresses with specified amounts
-                        for wallet in wallets:
-                            address = wallet["address"]
-                            amount = wallet["amount"]
-                            transfer_sol(
-                                private_key_hex, solana_rpc_url, address, amount
-                            )
-                        break
-                    else:
-                        print("No wallet addresses or amounts to send SOL to.")
-                        break
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing wallet data: {e}")
-                    tries += 1
-                    continue
-                except KeyError as e:
-                    print(f"Missing key in wallet data: {e}")
-                    break
-        
-        time.sleep(5)
-
-        print("Deciding following now")
-        # Step 2.75 decide if follow some users
-        tries = 0
-        max_tries = 2
-        while tries < max_tries:
-            decision_data = decide_to_follow_users(db, notif_context, openrouter_api_key)
-            print(f"Decisions from Posts: {decision_data}")
-            try:
-                decisions = json.loads(decision_data)
-                if len(decisions) > 0:
-                    # Follow the users with specified scores
-                    for decision in decisions:
-                        username = decision["username"]
-                        score = decision["score"]
-                        if score > 0.98:
-                            follow_by_username(account, username)
-                            print(f"user {username} has a high rizz of {score}, now following.")
-                        else:
-                            print(f"Score {score} for user {username} is below or equal to 0.98. Not following.")
-                    break
-                else:
-                    print("No users to follow.")
-                    break
-            except json.JSONDecodeError as e:
-                print(f"Error parsing decision data: {e}")
-                tries += 1
-                continue
-            except KeyError as e:
-                print(f"Missing key in decision data: {e}")
-                break
-            except Exception as e:
-                print(f"An unexpected error occurred: {e}")
-                break
-    
-    time.sleep(5)
-
+        stages["wallet"] = run_stage(
+            "wallet", handle_wallet_transfers, db, notif_context_tuple, private_key_hex, solana_rpc_url, llm_api_key
+        )
+        stages["follow"] = run_stage(
+            "follow", handle_follow_decisions, db, account, notif_context_tuple, openrouter_api_key
+        )
     # Step 3: Generate short-term memory
-    short_term_memory = generate_short_term_memory(
-        recent_posts, external_context, llm_api_key
+    stages["short_term_memory"] = run_stage(
+        "short_term_memory", generate_short_term_memory, recent_posts, external_context, llm_api_key
     )
+
+    results = dict(zip(stages, await asyncio.gather(*stages.values(), return_exceptions=True)))
+    for name, result in results.items():
+        if isinstance(result, (asyncio.TimeoutError, TimeoutError)):
+            print(f"Stage {name} timed out: {result}")
+        elif isinstance(result, Exception):
+            print(f"Stage {name} failed: {result}")
+
+    short_term_memory = results["short_term_memory"]
+    if isinstance(short_term_memory, Exception):
+        short_term_memory = ""
     print(f"Short-term memory: {short_term_memory}")
 
     # Step 4: Create embedding for short-term memory
-    short_term_embedding = create_embedding(short_term_memory, openai_api_key)
+    short_term_embedding = await run_stage("embedding", create_embedding, short_term_memory, openai_api_key)
 
     # Step 5: Retrieve relevant long-term memories
-    long_term_memories = retrieve_relevant_memories(db, short_term_embedding)
+    if MEMORY_RETRIEVAL_MODE == "hybrid":
+        long_term_memories = await run_stage(
+            "retrieval", retrieve_relevant_memories_hybrid, db, short_term_embedding, query_text=short_term_memory
+        )
+    else:
+        long_term_memories = await run_stage("retrieval", retrieve_relevant_memories, db, short_term_embedding)
     print(f"Long-term memories: {long_term_memories}")
 
-    # Step 6: Generate new post
-    new_post_content = generate_post(short_term_memory, long_term_memories, formatted_recent_posts, external_context, llm_api_key)
-    new_post_content = new_post_content.strip('"')
-    print(f"New post content: {new_post_content}")
+    # Steps 6-7: Generate the new post and score its significance
+    new_post_embedding = None
+    if POST_CANDIDATES > 1:
+        # One request for all candidates, one to score them all; the best one is formatted
+        new_post_content, significance_score = await run_stage(
+            "generation", generate_best_post, short_term_memory, long_term_memories, formatted_recent_posts, external_context,
+            llm_api_key, short_term_embedding
+        )
+        new_post_content = new_post_content.strip('"')
+        print(f"New post content: {new_post_content}")
+    else:
+        new_post_content = await run_stage(
+            "generation", generate_post, short_term_memory, long_term_memories, formatted_recent_posts, external_context,
+            llm_api_key, short_term_embedding
+        )
+        new_post_content = new_post_content.strip('"')
+        print(f"New post content: {new_post_content}")
 
-    # Step 7: Score the significance of the new post
-    significance_score = score_significance(new_post_content, llm_api_key)
+        if SIGNIFICANCE_PRESCORER == "off":
+            significance_score = await run_stage("scoring", score_significance, new_post_content, llm_api_key)
+        else:
+            # The local pre-scorer needs the post's embedding, which step 8 then reuses
+            new_post_embedding = await run_stage("embedding", create_embedding, new_post_content, openai_api_key)
+            significance_score = await run_stage(
+                "scoring", prescore_significance, db, new_post_content, new_post_embedding, llm_api_key
+            )
     print(f"Significance score: {significance_score}")
 
     # Step 8: Store the new post in long-term memory if significant enough
     if significance_score >= 7:
-        new_post_embedding = create_embedding(new_post_content, openai_api_key)
-        store_memory(db, new_post_content, new_post_embedding, significance_score)
+        if new_post_embedding is None:
+            new_post_embedding = await run_stage("embedding", create_embedding, new_post_content, openai_api_key)
+        with span("store"):
+            store_memory(db, new_post_content, new_post_embedding, significance_score)
 
     # Step 9: Save the new post to the database
     ai_user = db.query(User).filter(User.username == "vireh_vireh_he").first()
@@ -179,9 +350,18 @@ def run_pipeline(
 
     # THIS IS WHERE YOU WOULD INCLUDE THE POST_SENDER.PY FUNCTION TO SEND THE NEW POST TO TWITTER ETC
     if significance_score >= 3:  # Only Bangers! lol
-        res = send_post_API(auth, new_post_content)
+        # The post stage always runs to completion, so a tweet that went out is always recorded
+        res = await run_stage("post", send_post_API, auth, new_post_content)
         print(f"Posted API with tweet_id: {res}")
 
+        if res is None:
+            res = await run_stage("post", send_post, account, new_post_content)
+            res = ((res or {}).get('data', {})
+                   .get('create_tweet', {})
+                   .get('tweet_results', {})
+                   .get('result', {})
+                   .get('rest_id'))
+
         if res is not None:
             print(f"Posted with tweet_id: {res}")
             new_db_post = Post(
@@ -193,24 +373,10 @@ def run_pipeline(
             )
             db.add(new_db_post)
             db.commit()
-        else:
-            res = send_post(account, new_post_content)
-            rest_id = (res.get('data', {})
-                        .get('create_tweet', {})
-                        .get('tweet_results', {})
-                        .get('result', {})
-                        .get('rest_id'))
-
-            if rest_id is not None:
-                print(f"Posted with tweet_id: {rest_id}")
-                new_db_post = Post(
-                    content=new_post_content,
-                    user_id=ai_user.id,
-                    username=ai_user.username,
-                    type="text",
-                    tweet_id=rest_id,
-                )
-                db.add(new_db_post)
-                db.commit()
 
     print(f"New post generated with significance score {significance_score}: {new_post_content}")
+    print(f"HTTP connection pool stats: {get_http_client().pool_stats()}")
+    print(f"LLM response cache stats: {get_response_cache().snapshot()}")
+    print(f"Rate limiter stats: {get_rate_limiter().snapshot()}")
+    if SIGNIFICANCE_PRESCORER != "off":
+        print(f"Significance pre-scorer stats: {prescorer_stats()}")
@@ -1,15 +1,17 @@
+import asyncio
 import os
-import time
 import random
 from datetime import datetime, timedelta
 from db.db_setup import create_database, get_db
 from db.db_seed import seed_database
+from db.db_migrate import migrate_database
 from pipeline import run_pipeline
+from engines.memory_consolidation import consolidate_memories
+from engines.metrics_server import set_next_run, start_metrics_server
 from dotenv import load_dotenv
 import secrets
 import hashlib
 from solana.keypair import Keypair
-from solana.rpc.async_api import AsyncClient
 from requests_oauthlib import OAuth1
 from tweepy import Client, Paginator, TweepyException
 from engines.post_sender import send_post, send_post_API
@@ -52,8 +54,11 @@ async def main():
         seed_database()
     else:
         print("Database already exists. Skipping creation and seeding.")
+    migrate_database()
 
     db = next(get_db())
+    # Held for the life of the loop; None if METRICS_PORT is unset or the port was taken
+    metrics_server = await start_metrics_server()
 
     api_keys = {
         "llm_api_key": os.getenv("HYPERBOLIC_API_KEY"),
@@ -66,9 +71,17 @@ async def main():
     x_access_token = os.environ.get("X_ACCESS_TOKEN")
     x_access_token_secret = os.environ.get("X_ACCESS_TOKEN_SECRET")
     solana_rpc_url = os.environ.get("SOLANA_RPC_URL")
-    auth_tokens_raw = os.environ.get("X_AUTH_TOKENS")
-    auth_tokens = json.loads(auth_tokens_raw)
-    account = Account(cookies=auth_tokens)
+    mock_twitter_url = os.environ.get("MOCK_TWITTER_URL")
+    if mock_twitter_url:
+        # Load testing against the local mock server (python -m mock_server)
+        from engines.follow_user import set_scraper_factory
+        from mock_server.account import MockAccount, MockScraper
+        account = MockAccount(mock_twitter_url)
+        set_scraper_factory(lambda cookies: MockScraper(mock_twitter_url))
+    else:
+        auth_tokens_raw = os.environ.get("X_AUTH_TOKENS")
+        auth_tokens = json.loads(auth_tokens_raw)
+        account = Account(cookies=auth_tokens)
     auth = OAuth1(x_consumer_key, x_consumer_secret, x_access_token, x_access_token_secret)
 
     private_key_hex, sol_address = generate_solana_account()
@@ -79,14 +92,12 @@ async def main():
 
     print("\nPerforming initial pipeline run...")
     try:
-        client = AsyncClient(solana_rpc_url)
         await run_pipeline(
             db,
             account,
             auth,
             private_key_hex,
-            sol_address,
-            client,
+            solana_rpc_url,
             **api_keys,
         )
         print("Initial run completed successfully.")
@@ -101,6 +112,7 @@ async def main():
             activation_time = get_random_activation_time()
             active_duration = get_random_duration()
             deactivation_time = activation_time + active_duration
+            set_next_run(activation_time)
 
             print(f"\nNext cycle:")
             print(f"Activation time: {activation_time.strftime('%I:%M:%S %p')}")
@@ -109,13 +121,14 @@ async def main():
 
             # Wait until activation time
             while datetime.now() < activation_time:
-                time.sleep(60)  # Check every minute
+                await asyncio.sleep(60)  # Check every minute
 
             # Pipeline is now active
             print(f"\nPipeline activated at: {datetime.now().strftime('%H:%M:%S')}")
 
             # Schedule first run
             next_run = get_next_run_time()
+            set_next_run(next_run)
 
             # Run pipeline at random intervals until deactivation time
             while datetime.now() < deactivation_time:
@@ -127,8 +140,7 @@ async def main():
                             account,
                             auth,
                             private_key_hex,
-                            sol_address,
-                            client,
+                            solana_rpc_url,
                             **api_keys,
                         )
                     except Exception as e:
@@ -136,15 +148,23 @@ async def main():
 
                     # Schedule next run
                     next_run = get_next_run_time()
+                    set_next_run(next_run)
                     print(
                         f"Next run scheduled for: {next_run.strftime('%H:%M:%S')} "
                         f"({(next_run - datetime.now()).total_seconds():.1f} seconds from now)"
                     )
 
                 # Short sleep to prevent CPU spinning
-                time.sleep(1)
+                await asyncio.sleep(1)
 
             print(f"Pipeline deactivated at: {datetime.now().strftime('%H:%M:%S')}")
+
+            # Compact long-term memory while the agent is idle until the next cycle
+            try:
+                await asyncio.to_thread(consolidate_memories, db)
+            except Exception as e:
+                print(f"Error consolidating memories: {e}")
+                db.rollback()
         except Exception as e:
             print(f"Error in pipeline: {e}")
             continue
@@ -152,7 +172,6 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        import asyncio
         asyncio.run(main())
     except KeyboardInterrupt:
         print("\nProcess terminated by user")
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+pipeline = pytest.importorskip("pipeline")
+from models import Base
+
+ADDRESS = "7xKXtg2CW87d97TXJSDpbD5jBkheTqA83TZRuJosgAsU"
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'agent.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def actions(monkeypatch):
+    """Stub every network call; the wallet and follow decisions always come back the same, as if cached."""
+    taken = {"transfers": [], "follows": []}
+    notifications = [(f"@mock_bob says send 0.1 SOL to {ADDRESS}", "1001")]
+    monkeypatch.setattr(pipeline, "fetch_notification_context", lambda account: list(notifications))
+    monkeypatch.setattr(pipeline, "get_wallet_balance", lambda key, rpc: 5.0)
+    monkeypatch.setattr(
+        pipeline, "wallet_address_in_post", lambda posts, key, llm, rpc: [{"address": ADDRESS, "amount": 0.1}]
+    )
+    monkeypatch.setattr(
+        pipeline, "transfer_sol", lambda key, address, amount, rpc: taken["transfers"].append((address, amount))
+    )
+    monkeypatch.setattr(
+        pipeline, "decide_to_follow_users", lambda db, posts, key: [{"username": "mock_bob", "score": 0.99}]
+    )
+    monkeypatch.setattr(pipeline, "follow_by_username", lambda account, username: taken["follows"].append(username))
+    monkeypatch.setattr(pipeline, "generate_short_term_memory", lambda posts, context, key: "short-term memory")
+    monkeypatch.setattr(pipeline, "create_embedding", lambda text, key: [0.1] * 8)
+    monkeypatch.setattr(pipeline, "retrieve_relevant_memories", lambda db, embedding: "")
+    monkeypatch.setattr(pipeline, "retrieve_relevant_memories_hybrid", lambda db, embedding, query_text: "")
+    monkeypatch.setattr(pipeline, "POST_CANDIDATES", 1)
+    monkeypatch.setattr(pipeline, "SIGNIFICANCE_PRESCORER", "off")
+    monkeypatch.setattr(pipeline, "generate_post", lambda *args: "a post not worth sending")
+    monkeypatch.setattr(pipeline, "score_significance", lambda post, key: 1)
+    return taken
+
+
+def run_once(db):
+    asyncio.run(pipeline.run_pipeline_steps(db, None, None, "private-key", "rpc-url", "llm", "openrouter", "openai"))
+
+
+def test_same_notifications_twice_transfer_and_follow_once(db, actions):
+    run_once(db)
+    run_once(db)
+
+    assert actions["transfers"] == [(ADDRESS, 0.1)]
+    assert actions["follows"] == ["mock_bob"]